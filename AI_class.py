@@ -1,8 +1,10 @@
-from random import random, shuffle
+from simulation_context import random, shuffle
 import numpy as np
 import Choice_class as ch
 from functools import partial
 from Spell_class import spell
+from horde import representatives
+from Error_class import *
 
 if __name__ == '__main__':
     from Entity_class import entity
@@ -47,7 +49,7 @@ class AI:
 
     def do_your_turn(self,fight):
         player = self.player
-        self.allies = [x for x in fight if x.team == player.team and x.state != -1]       #which allies
+        self.allies = player.state_table.allies_left(fight, player.team)       #which allies
         self.dying_allies = [i for i in self.allies if i.state == 0]     #who is dying
 
         #stand up if prone
@@ -83,7 +85,7 @@ class AI:
         if player.is_shape_changed == False:
         #--------Evaluate Choices
             while (player.action == 1 or player.bonus_action == 1) and player.state == 1:
-                EnemiesConscious = [x for x in fight if x.state == 1 and x.team != player.team]
+                EnemiesConscious = player.state_table.enemies_left(fight, player.team)
                 if len(EnemiesConscious) == 0:
                     player.DM.say('All enemies defeated', True)
                     return #nothing left to do
@@ -100,10 +102,9 @@ class AI:
                 if sum(ChoiceScores) == 0:
                     rules = [player.bonus_action == 1 and player.action == 1,
                         player.attack_counter > 0,
-                        len([x for x in fight if x.team != player.team and x.state == 1]) == 0]
+                        len(player.state_table.enemies_left(fight, player.team)) == 0]
                     if all(rules):
-                        player.DM.say(player.name + ' count not decide what to do!', True)
-                        quit()
+                        raise DecisionError(player.name + ' count not decide what to do!')
                     return
 
         #------------Still in Wild Shape
@@ -138,11 +139,9 @@ class AI:
         #This can happen for spells that enable a choice, via their token mybe
         #It checks for a list of Choices that are expected to be added and removed, does not work for others
         if newChoice not in self.conditionalChoicesList:
-            print(self.player + ' tried to add a choice (' + str(newChoice) + ') from AI that is not conditional')
-            quit()
+            raise DecisionError(self.player.name + ' tried to add a choice (' + str(newChoice) + ') from AI that is not conditional')
         if newChoice in self.Choices:
-            print(self.player + ' tried to add a choice (' + str(newChoice) + ') to AI that is already in Choices')
-            quit()
+            raise DecisionError(self.player.name + ' tried to add a choice (' + str(newChoice) + ') to AI that is already in Choices')
         self.Choices.append(newChoice)
 
     def remove_choice(self, oldChoice):
@@ -150,11 +149,9 @@ class AI:
         #This can happen for spells that enable a choice, if their token is resolved
         #It checks for a list of Choices that are expected to be added and removed, does not work for others
         if oldChoice not in self.conditionalChoicesList:
-            print(self.player + ' tried to remove a choice (' + str(oldChoice) + ') from AI that is not conditional')
-            quit()
+            raise DecisionError(self.player.name + ' tried to remove a choice (' + str(oldChoice) + ') from AI that is not conditional')
         if oldChoice not in self.Choices:
-            print(self.player + ' tried to remove a choice (' + str(oldChoice) + ') from AI that is not in Choices')
-            quit()
+            raise DecisionError(self.player.name + ' tried to remove a choice (' + str(oldChoice) + ') from AI that is not in Choices')
         self.Choices.remove(oldChoice)
 
 #-----------Smart Actions
@@ -271,7 +268,7 @@ class AI:
     #The chooser takes all enemies and chooses amoung those to hit with the area of effect
     #every target can only be hit once, regardless if it is alive or dead 
     #how many targets wil be hit depends on the area and the density in that area from the Battlefield.txt
-        enemies = [x for x in fight if x.team != self.player.team and x.state != -1]
+        enemies = self.player.state_table.opponents(fight, self.player.team)
         DensityFaktor = 2
         if self.player.DM.density == 0: DensityFaktor = 1
         elif self.player.DM.density == 2: DensityFaktor = 3
@@ -349,7 +346,7 @@ class AI:
 
         #dmg score is about dmg times the attacks
         #This represents vs a test AC
-        TestACs = [x.AC for x in fight if x.team != player.team and x.state != -1]
+        TestACs = [x.AC for x in player.state_table.opponents(fight, player.team)]
         if len(TestACs) > 0:
             TestAC = np.mean(TestACs)
         else: TestAC = 16
@@ -399,15 +396,30 @@ class AI:
                 player.attack_counter = 0
             return False  #return, there is no target
         else:
-            target_list = EnemiesInReach
+            target_list = representatives(EnemiesInReach)  #one member per horde
             if self.player.strategy_level < 3:
                 return target_list[int(random()*len(target_list))] #if low strategy, attack random
             #This function is the intelligence behind choosing the best target to hit from a List of given Targets. It chooses reguarding lowest Enemy and AC and so on
+            if player.DM.target_heuristic:
+                return max(target_list, key=lambda target: self.quick_target_score(target, dmg_type, dmg))
             ThreatScore = np.zeros(len(target_list))
             for i in range(0, len(target_list)):
                 ThreatScore[i] = self.target_attack_score(fight, target_list[i], dmg_type, dmg)
             return target_list[np.argmax(ThreatScore)]
 
+    def quick_target_score(self, target, dmg_type, dmg):
+        #Short version of target_attack_score for the fast fidelity levels (DM.target_heuristic)
+        #only threat, how low the target is, kills and the chance to hit count
+        player = self.player
+        if dmg_type in target.damage_immunity:
+            return 0
+        TargetDPS = target.dps()
+        Score = TargetDPS*(1 + (target.HP - target.CHP)/target.HP)
+        if target.CHP <= dmg:
+            Score += TargetDPS*4
+        HitChance = min(max((21 + player.tohit - target.AC)/20, 0.05), 0.95)
+        return Score*HitChance*(random()*player.random_weight + 1)
+
     def target_attack_score(self, fight, target, dmg_type, dmg):
         #This functions helps in decision on a att taget by assining a score
         player = self.player
@@ -602,7 +614,7 @@ class AI:
     def choose_player_to_protect(self, fight):
         #Chooses one other allies, that is not self, which might be unconsious
         player = self.player
-        allies = [x for x in fight if x.team == player.team and x.state != -1 and x != player]       #which allies left alive
+        allies = [x for x in player.state_table.allies_left(fight, player.team) if x != player]       #which allies left alive
         if len(allies) == 0: return False #no allies
 
         AllyScore = []
@@ -658,7 +670,11 @@ class AI:
         if player.raged == 1:
             return False, 0   #cant cast while raging
 
+        if player.DM.spell_priority:
+            return self.choose_spell_by_priority(fight)
+
         Choices = []
+        spell_variants = player.DM.spell_variants #twin and quickened casts, off for fast fidelity
 
         #Check Spells
         for x, spell in player.SpellBook.items():
@@ -666,13 +682,13 @@ class AI:
             if Checkvalue == 1: #Check, Spell is castable
                 Choices.append(spell.cast)
                 #Check if Twin cast is an option
-            if all([Checkvalue == 1, spell.is_twin_castable, player.knows_twinned_spell, player.sorcery_points > spell.spell_level, player.sorcery_points > 1]):
+            if all([spell_variants, Checkvalue == 1, spell.is_twin_castable, player.knows_twinned_spell, player.sorcery_points > spell.spell_level, player.sorcery_points > 1]):
                 Choices.append(spell.twin_cast)
-            elif Checkvalue == 2: #Spell is only castable via quickened spell
+            elif spell_variants and Checkvalue == 2: #Spell is only castable via quickened spell
                 Choices.append(spell.quickened_cast)
 
         #This function determines if the player wants to cast a quickened spell this round
-        if player.knows_quickened_spell:
+        if player.knows_quickened_spell and spell_variants:
             cast_quickened_this_round = self.choose_quickened_cast()
         else:
             cast_quickened_this_round = False
@@ -727,6 +743,24 @@ class AI:
                 return False, 0
         else: return False, 0
 
+    def choose_spell_by_priority(self, fight):
+        #Fixed spell priority for the rough fidelity level (DM.spell_priority): the spells are
+        #tried from the highest spell level down and the first one that beats the same
+        #threshold as in choose_spell is cast, no twin or quickened casts
+        player = self.player
+        if player.action == 1:
+            Threshold = player.dmg/4
+        elif player.bonus_action == 1:
+            Threshold = player.dmg/5 + 1
+        else: return False, 0
+        for spell in sorted(player.SpellBook.values(), key=lambda spell: -spell.spell_level):
+            if self.spell_cast_check(spell) != 1:
+                continue
+            Score, SpellTargets, CastLevel = spell.score(fight)
+            if Score > Threshold:
+                return partial(spell.cast, SpellTargets, CastLevel), Score
+        return False, 0
+
     def choose_heal_target(self, fight):
         #This function is called if the player has heal
         #It returns the best Target for a heal and gives the Heal a Score
@@ -789,13 +823,13 @@ class AI:
         return False
 
     def choose_new_hex(self, fight):
-        HexChoices = [x for x in fight if x.team != self.player.team and x.state == 1]
+        HexChoices = self.player.state_table.enemies_left(fight, self.player.team)
         HexTarget = self.choose_att_target(HexChoices, AttackIsRanged=True, other_dmg=3.5, is_silent=True)
         if HexTarget != False and self.player.bonus_action == 1:
             self.player.SpellBook['Hex'].change_hex(HexTarget)
 
     def choose_new_hunters_mark(self, fight):
-        HuntersMarkChoices = [x for x in fight if x.team != self.player.team and x.state == 1]
+        HuntersMarkChoices = self.player.state_table.enemies_left(fight, self.player.team)
         Target = self.choose_att_target(HuntersMarkChoices, AttackIsRanged=True, other_dmg=3.5, is_silent=True)
-        if Target != False:
+        if Target != False and self.player.bonus_action == 1:
             self.player.SpellBook['HuntersMark'].change_hunters_mark(Target)
\ No newline at end of file
@@ -1,5 +1,6 @@
 import numpy as np
-from random import random
+from simulation_context import random
+from Error_class import *
 
 if __name__ == '__main__':
     from Entity_class import entity
@@ -49,7 +50,7 @@ class do_attack(choice):
 
         #dmg score is about dmg times the attacks
         #This represents vs a test AC
-        TestACs = [x.AC for x in fight if x.team != player.team and x.state != -1]
+        TestACs = [x.AC for x in player.state_table.opponents(fight, player.team)]
         if len(TestACs) > 0:
             TestAC = np.mean(TestACs)
         else: TestAC = 16
@@ -349,7 +350,7 @@ class do_monster_ability(choice):
     
     def spider_web(self, fight):
         player = self.player
-        enemies_left = [x for x in fight if x.team != player.team and x.state == 1]
+        enemies_left = player.state_table.enemies_left(fight, player.team)
         #Random Target
         if len(enemies_left) > 0:
             player.use_spider_web(enemies_left[int(random()*len(enemies_left))])
@@ -420,7 +421,7 @@ class do_heal(choice):
         #It returns the best Target for a heal and gives the Heal a Score
         #If False is returned, Heal will not be added as a Choice for this turn
         player = self.player
-        self.allies = [x for x in fight if x.team == player.team and x.state != -1]
+        self.allies = player.state_table.allies_left(fight, player.team)
         self.dying_allies = [x for x in self.allies if x.state == 0]
         if self.dying_allies != []:      #someone is dying
             DyingScore = []
@@ -488,8 +489,7 @@ class do_heal(choice):
             player.SpellBook['CureWounds'].quickened_cast(target, cast_level=level)
         else:
             #This should not happen
-            print('This is stupid, no Heal in AI, check do_heal class')
-            quit() 
+            raise DecisionError('This is stupid, no Heal in AI, check do_heal class')
 
 #Still work to do:
 class do_call_lightning(choice):
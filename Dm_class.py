@@ -2,23 +2,52 @@ from datetime import datetime
 import numpy as np
 import os
 import sys
+from simulation_context import load_battlefield
+
+#Simulation fidelity: cheaper decision paths for bulk sweeps, see fidelity_calibration.py
+#for what they cost in accuracy
+#   target_heuristic - short target score instead of AI.target_attack_score
+#   spell_variants - twin and quickened casts are scored as choices
+#   spell_priority - spells are tried from the highest level down, the first good one is cast
+#   death_saves_when_lost - death saves are rolled even if the side is clearly lost
+FIDELITY_LEVELS = {
+    'full': {'target_heuristic': False, 'spell_variants': True, 'spell_priority': False, 'death_saves_when_lost': True},
+    'fast': {'target_heuristic': True, 'spell_variants': False, 'spell_priority': False, 'death_saves_when_lost': True},
+    'rough': {'target_heuristic': True, 'spell_variants': False, 'spell_priority': True, 'death_saves_when_lost': False},
+}
 
 
 class DungeonMaster:
-    def __init__(self):
+    def __init__(self, context=None):
+        #context: SimulationContext of this simulation (simulation_context.py), it owns the
+        #battlefield and the log. Without one the Battlefield.txt of the process is used and
+        #the DM prints
         self.AI_blank = False #just ignore, but MUST be False, see AI Class
         self.printing_on = False
         self.start_time = datetime.now()
+        self.context = context
 
-        if getattr(sys, 'frozen', False):
-            application_path = os.path.dirname(sys.executable)
-        elif __file__:
-            application_path = os.path.dirname(__file__)
-
-        self.Battlefield = np.genfromtxt(application_path + '/Battlefield.txt', delimiter= ',')      #load Informations from Battlefield
+        if context is not None:
+            self.Battlefield = context.battlefield
+        else:
+            self.Battlefield = load_battlefield()      #load Informations from Battlefield, read once per process
         self.density = self.Battlefield[0][1]
         #density: 0 - loose, 1 - normal, 2 - dense
         self.rounds_number = 1
+        self.dice_tilt = None  #set by rare_event.py, biases the d20 against the heros
+        self.state_table = None  #CombatStateTable of the running fight, set by do_the_fighting
+        self.horde_min_size = 0  #horde mode: identical monsters in groups of at least this size act as one (horde.py), 0 is off
+        self.set_fidelity('full')
+        #Termination of do_the_fighting, the outcome of the last fight is in self.outcome
+        self.round_cap = 100          #the fight is stopped after this many rounds, 0 is no cap
+        self.stalemate_rounds = 10    #stopped if no HP changed for this many full rounds, 0 is off
+        self.early_resolution = False #a side that cannot turn the fight anymore loses at the end of the round
+        self.outcome = None
+        #Turn of the running fight, kept here while the fight is paused (fight_state.py)
+        self.turn_index = 0
+        self.quiet_rounds = 0
+        self.last_snapshot = None
+        self.loser_team = None
 
         self.text = ''
 
@@ -26,6 +55,14 @@ class DungeonMaster:
         #This function is called a the start of the fighting and resets the DM
         self.rounds_number = 1
     
+    def set_fidelity(self, level):
+        #'full', 'fast' or 'rough', see FIDELITY_LEVELS
+        if level not in FIDELITY_LEVELS:
+            raise ValueError('Unknown fidelity level: ' + str(level))
+        self.fidelity = level
+        for switch, value in FIDELITY_LEVELS[level].items():
+            setattr(self, switch, value)
+
     def block_print(self):
         self.printing_on = False
 
@@ -41,6 +78,9 @@ class DungeonMaster:
                     print(str(round((datetime.now() - self.start_time).total_seconds()*1000, 3)), end=': ')
                     self.start_time = datetime.now()
             if this_is_new_line:
-                print(self.text)
+                if self.context is not None and self.context.log is not None:
+                    self.context.log.append(self.text)
+                else:
+                    print(self.text)
                 self.text = '' #start new line
             self.text = ''.join([self.text, text_to_say])
\ No newline at end of file
@@ -1,3 +1,5 @@
+from Error_class import *
+
 class dmg:
     def __init__(self, amount = 0, type = 'slashing'):
         #List with float dmg amounts
@@ -24,8 +26,7 @@ class dmg:
                 self.dmg_amount_list.append(amount)
                 self.dmg_type_list.append(x)
                 return
-        print('Unknown Dmg Type: ' + type)
-        quit()
+        raise DamageTypeError('Unknown Dmg Type: ' + type)
 
     def multiply(self, factor):
         #All dmg entries are multiplied
@@ -8,7 +8,8 @@ import os
 import json
 #from ttkbootstrap.constants import *
 import platform #for figuring out windows/macOS
-from run_full_stat_recap import run_full_stat_recap
+from run_full_stat_recap import RecapRun
+from live_estimate import LiveEstimator
 
 #Controlls the Pages
 class Controller(Frame):
@@ -208,6 +209,7 @@ class Controller(Frame):
 class HomePage_cl(Frame):
     def __init__(self, root):
         Frame.__init__(self, root)
+        self.recap_run = False  #RecapRun of the running analysis
         self.Build_Page() #build up the Page
 
     def Build_Page(self):
@@ -239,6 +241,10 @@ class HomePage_cl(Frame):
         self.repetitions_entry = Entry(IterationFrame, bd=5, width=8)
         self.repetitions_entry.insert(0, '100')
         self.b_run_stat = ttk.Button(IterationFrame, width = 12, text='Run Analysis', bootstyle="outline", command=self.run_statistical_recap)
+        #Progress of the running analysis, shown while it runs
+        self.progress_bar = ttk.Progressbar(IterationFrame, length=150, maximum=100, bootstyle='success striped')
+        self.progress_label = Label(IterationFrame, text='', width=10)
+        self.b_cancel_stat = ttk.Button(IterationFrame, width = 8, text='Cancel', bootstyle="outline danger", command=self.cancel_statistical_recap)
         #Create Buttons
         ButtonFrame = Frame(BottomFrame)
         self.b_create_new = ttk.Button(ButtonFrame, text='Create New', width=12, bootstyle="outline", command= self.master.change_to_EntityPage)
@@ -250,6 +256,8 @@ class HomePage_cl(Frame):
         self.iterationlabel.grid(row=0,column=0, pady=3, sticky='w')
         self.repetitions_entry.grid(row=0, column=1, pady=3, padx=5)
         self.b_run_stat.grid(row=0, column=2, pady=5)
+        if self.recap_run != False:  #page rebuilt while an analysis runs
+            self.show_progress()
         IterationFrame.grid(row=0, column=0, sticky='w')
 
         self.b_create_new.grid(row=2, column=0, padx=3)
@@ -260,30 +268,65 @@ class HomePage_cl(Frame):
         BottomFrame.grid(row=1, column=0, columnspan=2, pady=15, sticky='wn')
         
     def run_statistical_recap(self):
-        #in the following all information about the simulation and the Entities that take part are written in the json file
-        if getattr(sys, 'frozen', False):
-            application_path = os.path.dirname(sys.executable)
-        elif __file__:
-            application_path = os.path.dirname(__file__)
-
-
-        repetitions = int(self.repetitions_entry.get()) #read repetitions from input
+        #the simulation runs in a worker process with the entities as they are loaded, the
+        #Tk loop polls its progress and result (poll_statistical_recap)
+        if self.recap_run != False:
+            return  #one analysis at a time
+        try:
+            repetitions = int(self.repetitions_entry.get()) #read repetitions from input
+        except ValueError:
+            messagebox.showinfo('Repetitions', 'Repetitions must be a number')
+            return
         if self.b_print_value.get() == 0:
             simulation_parameters = {"printing_on": 0, "repetitions" : repetitions}
         else:
             simulation_parameters = {"printing_on": 1, "repetitions" : repetitions}
 
-        Entities = [{"name" : player.name, "team" : player.team} for player in self.master.Fighters]
-        with open(application_path + "/simulation_parameters.json", "w") as f:  #write to json file
-            json.dump({"simulation_parameters": simulation_parameters, "Entities": Entities}, f, indent=4)
-
-        #using subprocess functions to call script
-#        p = subprocess.run('python3 run_full_stat_recap.py', shell= True)
-        run_full_stat_recap() #just a test
-
-        text_result = open(application_path + '/simulation_result.txt').read()
-        open(application_path + '/simulation_result.txt', 'w').write('')
-        self.open_message(text_result)
+        Entities = [{"name" : player.name, "team" : player.team, "data" : player.data} for player in self.master.Fighters]
+        self.recap_run = RecapRun(simulation_parameters, Entities)
+        self.progress_bar['value'] = 0
+        self.progress_label.configure(text='0 %')
+        self.show_progress()
+        self.after(100, self.poll_statistical_recap)
+
+    def show_progress(self):
+        self.b_run_stat.configure(state='disabled')
+        self.progress_bar.grid(row=0, column=3, padx=5)
+        self.progress_label.grid(row=0, column=4)
+        self.b_cancel_stat.configure(state='normal')
+        self.b_cancel_stat.grid(row=0, column=5, padx=5)
+
+    def hide_progress(self):
+        self.b_run_stat.configure(state='normal')
+        self.progress_bar.grid_remove()
+        self.progress_label.grid_remove()
+        self.b_cancel_stat.grid_remove()
+
+    def cancel_statistical_recap(self):
+        #the run stops after the running fight and shows the result of the fights played
+        if self.recap_run != False:
+            self.recap_run.cancel()
+            self.b_cancel_stat.configure(state='disabled')
+            self.progress_label.configure(text='stopping')
+
+    def poll_statistical_recap(self):
+        text_result = False
+        for message in self.recap_run.poll():
+            if message[0] == 'progress':
+                self.progress_bar['value'] = message[1]/message[2]*100
+                if not self.recap_run.cancel_event.is_set():
+                    self.progress_label.configure(text=str(int(message[1]/message[2]*100)) + ' %')
+            elif message[0] == 'result':
+                text_result = message[1]
+            elif message[0] == 'error':
+                text_result = 'The simulation stopped with an error:\n' + message[1]
+        if not self.recap_run.finished:
+            self.after(100, self.poll_statistical_recap)
+            return
+        self.recap_run = False
+        self.hide_progress()
+        if text_result != False:
+            self.open_message(text_result)
     
     def open_message(self, text):
         root = ttk.Toplevel()
@@ -1224,6 +1267,8 @@ class DM_page(Frame):
         Frame.__init__(self, root)
         self.root = root
         self.current_Fighter = False   #will later be changed
+        self.estimator = False   #LiveEstimator, started when the page is first used
+        self.polling = False
         self.build_page()
         
     def build_page(self):
@@ -1293,8 +1338,17 @@ class DM_page(Frame):
         ttk.Button(self, width=9, text = 'Previous', bootstyle='outline', command=self.previous_Fighter).grid(row= len(self.buttons_Fighters)+2, column=1)
         ttk.Button(self, width=9, text = 'Next', bootstyle='outline', command=self.next_Fighter).grid(row= len(self.buttons_Fighters)+2, column=2, columnspan=2)
 
+        #Live estimate of the rest of the fight, updated whenever the page changes
+        self.label_estimate = Label(self, anchor='w', text='Win chance: -')
+        self.label_estimate.grid(row= len(self.buttons_Fighters)+3, column=0, columnspan=7, padx=padx, pady=pady, sticky='w')
+        for Entry_HP in self.Entry_Fighters:
+            Entry_HP.bind('<Return>', lambda event: self.update_estimate())
+            Entry_HP.bind('<FocusOut>', lambda event: self.update_estimate())
+
         if self.current_Fighter in self.master.Fighters:
             self.change_to_Fighter(self.current_Fighter)
+        else:
+            self.update_estimate()
         
     def back_home(self):
         for i in range(len(self.master.Fighters)):
@@ -1337,6 +1391,7 @@ class DM_page(Frame):
                     self.buttons_Fighters[i].configure(bootstyle='danger solid')
                 else:
                     self.buttons_Fighters[i].configure(bootstyle='danger outline')
+        self.update_estimate()
 
     def apply_dmg(self,Fighter):
         index = self.master.Fighters.index(Fighter)
@@ -1367,6 +1422,7 @@ class DM_page(Frame):
         self.Entry_dmg_type[index].delete(0, 'end')
         self.Entry_Fighters[index].delete(0, 'end')
         self.Entry_Fighters[index].insert(0, str(self.master.Fighters[index].CHP))
+        self.update_estimate()
     
     def set_concentration(self,Player):
         if Player.is_concentrating == 0:
@@ -1375,6 +1431,38 @@ class DM_page(Frame):
         else:
             Player.is_concentrating = 0
             self.b_concentration[self.master.Fighters.index(Player)].configure(bootstyle = 'warning outline')
+        self.update_estimate()
+
+    def update_estimate(self):
+        #Sends the table as it is to the estimator, the run of the old table is cancelled
+        Fighters = self.master.Fighters
+        if len(set(x.team for x in Fighters)) < 2:
+            return
+        try:
+            table = [(x.name, x.team, int(self.Entry_Fighters[i].get()), x.is_concentrating == 1, x.data, list(x.spell_slot_counter)) for i, x in enumerate(Fighters)]
+        except ValueError:
+            return  #HP entry is being typed
+        turn = Fighters.index(self.current_Fighter) if self.current_Fighter in Fighters else 0
+        if self.estimator == False or not self.estimator.process.is_alive():
+            self.estimator = LiveEstimator()  #first table, or the old process died
+        self.estimator.submit(table, turn)
+        self.label_estimate.configure(text='Win chance: ...')
+        if not self.polling:
+            self.polling = True
+            self.after(100, self.poll_estimate)
+
+    def poll_estimate(self):
+        #Called by the Tk loop, shows the newest estimate until the run is done
+        result = self.estimator.poll()
+        if result is not None:
+            if 'error' in result:
+                self.label_estimate.configure(text='Win chance: - (' + result['error'] + ')')
+            elif 'win_prob' in result:
+                self.label_estimate.configure(text='Win chance: ' + str(round(result['win_prob']*100)) + '%   Expected rounds: ' + str(round(result['rounds_mean'], 1)) + '   (' + str(result['continuations']) + ' fights' + (', running' if result['running'] else '') + ')')
+            if not result['running']:
+                self.polling = False
+                return
+        self.after(100, self.poll_estimate)
 
 def StartGUI():
     root = ttk.Window(themename="cyborg")
@@ -4,32 +4,101 @@ from copy import copy
 from datetime import datetime
 
 from Entity_class import *
+from horde import make_hordes
+from simulation_context import fight_seed
+
+LOST_SIDE_HP_RATIO = 4  #rough fidelity skips death saves of a side that is this far behind in HP
+#How a fight ended (DM.outcome), only 'decided' and 'resolved_early' have a winner
+#   decided - one team is left standing
+#   resolved_early - early resolution, the losing side could not turn the fight anymore
+#   round_cap - stopped after DM.round_cap rounds
+#   stalemate - stopped after DM.stalemate_rounds full rounds without any HP change
+OUTCOMES = ['decided', 'resolved_early', 'round_cap', 'stalemate']
 
 def fight_ongoing_check(fight): #this function takes the fighters and checks if more then one team is still alive
-    fighter_tag_list = []
-    for i in range(0, len(fight)):
-        if fight[i].CHP > 0 and fight[i].team not in fighter_tag_list:
-            fighter_tag_list.append(fight[i].team)
-    if len(fighter_tag_list) > 1:
-        return True
-    else:
-        return False
+    return len(fight[0].state_table.teams_standing()) > 1  #every fighter is in the fight table
+
+def side_clearly_lost(fight, team):
+    #the team has less than 1/LOST_SIDE_HP_RATIO of the HP its enemies have left
+    table = fight[0].state_table
+    enemy_health = sum(table.team_health(x) for x in table.teams_standing() if x != team)
+    return table.team_health(team)*LOST_SIDE_HP_RATIO < enemy_health
+
+def hp_snapshot(fight):
+    #HP of every fighter, for the stalemate check
+    return tuple((x.CHP, x.shape_HP, x.state) for x in fight)
+
+def resolved_loser(fight):
+    #Early resolution: a team without any heal left that either has no member left that can
+    #act, or would fall to one round of the damage its enemies dealt so far per round while
+    #it could not even take half of their HP in a round. Returns that team or None
+    table = fight[0].state_table
+    teams = table.teams_standing()
+    if len(teams) != 2:
+        return None
+    rounds = fight[0].DM.rounds_number
+    for team in teams:
+        own = [x for x in fight if x.team == team and x.state != -1]
+        enemies = [x for x in fight if x.team != team and x.state != -1]
+        if any(x.has_heal_left() for x in own if x.state == 1):
+            continue
+        can_act = [x for x in own if x.state == 1 and not (x.is_stunned or x.is_paralyzed or x.is_incapacitated)]
+        own_dpr = sum(x.dmg_dealed for x in own)/rounds
+        enemy_dpr = sum(x.dmg_dealed for x in enemies)/rounds
+        if len(can_act) == 0 or (table.team_health(team) < enemy_dpr and 2*own_dpr < sum(x.CHP for x in enemies)):
+            return team
+    return None
 
 def do_the_fighting(fighters_unsorted): #here a list of fighters from different teams
-    fight = roll_for_initiative(fighters_unsorted)     #roll all inits and return sorted list
-    Init_counter = 0
+    fight = begin_fight(fighters_unsorted)
+    play_turns(fight)
+    return end_fight(fighters_unsorted, fight)
+
+def begin_fight(fighters_unsorted, initiative_order = False):
+    #Initiative, state table and hordes of a new fight, returns the fight in initiative order
+    #initiative_order: the fighters are already in initiative order, no initiative is rolled
+    if initiative_order:
+        fight = list(fighters_unsorted)
+    else:
+        fight = roll_for_initiative(fighters_unsorted)     #roll all inits and return sorted list
     DM = fighters_unsorted[0].DM
     DM.reset() #resets the DM at start of fighting
+    DM.state_table = CombatStateTable(len(fight))  #one state table per fight, summons join it
+    for x in fight:
+        DM.state_table.attach(x)
+    DM.state_table.fight = fight
+    make_hordes(fight, DM.horde_min_size)
 
     DM.say('Runde ' + str(DM.rounds_number) + ' - Heros Teamhealth: ' + str(teamhealth(fight, 0)), True)
+    DM.outcome = 'decided'
+    DM.loser_team = None
+    DM.turn_index = 0
+    DM.quiet_rounds = 0  #full rounds without HP change
+    DM.last_snapshot = hp_snapshot(fight)
+    return fight
+
+def play_turns(fight, pause_at = None):
+    #Plays the turns from DM.turn_index on until the fight is over (returns False)
+    #pause_at: (round, turn index), the fight stops before that turn and returns True, it
+    #can be resumed with play_turns (fight_state.py snapshots it there)
+    DM = fight[0].DM
+    Init_counter = DM.turn_index
+    quiet_rounds = DM.quiet_rounds
+    last_snapshot = DM.last_snapshot
 
     while fight_ongoing_check(fight) == True:
+        if pause_at is not None and (DM.rounds_number, Init_counter) == pause_at:
+            DM.turn_index, DM.quiet_rounds, DM.last_snapshot = Init_counter, quiet_rounds, last_snapshot
+            return True
         player = fight[Init_counter]
 
         if player.state != -1:
             DM.say('_____________', True)
-        if player.state == 1:                            #player is alive
-            enemies_left_list = [x for x in fight if x.team != player.team and x.state == 1]
+        if player.state == 1 and player.horde is not None:   #horde member, the horde acts once per round
+            if player.horde.acts_now(player, DM.rounds_number):
+                player.horde.take_turn(fight)
+        elif player.state == 1:                            #player is alive
+            enemies_left_list = DM.state_table.enemies_left(fight, player.team)
 
             player.start_of_turn()
 
@@ -38,7 +107,8 @@ def do_the_fighting(fighters_unsorted): #here a list of fighters from different
 
         #if player is dead, make death save
         if player.state == 0 and player.team == 0:
-            player.make_death_save()
+            if DM.death_saves_when_lost or not side_clearly_lost(fight, player.team):
+                player.make_death_save()
 
         #End of the Turn
         player.end_of_turn()   #after turn, reset counter, haste, stuff, all that happends at end of turn
@@ -46,20 +116,48 @@ def do_the_fighting(fighters_unsorted): #here a list of fighters from different
         Init_counter += 1                                #set Init counter, reset round counter if ness.
         if Init_counter >= len(fight):
             Init_counter = 0
+            #guaranteed termination: round cap, stalemate and early resolution
+            if fight_ongoing_check(fight):
+                if DM.round_cap > 0 and DM.rounds_number >= DM.round_cap:
+                    DM.outcome = 'round_cap'
+                    break
+                snapshot = hp_snapshot(fight)
+                quiet_rounds = quiet_rounds + 1 if snapshot == last_snapshot else 0
+                last_snapshot = snapshot
+                if DM.stalemate_rounds > 0 and quiet_rounds >= DM.stalemate_rounds:
+                    DM.outcome = 'stalemate'
+                    break
+                if DM.early_resolution:
+                    DM.loser_team = resolved_loser(fight)
+                    if DM.loser_team is not None:
+                        DM.outcome = 'resolved_early'
+                        break
             DM.rounds_number += 1
             DM.say('', True)
             DM.say('Runde ' + str(DM.rounds_number) + ' - Heros Teamhealth: ' + str(teamhealth(fight, 0)), True)
+    return False
 
-
+def end_fight(fighters_unsorted, fight):
+    #Cleans up after the fight, returns the winner team (None if stopped) and the rounds
+    DM = fighters_unsorted[0].DM
     #Only one Team is left alive
     DM.say('', True)
     DM.say("Fight over", True)
+    if DM.outcome != 'decided':
+        DM.say('Fight stopped: ' + DM.outcome, True)
+    if DM.loser_team is not None:
+        for x in fight:
+            if x.team == DM.loser_team and x.state != -1:
+                x.CHP = 0  #the losing side would have fallen
+    side_lost = DM.outcome in ['decided', 'resolved_early']  #round cap and stalemate have no loser
     for x in fighters_unsorted:
-        if x.CHP == 0:
+        if x.CHP == 0 and side_lost:
             x.state = -1 #Everone who is unconscious in the loser Team is practically Dead now
         if x.is_summoned:  #let summend characters vanish after dead
             fight.remove(x)
+            x.state_table.detach(x)
         x.TM.resolveAll()
+        x.release_summons()  #summons go back to the pool of their summoner
         
 
     DM.say('HP left:', True)
@@ -79,6 +177,8 @@ def do_the_fighting(fighters_unsorted): #here a list of fighters from different
         if i.CHP > 0:
             winner_team = i.team
             break
+    if DM.outcome in ['round_cap', 'stalemate']:
+        winner_team = None  #no winner
     
     return winner_team, DM.rounds_number
 
@@ -96,13 +196,20 @@ def enemies_left_sort(fight, TeamTag):
     enemies_left_list = [x for x in fight if x.team != TeamTag and x.state == 1]
     return enemies_left_list
 
-def run_simulation(repetition, fighters, progress = False):
+def run_simulation(repetition, fighters, progress = False, outcomes = None, failures = None):
+    #outcomes: optional list, the DM.outcome of every fight is appended (see OUTCOMES)
+    #failures: optional list, a fight that raises a SimulationError is recorded there
+    #({'fight': index, 'seed', 'fighters': [(name, team)], 'error'}) and left out of the statistics,
+    #without it the error is raised. Every fight starts the dice from its own seed, so
+    #use_context(SimulationContext(seed=seed)) and do_the_fighting replay a failed fight
+    #progress: True prints the progress, a function progress(fights done, repetition) is
+    #called before every fight instead, if it returns True the run stops there (cancelled)
     damage_statistic = []
     winner = []
     rounds_number = []
     deaths = []
     unconscious = []
-    DeathNumber = np.zeros(repetition)#Counts the absolute Deaths per Repetition (only for team 0)
+    DeathNumber = [] #Counts the absolute Deaths per Repetition (only for team 0)
     TeamHealth = [] #List with how much of the absolute Team Health is left
     TeamHP = 0
     for fighter in fighters:
@@ -110,25 +217,35 @@ def run_simulation(repetition, fighters, progress = False):
             TeamHP += fighter.HP
 
     for i in range(0,repetition):
-        percent = str(round(i/repetition*100, 1))
         if progress == True:
+            percent = str(round(i/repetition*100, 1))
             print('Progress : ' + percent +'%')
-        simulation_results = do_the_fighting(fighters)
+        elif progress and progress(i, repetition):
+            break
+        seed = fight_seed()
+        try:
+            simulation_results = do_the_fighting(fighters)
+        except SimulationError as e:
+            if failures is None:
+                raise
+            failures.append({'fight': i, 'seed': seed, 'fighters': [(x.orignial_name, x.team) for x in fighters], 'error': repr(e)})
+            for l in fighters:
+                l.release_summons()
+                l.long_rest()  #the next fight starts clean
+            continue
         winner.append(simulation_results[0])         # do the fight and get the winner, list of 0 (heros) or 1 (enemies)
         rounds_number.append(simulation_results[1])         # do the fight and get the rounds number
+        if outcomes is not None:
+            outcomes.append(fighters[0].DM.outcome)
         damage_statistic.append([k.dmg_dealed for k in fighters])  #get dmg statistic
 
-        for j in fighters:
-            if j.state == -1:
-                deaths.append(j.name)
-                if j.team == 0:
-                    DeathNumber[i] += 1 #Counts the absolute Deaths per Repetition
-        
-        TeamCHP = 0
-        for fighter in fighters:
-            if fighter.team == 0:
-                TeamCHP += fighter.CHP
-        TeamHealth.append(TeamCHP/TeamHP) #how much Team health is left
+        table = fighters[0].state_table  #rows of the fight that just ended
+        rows = table.rows_of(fighters)
+        dead = table.column('state')[rows] == -1
+        heros = table.column('team')[rows] == 0
+        deaths += [fighters[k].name for k in np.flatnonzero(dead)]
+        DeathNumber.append(np.sum(dead & heros)) #Counts the absolute Deaths per Repetition
+        TeamHealth.append(float(np.sum(table.column('CHP')[rows][heros]))/TeamHP) #how much Team health is left
 
         UnconsciousSum = 0
         for j in fighters:
@@ -140,39 +257,29 @@ def run_simulation(repetition, fighters, progress = False):
             l.long_rest()           #rest by doing a long Rest
     damage_statistic_sorted = []
     for j in range(0, len(fighters)):          #sort dmg statistic
-        damage_statistic_sorted.append([damage_statistic[i][j] for i in range(0,repetition)])
+        damage_statistic_sorted.append([damage_statistic[i][j] for i in range(0,len(damage_statistic))])
     names = [i.name for i in fighters]         #get names 
+    DeathNumber = np.array(DeathNumber, dtype=float)
 
     return names, damage_statistic_sorted, winner, rounds_number, deaths, unconscious, DeathNumber, TeamHealth
 
-def most_valuable_player(repetition, fighters):
+def most_valuable_player(repetition, fighters, processes=1):
+    #Leave one out on common seeds: the full team and every team without one hero
+    #play the same repetition fights, see contribution_analysis.py
+    #processes=1 plays in this process, the GUI calls this inside its own run
+    from contribution_analysis import contribution_analysis
     DM = fighters[0].DM
     Heros_List = [fighter for fighter in fighters if fighter.team == 0]
     if len(Heros_List) == 1: # if only one Heros is in the team
         return [[Heros_List[0].name], [0], Heros_List[0].name]
-    fighters_without_one_hero = copy(fighters)
-    player_name = []
+    contributions, fights_played = contribution_analysis(fighters, method='leave_one_out', fights=repetition, processes=processes)
+    player_name = [item['name'] for item in contributions]
     win_probability_without_player = []
-    for i in range(0, len(fighters_without_one_hero)):
-        if fighters_without_one_hero[i].team == 0:
-            fighters_without_one_hero.remove(fighters[i])
-            player_name.append(fighters[i].name) 
-            names, damage_statistic_sorted, winner, rounds_number, deaths, unconscious, DeathNumber, TeamHealth = run_simulation(repetition, fighters_without_one_hero)
-            
-            #calc win prob.
-            wins = 0
-            defeats = 0
-            for i in winner:
-                if i == 0:
-                    wins += 1
-                else:
-                    defeats += 1
-            win_probability = wins/(wins + defeats)
-            win_probability_without_player.append(win_probability)
-
-            DM.say('Win Probability = ' + str(win_probability) + '\n', True)
-            fighters_without_one_hero = copy(fighters)
-    
+    for item in contributions:
+        #the contribution is the win probability the team loses without the hero
+        win_probability_without_player.append(item['full_team_win'] - item['contribution'])
+        DM.say(item['name'] + ' : ' + str(round(item['contribution']*100, 1)) + ' % [' + str(round(item['ci_low']*100, 1)) + ', ' + str(round(item['ci_high']*100, 1)) + ']', True)
+
     mvp_index = argmin(win_probability_without_player)
     DM.say('Most valuable player: ' + str(player_name[mvp_index]), True)
     return player_name, win_probability_without_player, player_name[mvp_index]
@@ -185,7 +292,7 @@ def spell_cast_recap(repetition, fighters, text_result):  #only calls the object
                     text_result += str(fighter.name) + ' cast ' + spell.spell_text + ': ' + str(round(spell.was_cast/repetition,3)) + '\n'
     return text_result
 
-def full_statistical_recap(repetition, fighters):
+def full_statistical_recap(repetition, fighters, progress=True):
     DM = fighters[0].DM
     DM.start_time = datetime.now()
 
@@ -193,19 +300,33 @@ def full_statistical_recap(repetition, fighters):
     text_result = 'Simulation estimates:\n'
 
     #run simulation
-    names, damage_statistic_sorted, winner, rounds_number, deaths, unconscious, DeathNumber, TeamHealth = run_simulation(repetition, fighters, progress=True)
+    outcomes = []
+    names, damage_statistic_sorted, winner, rounds_number, deaths, unconscious, DeathNumber, TeamHealth = run_simulation(repetition, fighters, progress=progress, outcomes=outcomes)
+    played = len(winner)  #less than repetition if the run was cancelled
+    if played < repetition:
+        text_result += 'Cancelled after ' + str(played) + ' of ' + str(repetition) + ' fights\n'
+    if played == 0:
+        if DM.context is not None:
+            DM.context.statistics.update({'text_result': text_result})
+        return text_result, 0, rounds_number, [], DeathNumber, TeamHealth
+    #win and TPK probability are over all fights played, fights stopped without a winner
+    #(round cap, stalemate) count as neither and are reported on their own
     wins = 0
     defeats = 0
+    stopped = 0
     for i in winner:
         if i == 0:
             wins += 1
+        elif i is None:
+            stopped += 1
         else:
             defeats += 1
-    win_probability = wins/(wins + defeats)
+    win_probability = wins/played
+    tpk_probability = defeats/played
 
     # run the most valuable player function with less repetitions
     #This section was removed due to high performance impact
-    if True:
+    if played == repetition:  #not for a cancelled run
         DM.block_print()
         mvp_repetitions = int(repetition/10) +1
         if mvp_repetitions > 100:
@@ -224,14 +345,14 @@ def full_statistical_recap(repetition, fighters):
                 if i.name == j:   #if name is in deaths from simulation
                     fighter_has_died_counter += 1
             if fighter_has_died_counter > 0:
-                death_probability = fighter_has_died_counter/repetition
+                death_probability = fighter_has_died_counter/played
                 Deaths_text_result += str(i.name) + ' dies: ' + str(round(death_probability*100,2)) + ' %\n'
             else:
                 death_probability = 0
             DeathProbabilities.append(death_probability) # for late calc difficulty
 
     #Calculate the Difficulty
-    Difficulty = calculate_difficulty(1-win_probability, np.mean(rounds_number), DeathProbabilities, unconscious, DeathNumber, TeamHealth)
+    Difficulty = calculate_difficulty(tpk_probability, np.mean(rounds_number), DeathProbabilities, unconscious, DeathNumber, TeamHealth)
     Difficulty_Text = ['0',
     'Insignificant', 'Easy', 'Medium', 'Challenging', 'Hard',
     'Brutal', 'Insane', 'Death', 'Hell', 'How Dare You?']
@@ -256,7 +377,11 @@ def full_statistical_recap(repetition, fighters):
     text_result += 'Win Probability: ' + str(round(win_probability*100, 3)) + ' %\n'
     text_result += 'Fight Length: ' + str(round(np.mean(rounds_number),1)) + ' +/- ' + str(round(np.std(rounds_number),1)) + '\n'
     text_result += 'Team Health: ' + str(round(np.mean(TeamHealth)*100,1)) + ' %\n'
-    text_result += 'Total Party Kill: ' + str(round((1-win_probability)*100, 3)) + ' %\n\n'
+    text_result += 'Total Party Kill: ' + str(round(tpk_probability*100, 3)) + ' %\n'
+    text_result += 'Stopped without result: ' + str(round(stopped/played*100, 3)) + ' %\n\n'
+    for outcome in OUTCOMES[1:]:
+        if outcome in outcomes:
+            text_result += 'Fights ' + outcome.replace('_', ' ') + ': ' + str(round(outcomes.count(outcome)/played*100, 3)) + ' %\n'
     # text_result += Difficulty_Meaning[Difficulty] + '\n\n'
     # text_result += '----DEATHS----\n'
     # text_result += Deaths_text_result
@@ -283,15 +408,13 @@ def full_statistical_recap(repetition, fighters):
     #     text_result += fighters[i].name + ' : ' + str(int(damage_player[i])) + '\n'
     text_result += '\n'
     # text_result += '----SPELLS CAST----\n'
-    text_result = spell_cast_recap(repetition, fighters, text_result)
+    text_result = spell_cast_recap(played, fighters, text_result)
 
 
-    if getattr(sys, 'frozen', False):
-        application_path = os.path.dirname(sys.executable)
-    elif __file__:
-        application_path = os.path.dirname(__file__)
-    f = open(application_path + '/simulation_result.txt', 'w')
-    f.write(text_result)
+    #no file is written here, the result goes back to the caller (and its SimulationContext)
+    if DM.context is not None:
+        DM.context.statistics.update({'text_result': text_result, 'win_probability': win_probability, 'rounds_number': rounds_number,
+                                      'damage_player': damage_player, 'DeathNumber': DeathNumber, 'TeamHealth': TeamHealth, 'outcomes': outcomes})
 
     return text_result, win_probability, rounds_number, damage_player, DeathNumber, TeamHealth
 
@@ -358,8 +481,4 @@ def calculate_difficulty(TPKChance, Length, DeathProbabilities, Unconscious, Dea
         return 7
         
 def teamhealth(fight, teamtag):
-    healthlist = []
-    for i in range(0, len(fight)):                  #sort team
-        if fight[i].team == teamtag and fight[i].CHP > 0:
-            healthlist.append(fight[i].CHP)
-    return sum(healthlist)
\ No newline at end of file
+    return fight[0].state_table.team_health(teamtag)
\ No newline at end of file
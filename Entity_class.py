@@ -3,12 +3,14 @@ from Dmg_class import dmg
 from AI_class import AI
 from Token_class import *
 from Spell_class import *
+from combat_state import CombatStateTable, NO_TABLE, state_fields
 
-from random import random, shuffle
+from simulation_context import random, shuffle
 import numpy as np
 import json
 import os
 import sys
+from Error_class import *
 
 class entity:                                          #A Character
     def __init__(self, name, team, DM, archive = False, external_json = False):                  #Atk - Attack [+x to Hit, mean dmg]
@@ -24,15 +26,22 @@ class entity:                                          #A Character
             path = application_path + '/Archive/' + str(name) + '.json'
 
         if external_json == False:
-            file = open(path)
-            data = json.load(file)
-            file.close()
+            try:
+                file = open(path)
+                data = json.load(file)
+                file.close()
+            except (OSError, ValueError) as e:
+                raise EntityDataError('Entity ' + str(name) + ' could not be loaded: ' + str(e)) from e
         else:
             data = external_json
 
 
         self.data = data
         self.DM = DM
+        #CHP, HP, AC, team, state, position, speed and the conditions also live in a row of the
+        #CombatStateTable of the fight (see combat_state.py), do_the_fighting attaches the entity
+        self.state_table = NO_TABLE
+        self.state_row = 0
         self.TM = TokenManager(self)  #Token Manager
 
     #Base Properties
@@ -175,6 +184,9 @@ class entity:                                          #A Character
         self.is_summoned = False       #if True it will be removed from fight after dead
         self.summoner = False      #general for all summoned entities
         self.has_summons = False
+        self.summon_pool = {}      #Name -> entities this player has summoned, reused in later fights
+        self.summon_pool_used = {} #Name -> how many of them are in the current fight
+        self.shape_pool = {}       #ShapeName -> entity with the stats of a wild shape form
         #Guiding Bolt
         self.is_guiding_bolted = False
         #Chill Touch
@@ -481,6 +493,7 @@ class entity:                                          #A Character
         self.attack_counter = self.attacks           #will be reset to attack at start of turn
         self.is_attacking = False #Is set true if player has used acktion to attack
         self.unconscious_counter = 0       #This counts how often the player was unconscious in the fight for the statistics
+        self.horde = None   #Horde this monster belongs to in horde mode, see horde.py
 
         self.action = 1
         self.bonus_action = 1
@@ -514,9 +527,17 @@ class entity:                                          #A Character
     #AI
         self.AI = AI(self)
 
-    def rollD20(self, advantage_disadvantage=0): #-1 is disadvantage +1 is advantage
-        d20_1 = int(random()*20 + 1)
-        d20_2 = int(random()*20 + 1)
+    def rollD20(self, advantage_disadvantage=0, tilt=0): #-1 is disadvantage +1 is advantage
+        #tilt +1/-1 biases the roll high/low if the DM runs a rare event estimation (see rare_event.py)
+        if tilt != 0 and self.DM.dice_tilt is not None:
+            d20_1 = self.DM.dice_tilt.roll(tilt)
+            if advantage_disadvantage != 0:
+                d20_2 = self.DM.dice_tilt.roll(tilt)
+            else:
+                d20_2 = int(random()*20 + 1)
+        else:
+            d20_1 = int(random()*20 + 1)
+            d20_2 = int(random()*20 + 1)
         if advantage_disadvantage > 0:
             d20 = max([d20_1, d20_2])
         elif advantage_disadvantage < 0:
@@ -534,6 +555,16 @@ class entity:                                          #A Character
                 self.DM.say('(with inspiration), ')
         return d20
 
+    @property
+    def modifier(self):
+        return self._modifier
+
+    @modifier.setter
+    def modifier(self, value):
+        self._modifier = value
+        if 'saves_prof' in self.__dict__ and self.state_table is not NO_TABLE:  #not yet during __init__
+            self.state_table.update_saves(self)
+
 #---------------------Character State Handling----------------
     def unconscious(self):
         self.DM.say(self.name + ' is unconscious ', True)
@@ -652,8 +683,7 @@ class entity:                                          #A Character
         #---------Heal
         if damage < 0:               #neg. damage is heal Currently Heal is always applied to CHP never to shape HP
             if self.state == -1:
-                print('This is stupid, dead cant be healed', True)
-                quit()
+                raise RuleError('This is stupid, dead cant be healed')
             if self.chill_touched: 
                 self.DM.say(self.name + ' is chill touched and cant be healed.')
             elif abs(self.HP - self.CHP) >= abs(damage):
@@ -706,6 +736,14 @@ class entity:                                          #A Character
         #Heal is values 2 times dmg
         return (self.dmg_dealed + self.heal_given*2)/self.DM.rounds_number
 
+    def has_heal_left(self):
+        #True if the player can still heal: lay on hands, regeneration or a heal spell with a slot left
+        if self.lay_on_hands_counter > 0 or self.start_of_turn_heal > 0:
+            return True
+        if 'CureWounds' in self.SpellBook or 'HealingWord' in self.SpellBook:
+            return sum(self.spell_slot_counter) > 0
+        return False
+
     def value(self):
         #This function is designed to help decision making in AI
         #It returns a current, roughly dmg equal score of the entity to compare how important it is for the team
@@ -784,14 +822,15 @@ class entity:                                          #A Character
         AuraBonus = self.protection_aura()
         if AuraBonus > 0:
             self.DM.say('in protection aura, ')
+        Tilt = -1 if self.team == 0 else 0 #heros fail saves more often in a rare event estimation
         if Advantage < 0:
-            d20_roll = self.rollD20(advantage_disadvantage=-1)
+            d20_roll = self.rollD20(advantage_disadvantage=-1, tilt=Tilt)
             self.DM.say('in disadvantage doing a ' + save_text[which_save] + ' save: ')
         elif Advantage > 0:
-            d20_roll = self.rollD20(advantage_disadvantage=1)
+            d20_roll = self.rollD20(advantage_disadvantage=1, tilt=Tilt)
             self.DM.say('in advantage doing a ' + save_text[which_save] + ' save: ')
         else:
-            d20_roll = self.rollD20(advantage_disadvantage=0)
+            d20_roll = self.rollD20(advantage_disadvantage=0, tilt=Tilt)
             self.DM.say('doing a ' + save_text[which_save] + ' save: ')
 
         modifier = self.modifier[which_save]
@@ -813,7 +852,10 @@ class entity:                                          #A Character
             return result
 
     def make_death_save(self):
-        d20_roll = int(random()*20 + 1)
+        if self.DM.dice_tilt is not None and self.team == 0:
+            d20_roll = self.DM.dice_tilt.roll(-1)
+        else:
+            d20_roll = int(random()*20 + 1)
         AuraBonus = self.protection_aura()
         if AuraBonus > 0:
             d20_roll += AuraBonus
@@ -869,8 +911,7 @@ class entity:                                          #A Character
             self.agathys_dmg = 0
             self.DM.say(self.name + ' Armor of Agathys breaks, ')
         else:
-            print(self.name + ' Armor of Agathys broke without having one')
-            quit()
+            raise RuleError(self.name + ' Armor of Agathys broke without having one')
 
     def break_spiritual_weapon(self):
         if self.has_spiritual_weapon:
@@ -907,13 +948,11 @@ class entity:                                          #A Character
             distance = 12.5
 
 
-        EnemiesLeft = [x for x in fight if x.team != self.team and x.state == 1]
-        EnemiesInFront = [Enemy for Enemy in EnemiesLeft if Enemy.position == 0]
-        EnemiesInMid = [Enemy for Enemy in EnemiesLeft if Enemy.position == 1]
+        EnemiesInFront, EnemiesInMid = self.state_table.enemy_lines(fight, self.team)
 
         if self.position < 3: #0,1,2 Front, Mid, Back
-            if len(EnemiesInFront) == 0 and len(EnemiesInMid) == 0: OpenLines=2 #open Front and Mid
-            elif len(EnemiesInFront) == 0: OpenLines = 1 #open front
+            if EnemiesInFront == 0 and EnemiesInMid == 0: OpenLines=2 #open Front and Mid
+            elif EnemiesInFront == 0: OpenLines = 1 #open front
             else: OpenLines = 0 #no open line
         if self.position == 3: #airborn
             if target.position < 3: OpenLines=3 #basically 3 open lines
@@ -935,14 +974,12 @@ class entity:                                          #A Character
         if self.has_range_attack: return False
         if self.dash_target == target: return False
 
-        EnemiesLeft = [x for x in fight if x.team != self.team and x.state == 1]
-        EnemiesInFront = [Enemy for Enemy in EnemiesLeft if Enemy.position == 0]
-        EnemiesInMid = [Enemy for Enemy in EnemiesLeft if Enemy.position == 1]
+        EnemiesInFront, EnemiesInMid = self.state_table.enemy_lines(fight, self.team)
         
         #Open Lines
         if self.position < 3: #0,1,2 Front, Mid, Back
-            if len(EnemiesInFront) == 0 and len(EnemiesInMid) == 0: return False #open Front and Mid
-            elif len(EnemiesInFront) == 0: OpenLines = 1 #open front
+            if EnemiesInFront == 0 and EnemiesInMid == 0: return False #open Front and Mid
+            elif EnemiesInFront == 0: OpenLines = 1 #open front
             else: OpenLines = 0 #no open line
         if self.position == 3: return False #no opp. attacks from the air
 
@@ -962,8 +999,7 @@ class entity:                                          #A Character
             self.DM.say(self.name + ' used an action to disengage', True)
             self.action = 0
         else:
-            print(self.name + ' tried to disengage, but has no action left', True)
-            quit()
+            raise RuleError(self.name + ' tried to disengage, but has no action left')
 
     def enemies_reachable_sort(self,fight, AttackIsRanged = False):
         #This function is used to determine which Enemies are theoretically in reach to attack for a Player
@@ -994,7 +1030,7 @@ class entity:                                          #A Character
         #At the start of turn, a creature desides to go airborn or land
 
         #This includes Character Players that are unconscious        
-        EnemiesNotDead = [x for x in fight if x.team != self.team and (x.state == 1 or (x.team != 1 and x.state == 0))]
+        EnemiesNotDead = self.state_table.enemies_not_dead(fight, self.team)
         
         if AttackIsRanged: return EnemiesNotDead #Everyone in Range
         if self.has_range_attack: return EnemiesNotDead #Everyone in Range
@@ -1054,8 +1090,7 @@ class entity:                                          #A Character
             self.has_dashed_this_round = True
             self.DM.say(self.name + ' uses dash to get to ' + target.name, True)
         else:
-            print(self.name + ' tried to dash, but has no action left', True)
-            quit()
+            raise RuleError(self.name + ' tried to dash, but has no action left')
 
     def move_position(self):
         #This function will be called, if the player hat no target in reach last turn
@@ -1066,8 +1101,7 @@ class entity:                                          #A Character
 
     def use_dodge(self):
         if self.action == 0:
-            print(self.name + ' tried to dodge without action')
-            quit()
+            raise RuleError(self.name + ' tried to dodge without action')
         self.DM.say(self.name + ' uses its turn to dodge', True)
         self.action = 0 #uses an action to do
         DodgeToken(self.TM) #give self a dodge token
@@ -1076,24 +1110,18 @@ class entity:                                          #A Character
 #-------------------Attack Handling----------------------
     def make_attack_check(self, target, fight, is_off_hand):
         if self.action == 0 and self.is_attacking == False and is_off_hand == False:
-            print(self.name + ' tried to attack, but has no action left')
-            quit()
+            raise RuleError(self.name + ' tried to attack, but has no action left')
         elif self.bonus_action == 0 and is_off_hand:
-            print(self.name + ' tried to offhand attack, but has no bonus attacks left')
-            quit()
+            raise RuleError(self.name + ' tried to offhand attack, but has no bonus attacks left')
         elif is_off_hand and self.is_attacking == False:
-            print(self.name + ' tried to offhand attack, but has not attacked with action')
-            quit()
+            raise RuleError(self.name + ' tried to offhand attack, but has not attacked with action')
         elif self.attack_counter < 1 and is_off_hand == False:
-            print(self.name + ' tried to attack, but has no attacks left')
-            quit()
+            raise RuleError(self.name + ' tried to attack, but has no attacks left')
         elif self.state != 1:
-            print(self.name +' treid to attack but is not conscious')
-            quit()
+            raise RuleError(self.name +' treid to attack but is not conscious')
         #check if target is in range
         elif target not in self.enemies_reachable_sort(fight):
-            print(self.name + ' tried to attack, but ' + target.name + ' is out of reach')
-            quit()            
+            raise RuleError(self.name + ' tried to attack, but ' + target.name + ' is out of reach')
 
     def check_dash_and_op_attack(self, target, fight, NeedDash):
         if NeedDash == 1:
@@ -1101,7 +1129,7 @@ class entity:                                          #A Character
         if self.will_provoke_Attack(target, fight):
             if self.no_attack_of_opportunity_yet:#only one per turn
                 #now choose whos doing the attack of opportunity
-                EnemiesLeft = [x for x in fight if x.team != self.team and x.state == 1]
+                EnemiesLeft = self.state_table.enemies_left(fight, self.team)
                 EnemiesInFront = [Enemy for Enemy in EnemiesLeft if Enemy.position == 0]
                 if len(EnemiesInFront) > 0:
                     OpportunityAttacker = EnemiesInFront[int(random()*len(EnemiesInFront))]
@@ -1120,8 +1148,7 @@ class entity:                                          #A Character
         #target is within reach
         NeedDash = self.need_dash(target, fight)
         if NeedDash == 2:
-            print(self.name + ' tried to attack, but ' + target.name + ' is out of reach, this is weird here, check enemies_rechable_sort')
-            quit()
+            raise RuleError(self.name + ' tried to attack, but ' + target.name + ' is out of reach, this is weird here, check enemies_rechable_sort')
         #----attack of opportunity and dash
         self.check_dash_and_op_attack(target, fight, NeedDash)
 
@@ -1237,14 +1264,15 @@ class entity:                                          #A Character
             target.is_guiding_bolted = False #reset being boltet
             
         #Roll the Die to hit
+        Tilt = 1 if target.team == 0 and self.team != 0 else 0 #attacks on heros hit more often in a rare event estimation
         if advantage_disadvantage > 0:
-            d20 = self.rollD20(advantage_disadvantage=1)
+            d20 = self.rollD20(advantage_disadvantage=1, tilt=Tilt)
             self.DM.say('Advantage: ')
         elif advantage_disadvantage < 0:
-            d20 = self.rollD20(advantage_disadvantage=-1)
+            d20 = self.rollD20(advantage_disadvantage=-1, tilt=Tilt)
             self.DM.say('Disadvantage: ')
         else:
-            d20 = self.rollD20(advantage_disadvantage=0)
+            d20 = self.rollD20(advantage_disadvantage=0, tilt=Tilt)
         #The roll and advantage is returned, advantage is still important for sneak attack
         return d20 , advantage_disadvantage
 
@@ -1542,12 +1570,13 @@ class entity:                                          #A Character
         elif self.action == 1:
             self.action = 0
         else:
-            print('no action left for wildshape')
-            quit()
+            raise RuleError('no action left for wildshape')
 
         #A Shape form is choosen and then initiated as entity to use their stats
         ShapeName = self.BeastForms[ShapeIndex]['Name']
-        NewShape = entity(ShapeName, self.team, self.DM, archive=True)
+        if ShapeName not in self.shape_pool:  #every form is only loaded once
+            self.shape_pool[ShapeName] = entity(ShapeName, self.team, self.DM, archive=True)
+        NewShape = self.shape_pool[ShapeName]
         #Use Stats to create dict for shape change function
         ShapeDict = {
             'AC' : NewShape.AC, 
@@ -1580,11 +1609,9 @@ class entity:                                          #A Character
             self.DM.say(self.name + ' drops wild shape', True)
         else:
             if self.is_in_wild_shape == False:
-                print(self.name + ' tried to drop wild shape, but is not in wild shape')
-                quit()
+                raise RuleError(self.name + ' tried to drop wild shape, but is not in wild shape')
             else:
-                print(self.name + ' tried to drop wild shape, but has no bonus action left')
-                quit()
+                raise RuleError(self.name + ' tried to drop wild shape, but has no bonus action left')
 
     def use_combat_wild_shape_heal(self, spell_level=1):
         rules = [self.knows_combat_wild_shape,
@@ -1609,8 +1636,7 @@ class entity:                                          #A Character
             self.reckless = 1
             self.DM.say(self.name + ' uses reckless Attack', True)
         else:
-            print(self.name + ' tried to reckless Attack without knowing it')
-            quit()
+            raise RuleError(self.name + ' tried to reckless Attack without knowing it')
 
     def rage(self):
         #rage dmg is added in attack function
@@ -1629,11 +1655,9 @@ class entity:                                          #A Character
             self.DM.say(rage_text + ' rage', True)
         else:
             if self.bonus_action == 0:
-                print(self.name + ' tried to rage, but has no bonus action')
-                quit()
+                raise RuleError(self.name + ' tried to rage, but has no bonus action')
             elif self.knows_rage == False:
-                print(self.name + ' tried to rage but cant')
-                quit()
+                raise RuleError(self.name + ' tried to rage but cant')
 
     def use_frenzy_attack(self):
         if self.is_in_frenzy and self.bonus_action == 1:
@@ -1641,11 +1665,9 @@ class entity:                                          #A Character
             self.attack_counter += 1  #additional attack
             self.bonus_action = 0
         elif self.bonus_action == 0:
-            print(self.name + ' tried to use frenzy attack without a bonus action')
-            quit()
+            raise RuleError(self.name + ' tried to use frenzy attack without a bonus action')
         elif self.is_in_frenzy == False:
-            print(self.name + ' tried to use franzy attack but is not in a frenzy rage')
-            quit()
+            raise RuleError(self.name + ' tried to use franzy attack but is not in a frenzy rage')
 
     def end_rage(self):
         if self.raged == 1:
@@ -1656,8 +1678,7 @@ class entity:                                          #A Character
 
     def inspire(self, target):
         if self.bonus_action == 0:  #needs a bonus action
-            print(self.name + ' tried to use bardic inspiration but has no bonus action left')
-            quit()
+            raise RuleError(self.name + ' tried to use bardic inspiration but has no bonus action left')
         else:
             if self.inspiration_counter > 0:
                 self.bonus_action = 0
@@ -1671,19 +1692,15 @@ class entity:                                          #A Character
                 self.inspiration_counter -= 1
                 self.DM.say(''.join([self.name,CombatInspirationText,' inspired ',str(target.name),' with awesomeness']), True)
             else:
-                print(self.name + ' tried to use bardic inspiration but has none left')
-                quit()
+                raise RuleError(self.name + ' tried to use bardic inspiration but has none left')
 
     def use_lay_on_hands(self, target, heal):
         if self.action == 0:
-            print(self.name + ' tried to lay on hands, but has no action left')
-            quit()
+            raise RuleError(self.name + ' tried to lay on hands, but has no action left')
         elif heal <= 0:
-            print('Lay on Hands was called with a negative heal')
-            quit()
+            raise RuleError('Lay on Hands was called with a negative heal')
         elif self.lay_on_hands_counter <= 0:
-            print(self.name + ' tried to lay on hands, but has no points left')
-            quit()
+            raise RuleError(self.name + ' tried to lay on hands, but has no points left')
         else:
             if self.lay_on_hands_counter > heal:
                 self.lay_on_hands_counter -= heal
@@ -1800,8 +1817,7 @@ class entity:                                          #A Character
 
     def use_start_of_turn_heal(self):
         if self.start_of_turn_heal <= 0:
-            print(self.name + ' tried to use start of turn heal without having it')
-            quit()
+            raise RuleError(self.name + ' tried to use start of turn heal without having it')
         elif self.state != 1:
             return  #not consious
         else:
@@ -1925,9 +1941,26 @@ class entity:                                          #A Character
     def summon_entity(self, Name, archive=True):
         #This is to initialize a entity
         #For spells like conjure animals
-        summon = entity(Name, self.team, self.DM, archive=True)
+        #Summons come from the pool of the player: a summon of an earlier fight is reset by a
+        #long rest and used again, a new entity is only built if all of them are in this fight
+        pool = self.summon_pool.setdefault(Name, [])
+        used = self.summon_pool_used.get(Name, 0)
+        if used < len(pool):
+            summon = pool[used]
+            summon.long_rest()  #back to the stats of the archive entity
+        else:
+            summon = entity(Name, self.team, self.DM, archive=True)
+            pool.append(summon)
+        self.summon_pool_used[Name] = used + 1
+        summon.team = self.team
+        summon.summoner = self
+        self.state_table.attach(summon)  #the summon is part of the fight table of its summoner
         return summon
 
+    def release_summons(self):
+        #Called at the end of the fight, the pooled summons can be summoned again
+        self.summon_pool_used = {}
+
 #---------------Round Handling------------
     def start_of_turn(self):
         #Attention, is called in the do the fighting function
@@ -2147,8 +2180,7 @@ class entity:                                          #A Character
                 target.changeCHP(Dmg, self, True)
             self.action = 0
         else: 
-            print('Dragon breath could not be used')
-            quit()
+            raise RuleError('Dragon breath could not be used')
 
     def use_recharge_aoe(self, targets):
         #only works if charged at begining of turn
@@ -2166,8 +2198,7 @@ class entity:                                          #A Character
                 target.changeCHP(Dmg, self, True)
             self.action = 0
         else: 
-            print('Recharge AOE could not be used')
-            quit()
+            raise RuleError('Recharge AOE could not be used')
 
     def use_spider_web(self, target):
         if self.knows_spider_web and self.spider_web_is_charged and self.action == 1:
@@ -2182,6 +2213,9 @@ class entity:                                          #A Character
                 SpiderToken.subtype = 'r'  #restrain Target, no break condition yet
             self.action = 0
         else: 
-            print('Spider Web could not be used')
-            quit()
-        
\ No newline at end of file
+            raise RuleError('Spider Web could not be used')
+        
+
+#Hot fields of the entity are columns of its CombatStateTable
+for name, field in state_fields().items():
+    setattr(entity, name, field)
@@ -0,0 +1,29 @@
+#Errors of the simulation engine
+#Everything the engine cannot continue from raises one of these instead of ending the
+#process, so a batch runner can record the fight (seed and roster) and go on with the next.
+#
+#   SimulationError      - base class, catch this to survive any engine error
+#     RuleError          - a player tried something the rules do not allow right now
+#                          (no action left, ability not known, target out of reach, ...)
+#     DecisionError      - the AI reached a dead end or chose something impossible
+#     TokenError         - tokens were linked or resolved in an impossible way
+#     EntityDataError    - an entity file could not be read or has invalid values
+#       DamageTypeError  - unknown damage type
+
+class SimulationError(Exception):
+    pass
+
+class RuleError(SimulationError):
+    pass
+
+class DecisionError(SimulationError):
+    pass
+
+class TokenError(SimulationError):
+    pass
+
+class EntityDataError(SimulationError):
+    pass
+
+class DamageTypeError(EntityDataError):
+    pass
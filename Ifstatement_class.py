@@ -1,3 +1,5 @@
+from Error_class import *
+
 class ifstatements:
     def __init__(self, rules, errors, DM):
         self.rules = rules
@@ -10,5 +12,4 @@ class ifstatements:
         else:
             for i in range(0,len(self.rules)):
                 if self.rules[i] == False:
-                    print(self.errors[i])
-                    quit()
+                    raise RuleError(self.errors[i])
@@ -1,9 +1,10 @@
 from Ifstatement_class import ifstatements
-from random import random
+from simulation_context import random
 from Entity_class import * #should be disabled before running
 from Token_class import *
 from numpy import argmax
 from Dmg_class import dmg
+from Error_class import *
 
 class spell:
     def __init__(self, player):
@@ -97,19 +98,17 @@ class spell:
         #Is reaction Spell break here
         if self.is_reaction_spell:
             if self.player.reaction == 0:
-                print(self.player.name + ' tired to cast ' + self.spell_name + ', but hast no reaction')
-                quit()
+                raise RuleError(self.player.name + ' tired to cast ' + self.spell_name + ', but hast no reaction')
             else:
                 self.player.reaction = 0
                 self.player.spell_slot_counter[cast_level-1] -= 1   #one SpellSlot used
                 return True
         #check if player has cast this round
         elif self.player.has_cast_left == False:
-            print(self.player.name + ' tried to cast ' + self.spell_name + ', but has already cast a spell')
-            quit()
+            raise RuleError(self.player.name + ' tried to cast ' + self.spell_name + ', but has already cast a spell')
         #check is player has action/bonus action left
         elif self.make_action_check() == False:
-            quit()
+            raise RuleError(self.player.name + ' tried to cast ' + self.spell_name + ', but has no action left')
         #everything clear for cast
         else:
             self.player.spell_slot_counter[cast_level-1] -= 1   #one SpellSlot used
@@ -127,7 +126,7 @@ class spell:
         ifstatements(rules, errors, self.DM).check()
         #check is player has action/bonus action left
         if self.make_action_check() == False:
-            quit()
+            raise RuleError(self.player.name + ' tried to cast ' + self.spell_name + ', but has no action left')
         #everything clear for cast
         else:
             return True        
@@ -138,8 +137,7 @@ class spell:
         if self.is_bonus_action_spell:
             #Bonus Action used?
             if self.player.bonus_action == 0:
-                self.DM.say(self.player.name + ' tried to cast ' + self.spell_name + ', but has no Bonus Action left')
-                quit()
+                raise RuleError(self.player.name + ' tried to cast ' + self.spell_name + ', but has no Bonus Action left')
             #Allow cast and use bonus_action
             else:
                 self.player.bonus_action = 0       #Bonus Action used
@@ -161,8 +159,7 @@ class spell:
                     return True
                 #No Bonus Action left
                 else:
-                    print(self.player.name + ' tried to quickened cast ' + self.spell_name + ', but has no Bonus Action left')
-                    quit()
+                    raise RuleError(self.player.name + ' tried to quickened cast ' + self.spell_name + ', but has no Bonus Action left')
             #No Quickened Spell
             else:
                 if self.player.action == 0:
@@ -383,7 +380,7 @@ class attack_spell(spell):
             if CastLevel == False: return self.return_0_score()
 
         #Find a suitable target/targts for this spell
-        Choices = [x for x in fight if x.team != self.player.team]
+        Choices = self.player.state_table.enemies(fight, self.player.team)
         SpellTargets = []
         for i in range(0,self.number_of_attacks):
             #Append as many targets as attack numbers
@@ -400,8 +397,7 @@ class attack_spell(spell):
                 if TwinTarget == False: return self.return_0_score()  #No Target found
                 SpellTargets.append(TwinTarget)
             else:
-                print(self.player.name + ' requested twincast score, but target number does not check out')
-                quit()
+                raise DecisionError(self.player.name + ' requested twincast score, but target number does not check out')
 
         #DMG Score
         Score = 0
@@ -441,8 +437,7 @@ class save_spell(spell):
     def take_effect(self, target, twinned):
         #Take effect on a single target
         #This must be implemented in the subclasses
-        print('The Save Spell has no effect')
-        quit()
+        raise SimulationError('The Save Spell has no effect')
 
 class aoe_dmg_spell(spell):
     #This class is a spell that targts multiple targts with a AOE dmg spell
@@ -714,8 +709,7 @@ class entangle(save_spell):
         #Rewrite cast function to be suited for entangle
         #Entangle takes one target, or two if twinned
         if len(targets) > 2 or len(targets) == 2 and twinned == False: 
-            print('Too many entangle targets')
-            quit()
+            raise RuleError('Too many entangle targets')
         if cast_level == False: cast_level = self.spell_level
         self.autorize_cast(cast_level) #self.cast_level now set
         self.player.DM.say(self.player.name + ' casts ' + self.spell_text, True)
@@ -1163,8 +1157,7 @@ class haste(spell):
     
     def cast(self, targets, cast_level=False, twinned=False):
         if len(targets) > 2 or len(targets) == 2 and twinned == False: 
-            print('Too many entangle targets')
-            quit()
+            raise RuleError('Too many entangle targets')
         super().cast(targets, cast_level, twinned)
         HasteTokens = []
         for target in targets:
@@ -1273,8 +1266,7 @@ class conjure_animals(spell):
 
         Score = 0 #for now
         if player.has_summons:
-            print('Has sommons already')
-            quit() #nonsense
+            raise DecisionError('Has sommons already')
         #Ape has CR 1/2 with +5 to hit, 6.5 dmg, 2 attacks -> 6.5/4 *2attacks /0.5CR -> 6.5dmg/1CR
         #BrownBear CR 1 +5 9.75dmg, 2 attacks -> 4.8dmg/1CR
         #Wolf 7dmg/4 /0.25CR -> 7dmg/1CR
@@ -1385,7 +1377,7 @@ class blight(aoe_dmg_spell):
 
         self.addedDmg = 0  #is later added for plants, undead and constructs
         dmg = self.spell_dmg(CastLevel)
-        Choices = [x for x in fight if x.team != self.player.team]
+        Choices = self.player.state_table.enemies(fight, self.player.team)
         SpellTargets = [self.player.AI.choose_att_target(Choices, AttackIsRanged=True, other_dmg = dmg, other_dmg_type=self.dmg_type, is_silent=True)]
         if SpellTargets == [False]: #No Target
             return self.return_0_score()
@@ -1519,8 +1511,7 @@ class polymorph(spell):
     def cast(self, targets, cast_level=False, twinned=False):
         if type(targets) != list: targets = [targets]
         if len(targets) > 2 or len(targets) == 2 and twinned == False:
-            print('Too many polymorph targets')
-            quit()
+            raise RuleError('Too many polymorph targets')
         super().cast(targets, cast_level, twinned)
 
         #!!!!!!!!!!!!!!!!Still to do:
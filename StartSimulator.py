@@ -1,8 +1,10 @@
 import Encounter_GUI
+import multiprocessing
 import sys
 import os
 
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  #the live estimate of the DM page runs in a worker process
     Encounter_GUI.StartGUI()
\ No newline at end of file
@@ -2,6 +2,7 @@ if __name__ == '__main__':
     from Entity_class import entity
 
 from Dmg_class import *
+from Error_class import *
 #Types:
 #con - concentration
 #l - Link
@@ -308,8 +309,7 @@ class ConcentrationToken(DockToken):
 
         #Check for concentration before initiating
         if TM.player.is_concentrating:
-            print(TM.player.name + ' tried to initiate concentration while concentrated')
-            quit()
+            raise TokenError(TM.player.name + ' tried to initiate concentration while concentrated')
         TM.player.is_concentrating = True #set concentration
 
         super().__init__(TM, links)
@@ -476,11 +476,9 @@ class SummenedToken(LinkToken):
     def resolve(self):
         summon = self.TM.player
         if summon.is_summoned == False:
-            print('This is not a summon')
-            quit()
+            raise TokenError('This is not a summon')
         if summon.summoner == False:
-            print('Should have a summoner')
-            quit()
+            raise TokenError('Should have a summoner')
         
         summon.DM.say(summon.name + ' vanishes ', True)
         summon.CHP = 0
@@ -1,13 +1,231 @@
 #!/usr/bin/env python3.11
+#Encounter simulation service
+#   POST /simulate              small requests, waits for the result
+#   POST /jobs                  large requests, returns a job id at once
+#   GET  /jobs/{job_id}         current estimate and status of a job
+#   GET  /jobs/{job_id}/stream  server-sent events, one estimate per finished chunk
+#   POST /recommend             enemy teams that hit a target difficulty for a party
+#
+#Fights run in chunks on a process pool, every worker reads the entity files once
+#(simulation_worker.warm_up). Identical requests that arrive while a job is running
+#attach to that job instead of starting a new one. Every gunicorn worker (conf.py)
+#owns its own pool, so the service scales by adding workers or machines.
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
 import fastapi
 import uvicorn
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simulation_worker import warm_up, simulate_chunk, merge_chunks, estimate, has_template
+from encounter_xp import MAX_ENEMIES
+from encounter_recommender import EncounterRecommender
+
+POOL_WORKERS = int(os.getenv("SIMULATION_WORKERS", os.cpu_count() or 1))
+CHUNK_SIZE = 25              #fights per pool task, one estimate update per chunk
+MAX_PARTY_SIZE = 8
+SYNC_MAX_REPETITIONS = 500   #larger requests must use /jobs
+MAX_REPETITIONS = 10000
+DEFAULT_TIME_LIMIT = 30.0    #seconds, the job stops and keeps the fights done so far
+MAX_TIME_LIMIT = 300.0
+JOB_TTL = 600                #seconds a finished job can still be polled
+
+executor = None
+recommender = None  #shares the executor, its result cache lives as long as the worker
+jobs = {}           #job id -> Job
+running_jobs = {}   #coalescing key -> Job
+
+
+class EncounterRequest(BaseModel):
+    party: List[str]                  #class names, e.g. "Fighter" (simulated as "Fighter Lv5")
+    enemies: List[str]                #monster names of the Archive
+    repetitions: int = 100
+    time_limit: Optional[float] = None
+
+
+class RecommendRequest(BaseModel):
+    party: List[str]
+    win_low: float = 0.6
+    win_high: float = 0.75
+    min_team_health: float = 0.4
+    top_k: int = 5
+
+
+class Job:
+    def __init__(self, key, request):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.party = sorted(request.party)
+        self.enemies = sorted(request.enemies)
+        self.repetitions = request.repetitions
+        self.time_limit = min(request.time_limit or DEFAULT_TIME_LIMIT, MAX_TIME_LIMIT)
+        self.created = time.time()
+        self.finished = None
+        self.status = 'running'   #running, done, truncated (time limit), failed
+        self.error = None
+        self.total = {}
+        self.changed = asyncio.Event()
+        self.task = None
+
+    def notify(self):
+        #wakes up every stream that waits for this job
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def summary(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'party': self.party,
+            'enemies': self.enemies,
+            'repetitions': self.repetitions,
+            'estimate': estimate(self.total),
+        }
+
+
+def request_key(request):
+    text = '|'.join(sorted(request.party)) + '#' + '|'.join(sorted(request.enemies)) + '#' + str(request.repetitions)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def validate(request, max_repetitions):
+    if not 1 <= len(request.party) <= MAX_PARTY_SIZE:
+        raise fastapi.HTTPException(422, f"party must have 1 to {MAX_PARTY_SIZE} members")
+    if not 1 <= len(request.enemies) <= MAX_ENEMIES:
+        raise fastapi.HTTPException(422, f"enemies must have 1 to {MAX_ENEMIES} members")
+    if not 1 <= request.repetitions <= max_repetitions:
+        raise fastapi.HTTPException(422, f"repetitions must be between 1 and {max_repetitions}")
+    if request.time_limit is not None and request.time_limit <= 0:
+        raise fastapi.HTTPException(422, "time_limit must be positive")
+    unknown = [name for name in [f"{member} Lv5" for member in request.party] + request.enemies if not has_template(name)]
+    if len(unknown) > 0:
+        raise fastapi.HTTPException(422, f"unknown entities: {', '.join(sorted(set(unknown)))}")
 
-api = fastapi.FastAPI()
+def validate_recommendation(request):
+    if not 1 <= len(request.party) <= MAX_PARTY_SIZE:
+        raise fastapi.HTTPException(422, f"party must have 1 to {MAX_PARTY_SIZE} members")
+    if not 0 <= request.win_low <= request.win_high <= 1:
+        raise fastapi.HTTPException(422, "win_low and win_high must be probabilities with win_low <= win_high")
+    if not 1 <= request.top_k <= 20:
+        raise fastapi.HTTPException(422, "top_k must be between 1 and 20")
+    unknown = [member for member in request.party if not has_template(f"{member} Lv5")]
+    if len(unknown) > 0:
+        raise fastapi.HTTPException(422, f"unknown classes: {', '.join(sorted(set(unknown)))}")
+
+async def run_job(job):
+    loop = asyncio.get_running_loop()
+    seed = int(job.key, 16)  #same request, same fights
+    chunks = [min(CHUNK_SIZE, job.repetitions - start) for start in range(0, job.repetitions, CHUNK_SIZE)]
+    #a running chunk cannot be cancelled, it stops starting new fights at the deadline instead,
+    #so the workers are free for the next job right after the time limit
+    deadline = time.time() + job.time_limit
+    futures = [loop.run_in_executor(executor, simulate_chunk, job.party, job.enemies, n, seed + i, None, None, None, deadline) for i, n in enumerate(chunks)]
+    try:
+        for future in asyncio.as_completed(futures, timeout=job.time_limit):
+            merge_chunks(job.total, await future)
+            job.notify()
+        job.status = 'done'
+    except asyncio.TimeoutError:
+        job.status = 'truncated'
+    except Exception as e:
+        job.status = 'failed'
+        job.error = repr(e)
+    finally:
+        for future in futures:
+            future.cancel()  #chunks that did not start yet are dropped
+        job.finished = time.time()
+        running_jobs.pop(job.key, None)
+        job.notify()
+
+def prune_jobs():
+    now = time.time()
+    for job_id in [job_id for job_id, job in jobs.items() if job.finished is not None and now - job.finished > JOB_TTL]:
+        del jobs[job_id]
+
+def get_or_start_job(request):
+    #Coalescing: an identical running request gets the same job
+    prune_jobs()
+    key = request_key(request)
+    job = running_jobs.get(key)
+    if job is None:
+        job = Job(key, request)
+        jobs[job.id] = job
+        running_jobs[key] = job
+        job.task = asyncio.create_task(run_job(job))  #keep a reference, the loop only holds weak ones
+    return job
+
+def get_job(job_id):
+    if job_id not in jobs:
+        raise fastapi.HTTPException(404, "unknown or expired job")
+    return jobs[job_id]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global executor, recommender
+    executor = ProcessPoolExecutor(POOL_WORKERS, initializer=warm_up)
+    recommender = EncounterRecommender(pool=executor)
+    yield
+    executor.shutdown(wait=False, cancel_futures=True)
+
+api = fastapi.FastAPI(lifespan=lifespan)
 
 @api.get('/')
-def calculate():
-    answer = 24 + 18
-    return {'answer': answer}
+def status():
+    return {'workers': POOL_WORKERS, 'running_jobs': len(running_jobs), 'jobs': len(jobs)}
+
+@api.post('/simulate')
+async def simulate(request: EncounterRequest):
+    validate(request, SYNC_MAX_REPETITIONS)
+    job = get_or_start_job(request)
+    while job.finished is None:
+        await job.changed.wait()
+    if job.status == 'failed':
+        raise fastapi.HTTPException(500, job.error)
+    return job.summary()
+
+@api.post('/jobs')
+async def submit(request: EncounterRequest):
+    validate(request, MAX_REPETITIONS)
+    return get_or_start_job(request).summary()
+
+@api.get('/jobs/{job_id}')
+async def poll(job_id: str):
+    return get_job(job_id).summary()
+
+@api.get('/jobs/{job_id}/stream')
+async def stream(job_id: str):
+    job = get_job(job_id)
+
+    async def events():
+        while True:
+            changed = job.changed  #taken before the summary, so no update is missed
+            yield f"data: {json.dumps(job.summary())}\n\n"
+            if job.finished is not None:
+                break
+            await changed.wait()
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+@api.post('/recommend')
+async def recommend(request: RecommendRequest):
+    validate_recommendation(request)
+    #the race waits on the pool, a thread keeps the event loop free for the other requests
+    recommendations = await asyncio.to_thread(recommender.recommend, sorted(request.party),
+                                              win_range=(request.win_low, request.win_high),
+                                              min_team_health=request.min_team_health, top_k=request.top_k)
+    return {'party': sorted(request.party), 'recommendations': recommendations}
 
-# To test this app locally, uncomment this line:
-uvicorn.run(api, host="localhost", port=8000)
\ No newline at end of file
+# To test this app locally, run this file
+if __name__ == '__main__':
+    uvicorn.run(api, host="localhost", port=8000)
@@ -0,0 +1,108 @@
+#Adaptive fight scheduler of the batch jobs (matchup_matrix.py, multiplier_calibration.py)
+#A job is a set of cells, every cell is one encounter. Every cell starts with
+#initial_fights, then more batches go to the cells whose win probability is still the most
+#uncertain, until every cell is below target_error, the fight budget is used or the time
+#limit is reached. The dice of a batch only depend on its cell and its number
+#(simulation_worker.cell_seed).
+#
+#Every batch is appended to a checkpoint file as one json line
+#   {'cell', 'batch', 'fights', 'wins', 'team_health', 'failures'} or {'cell', 'batch', 'error'}
+#a restarted job (or a longer second run) sums the checkpoint and continues from there.
+#
+#   stats = read_checkpoint(checkpoint_file, cells)
+#   run_adaptive(stats, task_of, play_encounter_batch, checkpoint_file)
+
+import numpy as np
+from multiprocessing import Pool
+import time
+import json
+import os
+
+
+def new_cell():
+    return {'fights': 0, 'wins': 0.0, 'team_health': 0.0, 'batches': 0, 'failed': False}
+
+def add_record(cell, record):
+    #Adds a batch to the sums of its cell, returns the fights played
+    cell['batches'] = max(cell['batches'], record['batch'] + 1)
+    if 'error' in record:
+        cell['failed'] = True  #a cell whose roster cannot be built gets no more batches
+        return 0
+    for key in ['fights', 'wins', 'team_health']:
+        cell[key] += record[key]
+    return record['fights']
+
+def read_checkpoint(checkpoint_file, cell_keys):
+    #cell key -> sums of the batches in the checkpoint, records of other cells are ignored
+    stats = {cell_key: new_cell() for cell_key in cell_keys}
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  #line cut off by a killed job
+                if record['cell'] in stats:
+                    add_record(stats[record['cell']], record)
+    return stats
+
+def error_of(cell):
+    #standard error of the win probability, with a Beta(1, 1) prior so 0 or 1 wins are not certain
+    n = cell['fights']
+    p = (cell['wins'] + 1)/(n + 2)
+    return np.sqrt(p*(1 - p)/(n + 2))
+
+def next_batches(stats, initial_fights, batch_fights, max_fights, target_error):
+    #(priority, cell key, fights) of the next round, cells below initial_fights first
+    tasks = []
+    for cell_key, cell in stats.items():
+        if cell['failed'] or cell['fights'] >= max_fights:
+            continue
+        if cell['fights'] < initial_fights:
+            tasks.append((error_of(cell) + 1, cell_key, initial_fights - cell['fights']))
+        elif error_of(cell) > target_error:
+            tasks.append((error_of(cell), cell_key, min(batch_fights, max_fights - cell['fights'])))
+    return sorted(tasks, reverse=True)
+
+def run_adaptive(stats, task_of, play_batch, checkpoint_file, initial_fights=20, batch_fights=20, max_fights=200,
+                 target_error=0.05, budget=None, time_limit=None, processes=None, initializer=None):
+    #stats: from read_checkpoint, updated in place
+    #task_of(cell_key, batch, fights): pool task of play_batch (simulation_worker.play_roster_batch
+    #or play_encounter_batch), which returns the checkpoint record of the batch
+    #budget: most fights of this run, time_limit: seconds after which no new batches are started
+    start = time.time()
+
+    def over_time():
+        return time_limit is not None and time.time() - start > time_limit
+
+    spent = 0
+    pool = Pool(processes, initializer=initializer) if processes != 1 else None
+    try:
+        with open(checkpoint_file, 'a') as checkpoint:
+            while not over_time():
+                tasks = next_batches(stats, initial_fights, batch_fights, max_fights, target_error)
+                if budget is not None:
+                    tasks = tasks[0:max(0, (budget - spent)//batch_fights)]
+                if len(tasks) == 0:
+                    break
+                print('Batches in this round: ' + str(len(tasks)))
+                jobs = []
+                for priority, cell_key, fights in tasks:
+                    jobs.append(task_of(cell_key, stats[cell_key]['batches'], fights))
+                    stats[cell_key]['batches'] += 1
+                results = pool.imap_unordered(play_batch, jobs) if pool is not None else map(play_batch, jobs)
+                for record in results:
+                    checkpoint.write(json.dumps(record) + '\n')
+                    checkpoint.flush()
+                    spent += add_record(stats[record['cell']], record)
+                    if over_time():
+                        print('Time limit reached')
+                        break
+    finally:
+        if pool is not None:
+            if over_time():
+                pool.terminate()  #batches still queued are not needed any more
+            else:
+                pool.close()
+            pool.join()
+    return stats
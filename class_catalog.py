@@ -0,0 +1,158 @@
+#Feature catalog of the player classes in Classes/
+#Reads every class file once per process and keeps the numeric features, the
+#categorical vocabularies, the column ranges of the encoded matrix and the decoded
+#features of every class. The questionnaire UI and the generation of
+#precomputed_party_data.npz both use get_class_catalog, so they always agree on the encoding.
+#
+#Encoded class row (float64):
+#   numerical features, then every categorical feature in a block of its max length.
+#   Categorical values are coded with their position in the sorted vocabulary + 1,
+#   0 is an empty slot. Party rows that are not used are filled with -1.
+
+import numpy as np
+import threading
+import time
+import json
+import os
+
+NUMERICAL_FEATURES = [
+    "AC", "HP", "Proficiency", "To_Hit", "Attacks", "DMG",
+    "Str", "Dex", "Con", "Int", "Wis", "Cha",
+    "Spell_DC", "Spell_Mod", "Spell_Slot_1", "Spell_Slot_2", "Spell_Slot_3",
+    "Speed", "Range_Attack"
+]
+CAT_SET_1 = ["Saves_Proficiency", "Damage_Type", "Position"]
+CAT_SET_2 = ["Spell_List"]
+CAT_SET_3 = ["Other_Abilities"]
+CATEGORICAL_FEATURES = CAT_SET_1 + CAT_SET_2 + CAT_SET_3
+
+MAX_PARTY_SIZE = 8
+CLASS_SUFFIX = " Lv5.json"
+
+
+def directory_signature(class_files_path):
+    #Changes when a class file is added, removed or edited
+    signature = []
+    for entry in sorted(os.scandir(class_files_path), key=lambda entry: entry.name):
+        if entry.name.endswith(".json"):
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ClassCatalog:
+    def __init__(self, class_files_path):
+        self.path = class_files_path
+        self.signature = directory_signature(class_files_path)
+        self.numerical_features = NUMERICAL_FEATURES
+        self.categorical_features = CATEGORICAL_FEATURES
+        self.cat_sets = (CAT_SET_1, CAT_SET_2, CAT_SET_3)
+
+        self.raw = {}  #class name -> content of the json file
+        for file_name, mtime, size in self.signature:
+            with open(os.path.join(class_files_path, file_name), "r") as f:
+                class_name = file_name[:-len(CLASS_SUFFIX)] if file_name.endswith(CLASS_SUFFIX) else file_name[:-5]
+                self.raw[class_name] = json.load(f)
+
+        self.categorical_max_lengths = {feature: 0 for feature in CATEGORICAL_FEATURES}
+        value_sets = {feature: set() for feature in CATEGORICAL_FEATURES}
+        for data in self.raw.values():
+            for feature in CATEGORICAL_FEATURES:
+                values = str(data.get(feature, "")).split()
+                self.categorical_max_lengths[feature] = max(self.categorical_max_lengths[feature], len(values))
+                value_sets[feature].update(values)
+        #sorted, so the codes do not depend on the set order of the process
+        self.categorical_value_sets = {feature: sorted(values) for feature, values in value_sets.items()}
+        self.vocabulary = {feature: {value: i+1 for i, value in enumerate(values)} for feature, values in self.categorical_value_sets.items()}
+
+        self.index_ranges = {"numerical": (0, len(NUMERICAL_FEATURES))}
+        self.feature_slices = {}  #categorical feature -> (start, stop) column of its block
+        start = len(NUMERICAL_FEATURES)
+        for set_name, cat_set in zip(["cat_set_1", "cat_set_2", "cat_set_3"], self.cat_sets):
+            set_start = start
+            for feature in cat_set:
+                self.feature_slices[feature] = (start, start + self.categorical_max_lengths[feature])
+                start += self.categorical_max_lengths[feature]
+            self.index_ranges[set_name] = (set_start, start)
+        self.feature_count = start
+
+        self.features = {}  #class name -> decoded features as shown in the UI
+        self.vectors = {}   #class name -> encoded row
+        for class_name, data in self.raw.items():
+            self.features[class_name] = self._decode(data)
+            self.vectors[class_name] = self._encode(data)
+
+    def _decode(self, data):
+        class_features = {}
+        for feature in NUMERICAL_FEATURES:
+            class_features[feature] = data.get(feature, 0)
+        for feature in CATEGORICAL_FEATURES:
+            values = str(data.get(feature, "")).split()
+            valid_values = [val for val in values if val in self.vocabulary[feature]]
+            class_features[feature] = valid_values if valid_values else ["Unknown"]
+        return class_features
+
+    def _encode(self, data):
+        row = np.zeros(self.feature_count, dtype=np.float64)
+        for i, feature in enumerate(NUMERICAL_FEATURES):
+            row[i] = float(data.get(feature, 0))
+        for feature in CATEGORICAL_FEATURES:
+            start, stop = self.feature_slices[feature]
+            codes = [self.vocabulary[feature][value] for value in str(data.get(feature, "")).split()]
+            row[start:start + len(codes)] = codes
+        return row
+
+    def class_features(self, class_name):
+        if class_name not in self.features:
+            raise FileNotFoundError(f"Class file not found: {class_name}{CLASS_SUFFIX}")
+        return {key: list(value) if isinstance(value, list) else value for key, value in self.features[class_name].items()}
+
+    def encode_party(self, class_names, max_party_size=MAX_PARTY_SIZE):
+        #Matrix [max_party_size, feature_count], unused rows are -1
+        matrix = np.full((max_party_size, self.feature_count), -1, dtype=np.float64)
+        for i, class_name in enumerate(class_names):
+            if class_name not in self.vectors:
+                raise FileNotFoundError(f"Class file not found: {class_name}{CLASS_SUFFIX}")
+            matrix[i] = self.vectors[class_name]
+        return matrix
+
+    def constants(self):
+        #Same tuple as streamlit.extract_feature_constants returned
+        return (
+            self.numerical_features,
+            self.categorical_features,
+            self.categorical_max_lengths,
+            {key: list(values) for key, values in self.categorical_value_sets.items()},
+            self.index_ranges,
+            self.cat_sets
+        )
+
+    def vocabulary_json(self):
+        #Everything needed to decode a matrix without the class files
+        return {
+            "numerical_features": self.numerical_features,
+            "categorical_value_sets": self.categorical_value_sets,
+            "categorical_max_lengths": self.categorical_max_lengths,
+            "feature_slices": self.feature_slices,
+            "index_ranges": self.index_ranges,
+            "feature_count": self.feature_count
+        }
+
+
+_catalogs = {}  #absolute path -> [catalog, time of the last signature check]
+_catalog_lock = threading.Lock()
+
+def get_class_catalog(class_files_path="Classes/", check_interval=2.0):
+    #Cached per process. The folder is checked for changes at most every
+    #check_interval seconds, so a rerun does not stat the class files every time.
+    path = os.path.abspath(class_files_path)
+    now = time.monotonic()
+    with _catalog_lock:
+        cached = _catalogs.get(path)
+        if cached is not None and now - cached[1] < check_interval:
+            return cached[0]
+        if cached is None or directory_signature(path) != cached[0].signature:
+            cached = [ClassCatalog(path), now]
+            _catalogs[path] = cached
+        cached[1] = now
+        return cached[0]
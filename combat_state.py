@@ -0,0 +1,227 @@
+#Fight level state table: the hot fields of every combatant as numpy columns, one row per entity
+#(summons included). Every assignment to these attributes of an entity also writes its row
+#(descriptors below), so player.CHP, player.state, player.is_stunned, ... keep working
+#everywhere, while scans over the fight (team health, who is still standing, AoE targets,
+#statistics) are single numpy operations on the table instead of attribute walks.
+#
+#Outside of a fight an entity is on NO_TABLE, a shared table without rows: it only keeps its
+#attributes, the fight scans walk the fight list they are given. do_the_fighting builds one table for the fight and attaches all fighters to it,
+#summon_entity attaches the summons to the table of the summoner. Attaching copies the
+#current values into the row. A summon that leaves the fight is detached, its row stays
+#but is not live anymore and is left out of the scans.
+
+import numpy as np
+from itertools import compress
+
+VECTOR_MIN_ROWS = 48  #smaller fights walk the entities, numpy has a fixed cost per scan
+SAVES = ['Str', 'Dex', 'Con', 'Int', 'Wis', 'Cha']
+#field -> numpy type
+FIELDS = {
+    'CHP': np.float64,
+    'HP': np.int32,
+    'AC': np.int32,
+    'team': np.int32,
+    'state': np.int8,     # 1 - alive, 0 - unconscious, -1 dead
+    'position': np.int8,  #0 - front, 1 - mid, 2 - back, 3 - airborne
+    'speed': np.int32,
+}
+#condition -> bit of the conditions column
+CONDITIONS = {
+    'restrained': 1 << 0,
+    'prone': 1 << 1,
+    'is_blinded': 1 << 2,
+    'is_dodged': 1 << 3,
+    'is_stunned': 1 << 4,
+    'is_incapacitated': 1 << 5,
+    'is_paralyzed': 1 << 6,
+    'is_poisoned': 1 << 7,
+    'is_invisible': 1 << 8,
+}
+
+
+class StateField:
+    #Write through: the entity keeps reading its own attribute (no __get__, so reads are as
+    #fast as before), every assignment also updates its row of entity.state_table
+    def __init__(self, name):
+        self.name = name
+
+    def __set__(self, entity, value):
+        entity.__dict__[self.name] = value
+        if entity.state_table is not NO_TABLE:
+            entity.state_table.columns[self.name][entity.state_row] = value
+
+class ConditionFlag:
+    #Same for a condition, stored as one bit of the conditions column
+    def __init__(self, name, bit):
+        self.name = name
+        self.bit = bit
+
+    def __set__(self, entity, value):
+        entity.__dict__[self.name] = value
+        if entity.state_table is NO_TABLE:
+            return
+        conditions = entity.state_table.conditions
+        if value:
+            conditions[entity.state_row] |= self.bit
+        else:
+            conditions[entity.state_row] &= ~np.uint32(self.bit)
+
+def state_fields():
+    #Descriptors for the entity class: {attribute name: descriptor}
+    fields = {name: StateField(name) for name in FIELDS}
+    for name, bit in CONDITIONS.items():
+        fields[name] = ConditionFlag(name, bit)
+    return fields
+
+
+class CombatStateTable:
+    def __init__(self, capacity=8):
+        self.size = 0
+        self.entities = []
+        self.fight = []  #the fight list whose entities are the rows, in order
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in FIELDS.items()}
+        self.conditions = np.zeros(capacity, dtype=np.uint32)
+        self.saves = np.zeros((capacity, 6))  #save modifier incl. proficiency
+        self.live = np.zeros(capacity, dtype=bool)  #False for summons that left the fight
+
+    def grow(self):
+        capacity = max(2*len(self.conditions), 8)
+        for name in self.columns:
+            self.columns[name] = np.resize(self.columns[name], capacity)
+        self.conditions = np.resize(self.conditions, capacity)
+        self.saves = np.resize(self.saves, (capacity, 6))
+        self.live = np.resize(self.live, capacity)
+
+    def new_row(self, entity):
+        #Empty row for an entity that is being initialized
+        if self.size == len(self.conditions):
+            self.grow()
+        row = self.size
+        self.size += 1
+        self.entities.append(entity)
+        for column in self.columns.values():
+            column[row] = 0
+        self.conditions[row] = 0
+        self.saves[row] = 0
+        self.live[row] = True
+        return row
+
+    def attach(self, entity):
+        #Moves the entity to this table, its current values are copied. An entity that has
+        #a row here already (a pooled summon summoned again) gets that row back
+        if entity.state_table is self and entity.state_row < self.size and self.entities[entity.state_row] is entity:
+            self.live[entity.state_row] = True
+            return entity.state_row
+        row = self.new_row(entity)
+        for name, column in self.columns.items():
+            column[row] = entity.__dict__.get(name, 0)
+        for name, bit in CONDITIONS.items():
+            if entity.__dict__.get(name, False):
+                self.conditions[row] |= bit
+        entity.state_table, entity.state_row = self, row
+        if 'saves_prof' in entity.__dict__:  #not yet during __init__
+            self.update_saves(entity)
+        return row
+
+    def detach(self, entity):
+        #The entity left the fight, its row is kept for the statistics of the fight
+        if entity.state_table is self:
+            self.live[entity.state_row] = False
+
+    def update_saves(self, entity):
+        self.saves[entity.state_row] = [entity.modifier[i] + (entity.proficiency if SAVES[i] in entity.saves_prof else 0) for i in range(0, 6)]
+
+    #---------------Vectorized views---------------
+    def column(self, name):
+        return self.columns[name][0:self.size]
+
+    def rows_of(self, entities):
+        return np.array([entity.state_row for entity in entities if entity.state_table is self], dtype=int)
+
+    def present(self):
+        #rows of the entities that are in the fight
+        return self.live[0:self.size]
+
+    def standing(self, team=None):
+        #CHP > 0, optionally of one team
+        mask = (self.column('CHP') > 0) & self.present()
+        if team is not None:
+            mask &= self.column('team') == team
+        return mask
+
+    def teams_standing(self):
+        if self.size < VECTOR_MIN_ROWS:
+            return set(x.team for x in self.fight if x.CHP > 0)
+        return np.unique(self.column('team')[self.standing()])
+
+    def team_health(self, team):
+        #current HP of the standing members of a team
+        if self.size < VECTOR_MIN_ROWS:
+            return sum(x.CHP for x in self.fight if x.team == team and x.CHP > 0)
+        return float(np.sum(self.column('CHP')[self.standing(team)]))
+
+    def has_condition(self, condition):
+        return self.conditions[0:self.size] & CONDITIONS[condition] != 0
+
+    def targets(self, team, position=None):
+        #Rows of the alive enemies of team, optionally only the ones at one position
+        mask = (self.column('state') == 1) & (self.column('team') != team) & self.present()
+        if position is not None:
+            mask &= self.column('position') == position
+        return np.flatnonzero(mask)
+
+    def entities_at(self, rows):
+        return [self.entities[row] for row in rows]
+
+    def entities_where(self, mask):
+        return list(compress(self.entities, mask.tolist()))
+
+    #---------------Fight scans---------------
+    #Same lists as the comprehensions over the fight list they replace, in fight order.
+    #numpy only pays off for large fights (hordes): the table is used if fight is the fight
+    #list of do_the_fighting (its rows in order, summons are attached when they are
+    #appended) and has at least VECTOR_MIN_ROWS rows, otherwise the entities are walked.
+    def vectorize(self, fight):
+        return fight is self.fight and self.size >= VECTOR_MIN_ROWS
+
+    def enemies_left(self, fight, team):
+        #[x for x in fight if x.team != team and x.state == 1]
+        if not self.vectorize(fight):
+            return [x for x in fight if x.team != team and x.state == 1]
+        return self.entities_where((self.column('team') != team) & (self.column('state') == 1) & self.present())
+
+    def enemies_not_dead(self, fight, team):
+        #alive enemies and unconscious heros (they can still be killed)
+        if not self.vectorize(fight):
+            return [x for x in fight if x.team != team and (x.state == 1 or (x.team != 1 and x.state == 0))]
+        teams, states = self.column('team'), self.column('state')
+        return self.entities_where((teams != team) & ((states == 1) | ((teams != 1) & (states == 0))) & self.present())
+
+    def enemies(self, fight, team):
+        #[x for x in fight if x.team != team], any state
+        if not self.vectorize(fight):
+            return [x for x in fight if x.team != team]
+        return self.entities_where((self.column('team') != team) & self.present())
+
+    def enemy_lines(self, fight, team):
+        #Number of alive enemies in the front and in the mid line
+        if not self.vectorize(fight):
+            positions = [x.position for x in fight if x.team != team and x.state == 1]
+            return positions.count(0), positions.count(1)
+        positions = self.column('position')[(self.column('team') != team) & (self.column('state') == 1) & self.present()]
+        return int(np.count_nonzero(positions == 0)), int(np.count_nonzero(positions == 1))
+
+    def opponents(self, fight, team):
+        #[x for x in fight if x.team != team and x.state != -1]
+        if not self.vectorize(fight):
+            return [x for x in fight if x.team != team and x.state != -1]
+        return self.entities_where((self.column('team') != team) & (self.column('state') != -1) & self.present())
+
+    def allies_left(self, fight, team):
+        #[x for x in fight if x.team == team and x.state != -1]
+        if not self.vectorize(fight):
+            return [x for x in fight if x.team == team and x.state != -1]
+        return self.entities_where((self.column('team') == team) & (self.column('state') != -1) & self.present())
+
+
+NO_TABLE = CombatStateTable(0)  #table of every entity that is not in a fight
@@ -0,0 +1,138 @@
+#Contribution of every hero to the win probability of an encounter
+#A coalition is a subset of the heroes fighting the full enemy team. Every coalition
+#is played on the same list of fight seeds (common random numbers), so the difference
+#between two coalitions is measured on the same dice as far as the fights stay alike,
+#and most of the noise cancels out.
+#
+#   method='shapley'        permutation sampling of the Shapley value. Every permutation
+#                           walks from the empty team to the full team, each coalition of
+#                           the walk is played once and used for two marginals.
+#   method='leave_one_out'  full team against the team without one hero, the full team
+#                           is played once and shared by all heroes.
+#
+#The sample unit of the confidence interval is one permutation (shapley) or one
+#fight seed (leave_one_out), each with its own seeds.
+
+import numpy as np
+from multiprocessing import Pool
+import random
+
+from simulation_worker import play_seeded_roster, warm_up, dm_settings
+
+Z_95 = 1.96
+
+
+def roster_of(fighters):
+    #Picklable description of the fighters: (name, team, json data)
+    return [(fighter.orignial_name, fighter.team, fighter.data) for fighter in fighters]
+
+def play_seeded_fights(task):
+    #Pool task: wins of team 0 (1/0) of the roster on the given seeds
+    roster, seeds, settings = task
+    return play_seeded_roster(roster, seeds, settings=settings)['win']
+
+
+class CoalitionEvaluator:
+    #Plays coalitions in batches, on a pool or in process (processes=1)
+    #Coalitions are frozensets of hero positions, results are cached per (coalition, seeds)
+    #settings: simulation_worker.dm_settings the fights are played with
+    def __init__(self, heroes, enemies, processes=None, settings=None):
+        self.heroes = heroes
+        self.enemies = enemies
+        self.processes = processes
+        self.settings = settings
+        self.cache = {}
+        self.fights_played = 0
+
+    def evaluate(self, requests):
+        #requests: list of (coalition, seeds), returns the outcomes in the same order
+        todo = []
+        queued = set()
+        for coalition, seeds in requests:
+            key = (coalition, tuple(seeds))
+            if key not in self.cache and key not in queued and len(coalition) > 0:
+                roster = [self.heroes[i] for i in sorted(coalition)] + self.enemies
+                todo.append((key, (roster, list(seeds), self.settings)))
+                queued.add(key)
+        tasks = [task for key, task in todo]
+        if self.processes == 1 or len(tasks) <= 1:
+            results = map(play_seeded_fights, tasks)
+        else:
+            pool = Pool(self.processes, initializer=warm_up)
+            results = pool.map(play_seeded_fights, tasks)
+            pool.close()
+            pool.join()
+        for (key, task), outcomes in zip(todo, results):
+            self.cache[key] = outcomes
+            self.fights_played += len(outcomes)
+        return [self.cache[(coalition, tuple(seeds))] if len(coalition) > 0 else np.zeros(len(seeds)) for coalition, seeds in requests]
+
+
+def summarize(names, samples, full_team_win):
+    #samples: array [units, heroes] of marginal contributions
+    units = samples.shape[0]
+    mean = samples.mean(axis=0)
+    if units > 1:
+        error = samples.std(axis=0, ddof=1)/np.sqrt(units)
+    else:
+        error = np.full(len(names), np.nan)
+    return [{
+        'name': names[i],
+        'contribution': float(mean[i]),
+        'ci_low': float(mean[i] - Z_95*error[i]),
+        'ci_high': float(mean[i] + Z_95*error[i]),
+        'full_team_win': float(full_team_win),
+    } for i in range(0, len(names))]
+
+def contribution_analysis(fighters, method='shapley', permutations=8, fights=10, processes=None, seed=0):
+    #fighters: the entities of one encounter, heroes are team 0, the fights use the settings
+    #of their DM (density, fidelity, horde mode, termination)
+    #shapley: permutations x fights fights per coalition of every walk
+    #leave_one_out: fights seeds, the same for the full team and every reduced team
+    #Returns the per hero results (contribution = win probability added) and the fights played
+    heroes = [item for item in roster_of(fighters) if item[1] == 0]
+    enemies = [item for item in roster_of(fighters) if item[1] != 0]
+    names = [name for name, team, data in heroes]
+    n = len(heroes)
+    evaluator = CoalitionEvaluator(heroes, enemies, processes, dm_settings(fighters[0].DM))
+    rng = random.Random(seed)
+    full_team = frozenset(range(0, n))
+
+    if method == 'leave_one_out':
+        seeds = [rng.getrandbits(32) for k in range(0, fights)]
+        requests = [(full_team, seeds)] + [(full_team - {i}, seeds) for i in range(0, n)]
+        results = evaluator.evaluate(requests)
+        samples = np.stack([results[0] - results[i+1] for i in range(0, n)], axis=1)  #[fights, heroes]
+        full_team_win = results[0].mean()
+    elif method == 'shapley':
+        walks = []
+        requests = []
+        for p in range(0, permutations):
+            order = list(range(0, n))
+            rng.shuffle(order)
+            seeds = [rng.getrandbits(32) for k in range(0, fights)]
+            walks.append((order, seeds))
+            for j in range(1, n+1):
+                requests.append((frozenset(order[0:j]), seeds))
+        results = evaluator.evaluate(requests)
+        samples = np.zeros((permutations, n))
+        full_team_win = np.mean([results[p*n + n - 1].mean() for p in range(0, permutations)])
+        for p, (order, seeds) in enumerate(walks):
+            values = [0.0] + [results[p*n + j - 1].mean() for j in range(1, n+1)]  #empty team never wins
+            for j, hero in enumerate(order):
+                samples[p, hero] = values[j+1] - values[j]
+    else:
+        raise ValueError('Unknown method: ' + str(method))
+
+    return summarize(names, samples, full_team_win), evaluator.fights_played
+
+def print_contributions(contributions):
+    for item in sorted(contributions, key=lambda item: -item['contribution']):
+        print(item['name'] + ' : ' + str(round(item['contribution']*100, 1)) + ' % [' + str(round(item['ci_low']*100, 1)) + ', ' + str(round(item['ci_high']*100, 1)) + ']')
+
+if __name__ == '__main__':
+    from simulation_worker import build_fighters
+    fighters = build_fighters(['Fighter', 'Rogue', 'Wizard', 'Cleric'], ['Ogre', 'Ogre', 'Giant Spider'])
+    contributions, fights_played = contribution_analysis(fighters)
+    print_contributions(contributions)
+    print('Fights played: ' + str(fights_played))
@@ -0,0 +1,249 @@
+#Damage race: closed form difficulty estimate of an encounter, no dice rolled
+#For every attacker and defender of the Archive the expected damage of one round is
+#computed once from the entity files: weapon attacks against the AC (crit on 20, or 19
+#with ImprovedCritical, crit damage x1.8 like Entity.attack, advantage with
+#RecklessAttack, sneak attack once if any attack hits, rage damage per hit) and the damage
+#spells of the spell list while the slots last (attack roll against the AC, or save
+#against the spell DC with half damage on a success). Damage types use the
+#resistances, immunities and vulnerabilities of the defender.
+#
+#An encounter is two count vectors (classes, monsters). Both sides hit the mix of the
+#other side every round, the damage of a side shrinks with the HP it has left
+#(mean field attrition). The rounds each side needs to defeat the other give
+#   win probability = sigmoid(RACE_SLOPE * log(rounds heroes need to fall / rounds enemies need to fall) + RACE_OFFSET)
+#Everything runs on [encounters, ...] arrays, thousands of encounters take milliseconds.
+#Healing, conditions, positions and initiative are left out: a first filter and a
+#sanity check for the simulation, not a replacement.
+
+import numpy as np
+
+from simulation_worker import load_template, has_template
+from surrogate_model import CLASSES, MONSTERS, counts
+
+MAX_ROUNDS = 30
+RACE_CAP = 3   #rounds to defeat a side are capped at RACE_CAP*MAX_ROUNDS
+#fitted with fit_race_calibration on surrogate_model/training.jsonl (1500 simulated encounters)
+RACE_SLOPE = 0.62
+RACE_OFFSET = 1.36
+
+SAVES = ['Str', 'Dex', 'Con', 'Int', 'Wis', 'Cha']
+#Damage spells of the engine: slot level, kind, mean damage per target, damage type,
+#targets of an area spell. Cantrips use the Lv5 damage of Spell_class.
+SPELLS = {
+    'FireBolt': (0, 'attack', 11.0, 'fire', 1),
+    'ChillTouch': (0, 'attack', 9.0, 'necrotic', 1),
+    'EldritchBlast': (0, 'attack', 11.0, 'force', 1),   #2 beams of 1d10
+    'MagicMissile': (1, 'auto', 10.5, 'force', 1),
+    'GuidingBolt': (1, 'attack', 14.0, 'radiant', 1),
+    'BurningHands': (1, 'Dex', 10.5, 'fire', 2),
+    'ScorchingRay': (2, 'attack', 21.0, 'fire', 1),     #3 rays of 2d6
+    'Shatter': (2, 'Con', 13.5, 'thunder', 2),
+    'Fireball': (3, 'Dex', 28.0, 'fire', 3),
+}
+
+
+#---------------Per entity---------------
+class Combatant:
+    #The numbers of one entity file the race needs
+    def __init__(self, name):
+        self.name = name
+        self.known = has_template(name)
+        data = load_template(name) if self.known else {}
+        self.hp = float(data.get('HP', 0))
+        self.ac = float(data.get('AC', 10))
+        self.to_hit = float(data.get('To_Hit', 0))
+        self.attacks = float(data.get('Attacks', 0))
+        self.dmg = float(data.get('DMG', 0))
+        self.damage_type = str(data.get('Damage_Type', 'slashing'))
+        self.resistances = str(data.get('Damage_Resistance', 'none'))
+        self.immunities = str(data.get('Damage_Immunity', 'none'))
+        self.vulnerabilities = str(data.get('Damage_Vulnerabilities', 'none'))
+        abilities = str(data.get('Other_Abilities', ''))
+        self.crit_chance = 0.1 if 'ImprovedCritical' in abilities else 0.05
+        self.advantage = 'RecklessAttack' in abilities
+        self.sneak_attack = float(data.get('Sneak_Attack_Dmg', 0))
+        self.rage_dmg = float(data.get('RageDmg', 0))
+        proficiency = float(data.get('Proficiency', 0))
+        self.spell_dc = float(data.get('Spell_DC', 0))
+        self.spell_to_hit = float(data.get('Spell_Mod', 0)) + proficiency
+        self.slots = [int(data.get('Spell_Slot_' + str(level), 0)) for level in range(1, 10)]
+        self.spells = [spell for spell in str(data.get('Spell_List', '')).split() if spell in SPELLS]
+        #same modifier as Entity: round((stat - 10)/2 - 0.1)
+        proficient = str(data.get('Saves_Proficiency', '')).split()
+        self.saves = {save: round((float(data.get(save, 10)) - 10)/2 - 0.1) + (proficiency if save in proficient else 0) for save in SAVES}
+
+    def type_factor(self, damage_type):
+        #same substring rule as the dmg class of the engine
+        if damage_type in self.vulnerabilities:
+            return 2.0
+        if damage_type in self.resistances:
+            return 0.5
+        if damage_type in self.immunities:
+            return 0.0
+        return 1.0
+
+def roll_at_least(target):
+    #P(d20 >= target)
+    return float(np.clip((21 - target)/20, 0, 1))
+
+def attack_damage(attacker, defender, to_hit, damage, damage_type, number=1, advantage=False):
+    #Expected damage of number attacks and P(at least one hits)
+    crit = attacker.crit_chance
+    hit = max(roll_at_least(defender.ac - to_hit), crit)
+    if advantage:
+        hit, crit = 1 - (1 - hit)**2, 1 - (1 - crit)**2
+    per_attack = damage*((hit - crit) + 1.8*crit)*defender.type_factor(damage_type)
+    return number*per_attack, 1 - (1 - hit)**number
+
+def weapon_round(attacker, defender):
+    damage, any_hit = attack_damage(attacker, defender, attacker.to_hit, attacker.dmg, attacker.damage_type, attacker.attacks, attacker.advantage)
+    hits = attacker.attacks*max(roll_at_least(defender.ac - attacker.to_hit), attacker.crit_chance)
+    return damage + any_hit*attacker.sneak_attack*defender.type_factor(attacker.damage_type) + hits*attacker.rage_dmg
+
+def spell_round(attacker, defender, spell):
+    level, kind, damage, damage_type, targets = SPELLS[spell]
+    if kind == 'attack':
+        return attack_damage(attacker, defender, attacker.spell_to_hit, damage, damage_type)[0]
+    if kind == 'auto':
+        return damage*defender.type_factor(damage_type)
+    success = roll_at_least(attacker.spell_dc - defender.saves[kind])
+    return damage*(1 - success/2)*defender.type_factor(damage_type)
+
+def round_plan(attacker, defenders, max_rounds=MAX_ROUNDS):
+    #[max_rounds, defenders] damage per target of every round and [max_rounds] targets hit.
+    #Slots are spent from the highest level down on the best damage spell of that level
+    #(against the average defender), then the better of weapon and cantrip.
+    damage = np.zeros((max_rounds, len(defenders)))
+    targets = np.ones(max_rounds)
+    sustained = np.array([weapon_round(attacker, defender) for defender in defenders])
+    cantrips = [spell for spell in attacker.spells if SPELLS[spell][0] == 0]
+    for spell in cantrips:
+        cantrip = np.array([spell_round(attacker, defender, spell) for defender in defenders])
+        if np.mean(cantrip) > np.mean(sustained):
+            sustained = cantrip
+    r = 0
+    for level in range(9, 0, -1):
+        castable = [spell for spell in attacker.spells if 0 < SPELLS[spell][0] <= level]
+        if len(castable) == 0:
+            continue
+        options = [(np.array([spell_round(attacker, defender, spell) for defender in defenders]), SPELLS[spell][4]) for spell in castable]
+        values, number = max(options, key=lambda option: np.mean(option[0])*option[1])
+        for k in range(0, attacker.slots[level - 1]):
+            if r < max_rounds and np.mean(values)*number > np.mean(sustained):
+                damage[r], targets[r] = values, number
+                r += 1
+    damage[r:] = sustained
+    return damage, targets
+
+class RaceTables:
+    #Round plans of every class against every monster and back, built once per process
+    def __init__(self, max_rounds=MAX_ROUNDS):
+        self.heroes = [Combatant(name + ' Lv5') for name in CLASSES]
+        self.monsters = [Combatant(name) for name in MONSTERS]
+        self.hero_hp = np.array([c.hp for c in self.heroes])
+        self.monster_hp = np.array([c.hp for c in self.monsters])
+        self.hero_plan = [round_plan(c, self.monsters, max_rounds) for c in self.heroes]
+        self.monster_plan = [round_plan(c, self.heroes, max_rounds) for c in self.monsters]
+        #[attackers, rounds, defenders] and [attackers, rounds]
+        self.hero_damage = np.array([plan[0] for plan in self.hero_plan])
+        self.hero_targets = np.array([plan[1] for plan in self.hero_plan])
+        self.monster_damage = np.array([plan[0] for plan in self.monster_plan])
+        self.monster_targets = np.array([plan[1] for plan in self.monster_plan])
+        self.max_rounds = max_rounds
+
+_tables = None
+
+def get_race_tables():
+    global _tables
+    if _tables is None:
+        _tables = RaceTables()
+    return _tables
+
+
+#---------------Encounters---------------
+def side_damage(attacker_counts, defender_counts, damage, targets):
+    #[encounters, rounds] damage a full side deals, spread over the mix of the other side
+    mix = defender_counts/np.maximum(np.sum(defender_counts, axis=1, keepdims=True), 1)
+    per_attacker = np.einsum('ed,ard->ear', mix, damage)
+    hit = np.minimum(targets[None, :, :], np.sum(defender_counts, axis=1)[:, None, None])
+    return np.einsum('ea,ear->er', attacker_counts, per_attacker*hit)
+
+def crossing_round(hp, previous_hp, r):
+    #Fractional round in which the HP crossed 0
+    return r + previous_hp/np.maximum(previous_hp - hp, 1e-9)
+
+def damage_race_counts(party_counts, enemy_counts, tables=None):
+    #party_counts [n, classes], enemy_counts [n, monsters], see surrogate_model.counts
+    tables = tables or get_race_tables()
+    party_damage = side_damage(party_counts, enemy_counts, tables.hero_damage, tables.hero_targets)
+    enemy_damage = side_damage(enemy_counts, party_counts, tables.monster_damage, tables.monster_targets)
+    party_hp0 = party_counts @ tables.hero_hp
+    enemy_hp0 = enemy_counts @ tables.monster_hp
+    party_hp, enemy_hp = party_hp0.copy(), enemy_hp0.copy()
+    party_falls = np.full(len(party_hp), np.inf)
+    enemies_fall = np.full(len(party_hp), np.inf)
+    party_hp_at_win = np.zeros(len(party_hp))
+    for r in range(0, tables.max_rounds):
+        decided = np.isfinite(party_falls) | np.isfinite(enemies_fall)
+        party_left = np.maximum(party_hp, 0)/np.maximum(party_hp0, 1)
+        enemy_left = np.maximum(enemy_hp, 0)/np.maximum(enemy_hp0, 1)
+        new_enemy_hp = enemy_hp - party_damage[:, r]*party_left
+        new_party_hp = party_hp - enemy_damage[:, r]*enemy_left
+        enemies_down = ~decided & (new_enemy_hp <= 0)
+        party_down = ~decided & (new_party_hp <= 0)
+        enemies_fall[enemies_down] = crossing_round(new_enemy_hp, enemy_hp, r)[enemies_down]
+        party_falls[party_down] = crossing_round(new_party_hp, party_hp, r)[party_down]
+        party_hp_at_win[enemies_down] = np.maximum(party_hp - (enemies_fall - r)*enemy_damage[:, r]*enemy_left, 0)[enemies_down]
+        enemy_hp, party_hp = new_enemy_hp, new_party_hp
+    #sides still up after max_rounds: extrapolate with the damage of the last round
+    last = tables.max_rounds - 1
+    open_enemies = ~np.isfinite(enemies_fall)
+    enemies_fall[open_enemies] = (tables.max_rounds + np.maximum(enemy_hp, 0)/np.maximum(party_damage[:, last]*np.maximum(party_hp, 0)/np.maximum(party_hp0, 1), 1e-9))[open_enemies]
+    open_party = ~np.isfinite(party_falls)
+    party_falls[open_party] = (tables.max_rounds + np.maximum(party_hp, 0)/np.maximum(enemy_damage[:, last]*np.maximum(enemy_hp, 0)/np.maximum(enemy_hp0, 1), 1e-9))[open_party]
+
+    #a side that takes no more damage never falls, capped so the ratio stays finite
+    enemies_fall = np.minimum(enemies_fall, RACE_CAP*tables.max_rounds)
+    party_falls = np.minimum(party_falls, RACE_CAP*tables.max_rounds)
+    log_ratio = np.log(np.maximum(party_falls, 1e-3)/np.maximum(enemies_fall, 1e-3))
+    return {
+        'party_dpr': party_damage[:, 0],
+        'enemy_dpr': enemy_damage[:, 0],
+        'rounds_to_defeat_enemies': enemies_fall,
+        'rounds_to_defeat_party': party_falls,
+        'rounds': np.minimum(enemies_fall, party_falls),
+        'log_ratio': log_ratio,
+        'win_prob': 1/(1 + np.exp(-np.clip(RACE_SLOPE*log_ratio + RACE_OFFSET, -30, 30))),
+        'team_health': np.where(enemies_fall < party_falls, party_hp_at_win/np.maximum(party_hp0, 1), 0.0),
+    }
+
+def damage_race(parties, enemy_lists):
+    #parties: lists of class names, enemy_lists: lists of monster names
+    return damage_race_counts(counts(parties, CLASSES), counts(enemy_lists, MONSTERS))
+
+def race_win_probs(parties, enemy_lists):
+    #Win probability of the race, nan for encounters with names outside CLASSES and MONSTERS
+    known = np.array([all(name in CLASSES for name in party) and all(name in MONSTERS for name in enemies) for party, enemies in zip(parties, enemy_lists)], dtype=bool)
+    win = np.full(len(known), np.nan)
+    if np.any(known):
+        win[known] = damage_race([p for p, k in zip(parties, known) if k], [e for e, k in zip(enemy_lists, known) if k])['win_prob']
+    return win
+
+def race_disagreement(simulated_win, race_win, threshold=0.5):
+    #True where a simulated win probability is far from the damage race, worth a look
+    return np.abs(np.asarray(simulated_win) - np.asarray(race_win)) > threshold
+
+def fit_race_calibration(records):
+    #RACE_SLOPE and RACE_OFFSET from simulated encounters (records of surrogate_model.training.jsonl)
+    from matchup_matrix import newton_logistic
+    records = [record for record in records if 'error' not in record]
+    race = damage_race([record['party'] for record in records], [record['enemies'] for record in records])
+    wins = np.array([record['wins'] for record in records], dtype=float)
+    fights = np.array([record['fights'] for record in records], dtype=float)
+    offset, slope = newton_logistic(wins, fights, np.stack([np.ones(len(records)), race['log_ratio']], axis=1), np.array([100.0, 100.0]))
+    return float(slope), float(offset)
+
+if __name__ == '__main__':
+    result = damage_race([['Fighter', 'Rogue', 'Wizard', 'Cleric']], [['Ogre', 'Ogre', 'Goblin']])
+    for key, value in result.items():
+        print(key + ': ' + str(round(float(value[0]), 3)))
@@ -0,0 +1,183 @@
+#Index of every enemy multiset of the questionnaire monsters, sorted by adjusted XP
+#With the 25 monsters of exp_dict and up to 8 slots there are about 14 million enemy
+#teams. They are enumerated once with numpy and stored sorted by adjusted XP
+#(raw XP x MULTIPLIER_TABLE), so "every team between a and b XP" is a binary search
+#and the filters run vectorized on that slice.
+#
+#Packed team (uint64): slot k holds the code of one monster in bits 5k..5k+4, codes
+#are 1 + position in meta['monsters'], 0 is an empty slot, the codes of a team are
+#sorted from slot 0 upwards. 8 slots use 40 bits.
+#
+#Files (folder encounter_index/), one row per team in ascending XP order: packed.npy,
+#adjusted_xp.npy (float32), types.npy (uint32, bit i set if monster i is in the team),
+#count.npy and distinct.npy (uint8), plus meta.json. The filters only read the small
+#columns, a query over millions of teams takes a few tens of milliseconds.
+#The index is rebuilt when exp_dict, the multiplier table or max_slots change.
+
+import numpy as np
+import threading
+import hashlib
+import json
+import os
+import sys
+
+from encounter_xp import exp_dict, multiplier, MAX_ENEMIES
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+INDEX_PATH = os.path.join(application_path, 'encounter_index')
+ARCHIVE_PATH = os.path.join(application_path, 'Archive')
+SLOT_BITS = 5
+SLOT_MASK = (1 << SLOT_BITS) - 1
+COLUMNS = ['packed', 'adjusted_xp', 'types', 'count', 'distinct']
+
+
+def index_signature(monsters, max_slots):
+    text = json.dumps([[(name, exp_dict[name]) for name in monsters], [multiplier(n) for n in range(1, max_slots + 1)], max_slots])
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def enumerate_teams(xp, max_slots):
+    #All multisets of 1..max_slots monsters (unsorted): packed teams, adjusted XP,
+    #bit mask of the monster positions in the team, number of enemies and of distinct monsters
+    packed = np.zeros(1, dtype=np.uint64)
+    raw = np.zeros(1, dtype=np.int64)
+    types = np.zeros(1, dtype=np.uint32)
+    distinct = np.zeros(1, dtype=np.uint8)
+    last = np.zeros(1, dtype=np.int8)  #monster position of the previous slot
+    columns = {'packed': [], 'adjusted_xp': [], 'types': [], 'count': [], 'distinct': []}
+    for slot in range(0, max_slots):
+        new = {'packed': [], 'raw': [], 'types': [], 'distinct': [], 'last': []}
+        for j in range(0, len(xp)):
+            selected = last <= j  #slots are sorted
+            n = int(np.sum(selected))
+            new['packed'].append(packed[selected] | np.uint64((j + 1) << (SLOT_BITS*slot)))
+            new['raw'].append(raw[selected] + xp[j])
+            new['types'].append(types[selected] | np.uint32(1 << j))
+            if slot == 0:
+                new['distinct'].append(np.ones(n, dtype=np.uint8))
+            else:
+                new['distinct'].append(distinct[selected] + (last[selected] != j).astype(np.uint8))
+            new['last'].append(np.full(n, j, dtype=np.int8))
+        packed, raw, types = np.concatenate(new['packed']), np.concatenate(new['raw']), np.concatenate(new['types'])
+        distinct, last = np.concatenate(new['distinct']), np.concatenate(new['last'])
+        columns['packed'].append(packed)
+        columns['adjusted_xp'].append((raw*multiplier(slot + 1)).astype(np.float32))
+        columns['types'].append(types)
+        columns['count'].append(np.full(len(packed), slot + 1, dtype=np.uint8))
+        columns['distinct'].append(distinct)
+    return {name: np.concatenate(arrays) for name, arrays in columns.items()}
+
+def monster_tags(name, archive_path=ARCHIVE_PATH):
+    #'caster' (has a spell list), 'ranged' (Range_Attack) and the Type of the monster json
+    file_name = os.path.join(archive_path, name + '.json')
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name) as f:
+        data = json.load(f)
+    tags = [str(data.get('Type', '')).lower()]
+    if str(data.get('Spell_List', 'none')).strip() not in ['none', '']:
+        tags.append('caster')
+    if data.get('Range_Attack', 0) == 1:
+        tags.append('ranged')
+    return tags
+
+def build_encounter_index(index_path=INDEX_PATH, max_slots=MAX_ENEMIES):
+    monsters = list(exp_dict.keys())
+    columns = enumerate_teams(np.array([exp_dict[name] for name in monsters], dtype=np.int64), max_slots)
+    order = np.argsort(columns['adjusted_xp'], kind='stable')
+    os.makedirs(index_path, exist_ok=True)
+    for name in COLUMNS:
+        np.save(os.path.join(index_path, name + '.npy'), columns[name][order])
+    meta = {
+        'monsters': monsters,
+        'tags': {name: monster_tags(name) for name in monsters},
+        'max_slots': max_slots,
+        'size': int(len(order)),
+        'signature': index_signature(monsters, max_slots),
+    }
+    with open(os.path.join(index_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    return meta
+
+
+class EncounterIndex:
+    #Read only, the arrays are memory mapped
+    def __init__(self, index_path=INDEX_PATH):
+        with open(os.path.join(index_path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(index_path, name + '.npy'), mmap_mode='r'))
+        self.monsters = self.meta['monsters']
+        self.codes = {name: i + 1 for i, name in enumerate(self.monsters)}
+        self.shifts = np.arange(0, self.meta['max_slots'], dtype=np.uint64)*np.uint64(SLOT_BITS)
+
+    def __len__(self):
+        return len(self.packed)
+
+    def slots(self, packed):
+        #[n, max_slots] monster codes, 0 for empty slots
+        return ((np.asarray(packed, dtype=np.uint64)[:, None] >> self.shifts) & np.uint64(SLOT_MASK)).astype(np.uint8)
+
+    def type_mask(self, names):
+        return np.uint32(sum(1 << (self.codes[name] - 1) for name in set(names)))
+
+    def tag_mask(self, tag):
+        return self.type_mask([name for name in self.monsters if tag in self.meta['tags'].get(name, [])])
+
+    def query(self, xp_low, xp_high, require=None, exclude=None, require_tag=None,
+              max_distinct=None, min_enemies=1, max_enemies=None):
+        #Packed teams with adjusted XP in [xp_low, xp_high], in ascending XP order
+        #require: monsters that must all be in the team, exclude: monsters that must not be
+        #require_tag: e.g. 'caster', at least one monster of the team has it
+        start = int(np.searchsorted(self.adjusted_xp, xp_low, side='left'))
+        stop = int(np.searchsorted(self.adjusted_xp, xp_high, side='right'))
+        keep = np.ones(stop - start, dtype=bool)
+        if min_enemies > 1 or max_enemies is not None:
+            count = self.count[start:stop]
+            keep &= (count >= min_enemies) & (count <= (max_enemies or 255))
+        if max_distinct is not None:
+            keep &= self.distinct[start:stop] <= max_distinct
+        if exclude or require or require_tag is not None:
+            types = self.types[start:stop]
+            if exclude:
+                keep &= (types & self.type_mask(exclude)) == 0
+            if require:
+                keep &= (types & self.type_mask(require)) == self.type_mask(require)
+            if require_tag is not None:
+                keep &= (types & self.tag_mask(require_tag)) != 0
+        return np.asarray(self.packed[start:stop])[keep]
+
+    def decode(self, packed):
+        #packed teams -> lists of monster names
+        return [[self.monsters[code - 1] for code in row if code > 0] for row in self.slots(packed)]
+
+    def encode(self, enemy_names):
+        codes = sorted(self.codes[name] for name in enemy_names)
+        return np.uint64(sum(code << (SLOT_BITS*k) for k, code in enumerate(codes)))
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+def get_encounter_index(index_path=INDEX_PATH, max_slots=MAX_ENEMIES):
+    #Cached per process, built on first use (a few seconds) or when exp_dict changed
+    path = os.path.abspath(index_path)
+    with _index_lock:
+        if path not in _indexes:
+            meta_file = os.path.join(path, 'meta.json')
+            meta = None
+            if os.path.exists(meta_file):
+                with open(meta_file) as f:
+                    meta = json.load(f)
+            if meta is None or meta.get('signature') != index_signature(list(exp_dict.keys()), max_slots):
+                print('Building the encounter index...')
+                build_encounter_index(path, max_slots)
+            _indexes[path] = EncounterIndex(path)
+        return _indexes[path]
+
+if __name__ == '__main__':
+    meta = build_encounter_index()
+    print('Enemy teams in the index: ' + str(meta['size']))
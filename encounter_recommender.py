@@ -0,0 +1,208 @@
+#Encounter recommender: enemy teams of the catalog that hit a target difficulty for a party
+#   recommender = EncounterRecommender()
+#   recommender.recommend(['Fighter', 'Rogue', 'Wizard', 'Cleric'], win_range=(0.6, 0.75), min_team_health=0.4)
+#
+#Candidates are the enemy multisets whose adjusted XP is inside xp_range (fractions of the
+#Deadly budget of the party, the simulated heroes win most fights up to about twice the
+#budget), max_candidates of them spread over that XP range are raced:
+#every round plays a few more fights of every survivor, drops the ones whose confidence
+#interval is outside the target, keeps the better half when there are too many, and
+#doubles the fights of the next round. Only the promising candidates get many fights.
+#
+#With a trained surrogate model, more candidates are scored first and only the ones it
+#predicts near the target (or is unsure about) are raced. Without one, the damage race
+#(damage_race.py) drops the candidates that are clearly far from the target.
+#
+#One recommender keeps one pool (or uses the pool it is given, e.g. the executor of the
+#simulation service) and one result cache. Outcome table hits count as fights already played.
+
+import numpy as np
+from multiprocessing import Pool
+import random as rnd
+import threading
+
+from simulation_worker import warm_up, has_template, play_encounter_batch
+from encounter_xp import exp_dict, multiplier, party_xp, MAX_ENEMIES
+from outcome_table import OutcomeTable, encounter_key
+from encounter_index import get_encounter_index
+from surrogate_model import get_surrogate
+from damage_race import race_win_probs
+
+Z_95 = 1.96
+
+
+def monster_catalog():
+    return sorted([name for name in exp_dict if has_template(name)], key=lambda name: exp_dict[name])
+
+def candidate_encounters(xp_low, xp_high, monsters, max_enemies=MAX_ENEMIES, max_distinct=3, number=None, rng=None):
+    #Multisets of monsters with adjusted XP in [xp_low, xp_high], as sorted name lists.
+    #With number, only that many spread evenly over the XP range (the index is in XP order)
+    index = get_encounter_index()
+    exclude = [name for name in index.monsters if name not in monsters]
+    packed = index.query(xp_low, xp_high, exclude=exclude, max_distinct=max_distinct, max_enemies=max_enemies)
+    if number is not None and len(packed) > number:
+        step = len(packed)/number
+        rng = rng or rnd.Random(0)
+        packed = packed[[int((k + rng.random())*step) for k in range(0, number)]]
+    return index.decode(packed)
+
+def adjusted_xp(enemies):
+    return sum(exp_dict[name] for name in enemies)*multiplier(len(enemies))
+
+def interval(successes, fights):
+    #Mean with a Beta(1, 1) prior and its 95 % interval. Team health is in [0, 1], its
+    #variance is at most m*(1 - m), so the same interval is a conservative one for it
+    m = (successes + 1)/(fights + 2)
+    error = np.sqrt(m*(1 - m)/(fights + 2))
+    return float(m), float(m - Z_95*error), float(m + Z_95*error)
+
+
+class EncounterRecommender:
+    def __init__(self, pool=None, processes=None, outcome_table=None, batch_fights=8, surrogate=None):
+        #pool: anything with map(function, iterable), a multiprocessing Pool or a ProcessPoolExecutor
+        #surrogate: surrogate_model.Surrogate that pre-screens the candidates, default the trained one
+        self.pool = pool
+        self.processes = processes
+        self.own_pool = None
+        self.outcome_table = outcome_table if outcome_table is not None else OutcomeTable()
+        self.batch_fights = batch_fights
+        self.surrogate = surrogate if surrogate is not None else get_surrogate()
+        self.cache = {}   #encounter key -> fights, wins, team_health sums and batches played
+        self.lock = threading.Lock()
+        self.fights_played = 0
+
+    def map(self, function, tasks):
+        if self.pool is not None:
+            return list(self.pool.map(function, tasks))
+        if self.processes == 1 or len(tasks) <= 1:
+            return list(map(function, tasks))
+        if self.own_pool is None:
+            self.own_pool = Pool(self.processes, initializer=warm_up)
+        return self.own_pool.map(function, tasks)
+
+    def close(self):
+        if self.own_pool is not None:
+            self.own_pool.close()
+            self.own_pool.join()
+            self.own_pool = None
+
+    def stats(self, party, enemies):
+        key = encounter_key(party, enemies)
+        with self.lock:
+            if key not in self.cache:
+                entry = {'fights': 0, 'wins': 0.0, 'team_health': 0.0, 'batches': 0, 'failed': False}
+                outcome = self.outcome_table.lookup(party, enemies)
+                if outcome is not None:
+                    repetitions = self.outcome_table.meta.get('repetitions', 100)
+                    entry.update({'fights': repetitions, 'wins': outcome[0]*repetitions, 'team_health': outcome[4]*repetitions})
+                self.cache[key] = entry
+            return self.cache[key]
+
+    def play(self, party, encounters, fights):
+        #Tops up every encounter to at least fights fights, in batches of batch_fights
+        jobs = []
+        for enemies in encounters:
+            entry = self.stats(party, enemies)
+            cell_key = '|'.join(sorted(party)) + '#' + '|'.join(sorted(enemies))
+            with self.lock:  #requests running at the same time get different batches (seeds)
+                missing = fights - entry['fights']
+                while missing > 0 and not entry['failed']:
+                    jobs.append((cell_key, entry['batches'], self.batch_fights, party, enemies))
+                    entry['batches'] += 1
+                    missing -= self.batch_fights
+        for record, (cell_key, batch, batch_fights, job_party, enemies) in zip(self.map(play_encounter_batch, jobs), jobs):
+            entry = self.stats(party, enemies)
+            with self.lock:
+                if 'error' in record:
+                    entry['failed'] = True
+                    continue
+                for name in ['fights', 'wins', 'team_health']:
+                    entry[name] += record[name]
+                self.fights_played += record['fights']
+
+    def summary(self, party, enemies):
+        entry = self.stats(party, enemies)
+        win = interval(entry['wins'], entry['fights'])
+        team_health = interval(entry['team_health'], entry['fights'])
+        return {
+            'enemies': enemies,
+            'adjusted_xp': adjusted_xp(enemies),
+            'fights': entry['fights'],
+            'win_prob': win[0], 'win_ci': (win[1], win[2]),
+            'team_health': team_health[0], 'team_health_ci': (team_health[1], team_health[2]),
+        }
+
+    def recommend(self, party, win_range=(0.6, 0.75), min_team_health=0.4, top_k=5,
+                  xp_range=(0.5, 6.0), max_enemies=MAX_ENEMIES, max_distinct=3, max_candidates=64,
+                  initial_fights=8, max_fights=128, max_rounds=6, prescreen_factor=8, race_margin=0.3, seed=0):
+        #party: class names. Returns up to top_k summaries, the closest to the target first.
+        #'hit' is False for candidates that were dropped, they only fill up a short list
+        budget = party_xp(party)
+        rng = rnd.Random(seed)
+        if self.surrogate is None:
+            encounters = candidate_encounters(xp_range[0]*budget, xp_range[1]*budget, monster_catalog(), max_enemies, max_distinct,
+                                              number=prescreen_factor*max_candidates, rng=rng)
+            #the race is coarse, it only drops what it puts far outside the target
+            race = race_win_probs([party]*len(encounters), encounters)
+            near = (race >= win_range[0] - race_margin) & (race <= win_range[1] + race_margin)
+            encounters = [enemies for enemies, keep in zip(encounters, near | np.isnan(race)) if keep]
+            if len(encounters) > max_candidates:
+                encounters = [encounters[int((k + rng.random())*len(encounters)/max_candidates)] for k in range(0, max_candidates)]
+        else:
+            #score prescreen_factor times more candidates with the surrogate, race the ones it
+            #places near the target and the ones it is unsure about
+            encounters = candidate_encounters(xp_range[0]*budget, xp_range[1]*budget, monster_catalog(), max_enemies, max_distinct,
+                                              number=prescreen_factor*max_candidates, rng=rng)
+            prediction = self.surrogate.predict([party]*len(encounters), encounters)
+            near = (prediction['win'] + 2*prediction['win_sd'] >= win_range[0]) & (prediction['win'] - 2*prediction['win_sd'] <= win_range[1])
+            near &= prediction['team_health'] + 2*prediction['team_health_sd'] >= min_team_health
+            encounters = [enemies for enemies, keep in zip(encounters, near | ~prediction['confident']) if keep]
+            if len(encounters) > max_candidates:
+                encounters = [encounters[int((k + rng.random())*len(encounters)/max_candidates)] for k in range(0, max_candidates)]
+
+        def distance(summary):
+            #0 inside the target, otherwise how far the estimates are outside
+            win = max(win_range[0] - summary['win_prob'], summary['win_prob'] - win_range[1], 0)
+            return win + max(min_team_health - summary['team_health'], 0)
+
+        survivors = encounters
+        kept = []
+        dropped = []
+        fights = initial_fights
+        for round_number in range(0, max_rounds):
+            self.play(party, survivors, fights)
+            summaries = [self.summary(party, enemies) for enemies in survivors]
+            kept = []
+            for enemies, summary in zip(survivors, summaries):
+                if self.stats(party, enemies)['failed']:
+                    continue
+                if summary['win_ci'][0] > win_range[1] or summary['win_ci'][1] < win_range[0] or summary['team_health_ci'][1] < min_team_health:
+                    dropped.append((distance(summary), enemies, summary))  #the interval is outside the target
+                    continue
+                kept.append((distance(summary), enemies, summary))
+            kept = sorted(kept, key=lambda item: item[0])
+            if len(kept) > 2*top_k:
+                cut = max(2*top_k, len(kept)//2)  #successive halving
+                dropped += kept[cut:]
+                kept = kept[0:cut]
+            survivors = [enemies for d, enemies, summary in kept]
+            if len(survivors) == 0 or fights >= max_fights:
+                break
+            if len(survivors) <= top_k and all(summary['win_ci'][0] >= win_range[0] and summary['win_ci'][1] <= win_range[1] for d, enemies, summary in kept):
+                break  #every survivor is inside the target
+            fights = min(2*fights, max_fights)
+        for d, enemies, summary in kept:
+            summary['hit'] = True
+        for d, enemies, summary in dropped:
+            summary['hit'] = False
+        return [summary for d, enemies, summary in kept[0:top_k] + sorted(dropped, key=lambda item: item[0])[0:max(0, top_k - len(kept))]]
+
+def print_recommendations(recommendations):
+    for summary in recommendations:
+        print(', '.join(summary['enemies']) + ' (' + str(int(summary['adjusted_xp'])) + ' XP) : win ' + str(round(summary['win_prob']*100, 1)) + ' %, team health ' + str(round(summary['team_health']*100, 1)) + ' %, ' + str(summary['fights']) + ' fights' + ('' if summary['hit'] else ', outside the target'))
+
+if __name__ == '__main__':
+    recommender = EncounterRecommender()
+    print_recommendations(recommender.recommend(['Fighter', 'Rogue', 'Wizard', 'Cleric']))
+    print('Fights played: ' + str(recommender.fights_played))
+    recommender.close()
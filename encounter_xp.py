@@ -0,0 +1,81 @@
+#XP rules of the DMG used by the questionnaire and the batch tools
+#streamlit.py, the outcome table and the other offline jobs all import from here,
+#so there is only one copy of the multiplier table and the monster XP values
+
+import math
+
+MULTIPLIER_TABLE = {
+    1: 1.0,    # 1 -> x1
+    2: 1.5,    # 2 -> x1.5
+    3: 2.0,    # 3-6 -> x2
+    4: 2.0,
+    5: 2.0,
+    6: 2.0,
+    7: 2.5,    # 7-10 -> x2.5
+    8: 2.5,
+    9: 2.5,
+    10: 2.5,
+    11: 3.0,   # 11-14 -> x3
+    12: 3.0,
+    13: 3.0,
+    14: 3.0,
+    15: 4.0,   # 15+ -> x4
+}
+
+exp_dict = {
+    "Ape": 100, "Boar": 50, "Brown Bear": 200, "Crocodile": 100, "Displayer Beast": 700,
+    "Fire Elemental": 1800, "Flameskull": 1100, "Giant Boar": 450, "Giant Centipede": 50,
+    "Giant Crocodile": 1800, "Giant Eagle": 200, "Giant Scorpion": 700, "Giant Spider": 200,
+    "Giant Wasp": 100, "Goblin": 50, "Night Hag": 1800, "Ogre": 450, "Pirate": 200,
+    "Polar Bear": 450, "Stone Giant": 2900, "Swarm of Bats": 50, "Vampire Spawn": 1800,
+    "Vampire": 10000, "Wolf": 50, "Young Dragon": 5900
+}
+
+EXP_THRESHOLDS = {"easy": 250, "medium": 500, "hard": 750, "deadly": 1100}  #per Lv5 character
+
+MAX_ENEMIES = 8  #enemy slots in the questionnaire
+
+
+def multiplier(number_of_enemies):
+    return MULTIPLIER_TABLE.get(number_of_enemies, 4.0)
+
+MULTIPLIER_STEPS = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0]
+
+def party_size_multiplier(number_of_enemies, party_size):
+    #DMG: parties of 1-2 use the next higher multiplier, parties of 6+ the next lower one
+    step = MULTIPLIER_STEPS.index(multiplier(number_of_enemies))
+    if party_size < 3:
+        step += 1
+    elif party_size >= 6:
+        step -= 1
+    return MULTIPLIER_STEPS[step]
+
+def raw_enemy_xp(enemy_names):
+    return sum(exp_dict[name] for name in enemy_names)
+
+def adjusted_enemy_xp(enemy_names):
+    """Total XP of a list of monster names (no 'None' entries) times the DMG multiplier."""
+    return raw_enemy_xp(enemy_names) * multiplier(len(enemy_names))
+
+def party_xp(party, difficulty="deadly"):
+    return EXP_THRESHOLDS[difficulty] * len(party)
+
+def enemy_name_from_option(option):
+    #'Goblin -> 50 XP' -> 'Goblin', the questionnaire stores the option strings
+    return option.split("->")[0].strip()
+
+def enemy_names_from_options(options):
+    return [enemy_name_from_option(o) for o in options if enemy_name_from_option(o) in exp_dict]
+
+CR_XP = {
+    0: 10, 0.125: 25, 0.25: 50, 0.5: 100, 1: 200, 2: 450, 3: 700, 4: 1100, 5: 1800,
+    6: 2300, 7: 2900, 8: 3900, 9: 5000, 10: 5900, 11: 7200, 12: 8400, 13: 10000,
+    14: 11500, 15: 13000, 16: 15000, 17: 18000, 18: 20000, 19: 22000, 20: 25000
+}
+
+def cr_to_xp(cr):
+    return CR_XP.get(float(cr), 0)
+
+def xp_to_cr(xp):
+    #CR with the closest XP on a log scale, e.g. an empirical XP back to a CR
+    return min(CR_XP.keys(), key=lambda cr: abs(math.log(CR_XP[cr]) - math.log(max(xp, 1))))
@@ -0,0 +1,127 @@
+#Calibration report of the simulation fidelity levels (Dm_class.FIDELITY_LEVELS)
+#Every scenario built from BenchmarkEntities/ is played with the same seeds at every
+#level. Each level is compared with 'full': the difference in win probability (with
+#its standard error), the distance between the round count distributions
+#(Kolmogorov-Smirnov, the largest gap between the two CDFs), the team health left and
+#the speedup in time per fight.
+#
+#Output: fidelity_calibration/report.json
+
+import numpy as np
+import time
+import json
+import os
+import sys
+
+from simulation_worker import play_seeded_roster, get_dm
+from Dm_class import FIDELITY_LEVELS
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARK_PATH = os.path.join(application_path, 'BenchmarkEntities')
+OUTPUT_PATH = os.path.join(application_path, 'fidelity_calibration')
+CHUNK = 20  #fights per level in a row
+#scenario -> (heros, enemies), names of BenchmarkEntities/
+SCENARIOS = {
+    'benchmark': (['Bard Lv5', 'Barbarian Lv5', 'Cleric Lv8', 'Druid Lv 5', 'Paladin Lv5', 'Rogue Lv5', 'Sorcerer lv8', 'Warlock Lv5', 'Wizard Lv5'],
+                  ['Young Dragon', 'Vamire Spawn', 'Thoran', 'Ogre', 'Guard', 'Giant Eagle', 'Goblin', 'Flameskull', 'Fire Elemental', 'Displayer Beast']),
+    'dragon': (['Barbarian Lv5', 'Cleric Lv8', 'Wizard Lv5', 'Rogue Lv5'], ['Young Dragon']),
+    'undead': (['Paladin Lv5', 'Warlock Lv5', 'Bard Lv5', 'Druid Lv 5'], ['Vamire Spawn', 'Flameskull']),
+    'brutes': (['Barbarian Lv5', 'Sorcerer lv8', 'Cleric Lv8'], ['Ogre', 'Ogre', 'Guard', 'Guard']),
+    'goblins': (['Rogue Lv5', 'Wizard Lv5', 'Bard Lv5'], ['Goblin']*6),
+    'elementals': (['Paladin Lv5', 'Druid Lv5', 'Sorcerer lv8', 'Warlock Lv5'], ['Fire Elemental', 'Displayer Beast', 'Giant Eagle']),
+}
+
+
+def load_roster(heros, enemies):
+    #(name, team, json data) for play_seeded_roster
+    roster = []
+    for team, names in ((0, heros), (1, enemies)):
+        for name in names:
+            with open(os.path.join(BENCHMARK_PATH, name + '.json')) as f:
+                roster.append((name, team, json.load(f)))
+    return roster
+
+def ks_distance(a, b):
+    #largest gap between the CDFs of two samples of round counts
+    support = np.union1d(a, b)
+    cdf_a = np.searchsorted(np.sort(a), support, side='right')/len(a)
+    cdf_b = np.searchsorted(np.sort(b), support, side='right')/len(b)
+    return float(np.max(np.abs(cdf_a - cdf_b)))
+
+def play_level(roster, seeds, level):
+    DM = get_dm()
+    fidelity_level = DM.fidelity
+    DM.set_fidelity(level)
+    try:
+        start = time.perf_counter()
+        results = play_seeded_roster(roster, seeds)
+        results['seconds'] = time.perf_counter() - start
+    finally:
+        DM.set_fidelity(fidelity_level)
+    return results
+
+def play_chunks(roster, seeds, levels):
+    return {level: play_level(roster, seeds, level) for level in levels}
+
+def compare(results, full):
+    n = len(results['win'])
+    win_prob, full_win_prob = float(np.mean(results['win'])), float(np.mean(full['win']))
+    error = np.sqrt(win_prob*(1 - win_prob)/n + full_win_prob*(1 - full_win_prob)/n)
+    return {
+        'win_prob': win_prob,
+        'win_prob_diff': win_prob - full_win_prob,
+        'win_prob_diff_error': float(error),
+        'rounds': float(np.mean(results['rounds'])),
+        'rounds_diff': float(np.mean(results['rounds']) - np.mean(full['rounds'])),
+        'rounds_ks': ks_distance(results['rounds'], full['rounds']),
+        'team_health': float(np.mean(results['team_health'])),
+        'ms_per_fight': 1000*results['seconds']/n,
+        'ms_per_round': 1000*results['seconds']/float(np.sum(results['rounds'])),
+        'speedup': full['seconds']/results['seconds'] if results['seconds'] > 0 else None,
+    }
+
+def fidelity_report(fights=200, scenarios=SCENARIOS, levels=list(FIDELITY_LEVELS), seed=0):
+    seeds = [seed + k for k in range(0, fights)]
+    report = {'fights': fights, 'scenarios': {}, 'levels': {}}
+    seconds = {level: 0.0 for level in levels}
+    for name, (heros, enemies) in scenarios.items():
+        roster = load_roster(heros, enemies)
+        #the levels take turns on chunks of seeds, a slow phase of the machine hits all of them
+        chunks = [play_chunks(roster, seeds[k:k + CHUNK], levels) for k in range(0, fights, CHUNK)]
+        played = {level: {key: np.concatenate([chunk[level][key] for chunk in chunks]) if key != 'seconds' else sum(chunk[level][key] for chunk in chunks)
+                          for key in chunks[0][level]} for level in levels}
+        report['scenarios'][name] = {level: compare(played[level], played['full']) for level in levels}
+        for level in levels:
+            seconds[level] += played[level]['seconds']
+        print(name + ' done')
+    for level in levels:
+        rows = [report['scenarios'][name][level] for name in scenarios]
+        report['levels'][level] = {
+            'max_abs_win_prob_diff': max(abs(row['win_prob_diff']) for row in rows),
+            'mean_abs_win_prob_diff': float(np.mean([abs(row['win_prob_diff']) for row in rows])),
+            'mean_rounds_ks': float(np.mean([row['rounds_ks'] for row in rows])),
+            'speedup': seconds['full']/seconds[level] if seconds[level] > 0 else None,
+        }
+    if not os.path.exists(OUTPUT_PATH):
+        os.makedirs(OUTPUT_PATH)
+    with open(os.path.join(OUTPUT_PATH, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+def print_report(report):
+    print('Fights per scenario and level: ' + str(report['fights']))
+    for name, levels in report['scenarios'].items():
+        print(name)
+        for level, row in levels.items():
+            print('  ' + level.ljust(6) + ' win ' + str(round(row['win_prob'], 3)) + ' (' + '{:+.3f}'.format(row['win_prob_diff']) + ' +/- ' + str(round(row['win_prob_diff_error'], 3))
+                  + '), rounds ' + str(round(row['rounds'], 2)) + ' (KS ' + str(round(row['rounds_ks'], 3)) + '), ' + str(round(row['ms_per_fight'], 1)) + ' ms/fight, ' + str(round(row['ms_per_round'], 2)) + ' ms/round')
+    for level, row in report['levels'].items():
+        print(level.ljust(6) + ' speedup ' + str(round(row['speedup'], 2)) + ', max |win diff| ' + str(round(row['max_abs_win_prob_diff'], 3))
+              + ', mean |win diff| ' + str(round(row['mean_abs_win_prob_diff'], 3)) + ', mean rounds KS ' + str(round(row['mean_rounds_ks'], 3)))
+
+if __name__ == '__main__':
+    print_report(fidelity_report())
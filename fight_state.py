@@ -0,0 +1,228 @@
+#Fork from state: "what are the odds from here?"
+#A fight is played up to a turn and paused there, FightState takes a snapshot of it: every
+#combatant (CHP, spell slots, tokens, conditions, position, initiative order, ...), the state
+#table and the turn the fight stopped at. From the snapshot, fork_outcomes plays the rest of
+#the fight many times with different dice and returns the outcome distributions.
+#
+#   fighters = build_fighters(['Fighter', 'Cleric'], ['Ogre', 'Goblin'])
+#   state = fight_until(fighters, 3)      #paused before the first turn of round 3
+#   print(state.describe())
+#   odds = fork_outcomes(state, 500)
+#
+#Restoring does not deepcopy the entity/AI/TokenManager graph. The snapshot keeps the
+#attributes of every object of the fight (entities, AI, choices, spells, tokens, hordes,
+#state table) and restore writes them back into the same objects, only the lists, dicts and
+#arrays among them are copied. Continuations run in forked processes where the platform can
+#fork (the snapshot is shared copy on write), otherwise one after the other in this process.
+
+from Encounter_Simulator import begin_fight, play_turns, end_fight, OUTCOMES
+from Error_class import SimulationError
+from simulation_context import SimulationContext, use_context
+
+import numpy as np
+import multiprocessing
+import random
+
+#Fields of the DM that belong to the running fight
+DM_FIELDS = ['rounds_number', 'outcome', 'state_table', 'turn_index', 'quiet_rounds', 'last_snapshot', 'loser_team']
+_forked = None  #FightState the forked workers play from
+
+
+def copy_value(value):
+    #lists, dicts, sets and arrays are copied, everything else (numbers, entities, tokens) is shared
+    if type(value) is list:
+        return [copy_value(x) for x in value]
+    if type(value) is dict:
+        return {key: copy_value(x) for key, x in value.items()}
+    if type(value) is set:
+        return set(value)
+    if type(value) is np.ndarray:
+        return value.copy()
+    return value
+
+def fight_objects(fight):
+    #Every object whose attributes change during a fight
+    objects = {}
+    for x in fight:
+        owned = [x, x.AI, x.TM] + x.AI.Choices + list(x.SpellBook.values()) + x.TM.TokenList
+        if x.horde is not None:
+            owned.append(x.horde)
+        for thing in owned:
+            objects[id(thing)] = thing
+    return list(objects.values())
+
+
+class FightState:
+    def __init__(self, fighters_unsorted, fight):
+        #Snapshot of a paused fight (play_turns returned True)
+        self.fighters = list(fighters_unsorted)
+        self.fight = fight  #the live fight list, its order is restored
+        self.order = list(fight)
+        self.DM = fighters_unsorted[0].DM
+        self.table = self.DM.state_table
+        self.objects = [(thing, copy_value(thing.__dict__)) for thing in fight_objects(fight)]
+        self.table_values = copy_value(self.table.__dict__)
+        self.DM_values = {name: getattr(self.DM, name) for name in DM_FIELDS}
+
+    def restore(self):
+        #Puts the fight back to the snapshot, returns the fight list
+        for thing, values in self.objects:
+            thing.__dict__.clear()
+            thing.__dict__.update(copy_value(values))
+        self.table.__dict__.update(copy_value(self.table_values))
+        self.fight[:] = self.order
+        self.table.fight = self.fight
+        for name, value in self.DM_values.items():
+            setattr(self.DM, name, value)
+        return self.fight
+
+    @property
+    def round(self):
+        return self.DM_values['rounds_number']
+
+    @property
+    def turn(self):
+        return self.DM_values['turn_index']
+
+    def describe(self):
+        #The combatants in initiative order, for printing and analysis
+        conditions = ['restrained', 'prone', 'is_blinded', 'is_dodged', 'is_stunned', 'is_incapacitated',
+                      'is_paralyzed', 'is_poisoned', 'is_invisible', 'is_hasted', 'is_concentrating']
+        values = {id(thing): values for thing, values in self.objects}
+        combatants = []
+        for x in self.order:
+            v = values[id(x)]
+            combatants.append({
+                'name': v['name'],
+                'team': v['team'],
+                'CHP': v['CHP'],
+                'HP': v['HP'],
+                'state': v['state'],
+                'position': v['position'],
+                'initiative': v['initiative'],
+                'spell_slots': list(v['spell_slot_counter']),
+                'conditions': [name for name in conditions if v.get(name, False)],
+                'tokens': [type(token).__name__ for token in values[id(x.TM)]['TokenList']],
+            })
+        return {'round': self.round, 'turn': self.turn, 'combatants': combatants}
+
+
+def fight_until(fighters, round, turn=0):
+    #Plays a new fight up to the turn (index in initiative order) of the round and returns
+    #its FightState, or None if the fight is over before (the fighters are cleaned up then)
+    fight = begin_fight(fighters)
+    if play_turns(fight, pause_at=(round, turn)):
+        return FightState(fighters, fight)
+    end_fight(fighters, fight)
+    return None
+
+def state_from(fighters, turn=0, round=1):
+    #FightState of a fight that goes on from the fighters as they are now (CHP, state,
+    #concentration, ...), in this initiative order and at the turn of the round given
+    fight = begin_fight(fighters, initiative_order=True)
+    DM = fighters[0].DM
+    DM.rounds_number = round
+    DM.turn_index = turn
+    return FightState(fighters, fight)
+
+def resume_fighting(state):
+    #Plays the rest of the fight from the snapshot, returns like do_the_fighting
+    fight = state.restore()
+    play_turns(fight)
+    return end_fight(state.fighters, fight)
+
+def play_continuations(state, seeds, failures=None):
+    #One continuation per seed, the dice of each only depend on its seed
+    context = SimulationContext()
+    TeamHP = sum(x.HP for x in state.fighters if x.team == 0)
+    results = []
+    for seed in seeds:
+        context.rng.seed(seed)
+        try:
+            with use_context(context):
+                winner, rounds_number = resume_fighting(state)
+        except SimulationError as e:
+            if failures is None:
+                raise
+            failures.append({'seed': seed, 'error': repr(e)})
+            continue
+        results.append({
+            'winner': winner,
+            'outcome': state.DM.outcome,
+            'rounds': rounds_number,
+            'team_health': sum(x.CHP for x in state.fighters if x.team == 0)/TeamHP if TeamHP > 0 else 0.0,
+            'deaths': sum(1 for x in state.fighters if x.team == 0 and x.state == -1),
+            'standing': [x.CHP > 0 for x in state.fighters],
+        })
+    return results
+
+def play_forked(seeds):
+    #Pool task in a forked worker, the snapshot was inherited from the parent
+    failures = []
+    return play_continuations(_forked, seeds, failures), failures
+
+def fork_outcomes(state, continuations=100, seed=None, processes=None):
+    #Plays the fight from the snapshot continuations times and returns the distributions:
+    #winner team, outcome (Encounter_Simulator.OUTCOMES), rounds, team health and deaths of
+    #team 0, survival of every fighter (in the order of state.fighters).
+    #The fighters are left at the snapshot afterwards.
+    #processes: forked workers (default one per CPU), 1 or a platform without fork plays
+    #them in this process
+    global _forked
+    if seed is None:
+        seed = random.getrandbits(32)
+    seeds = [seed + k for k in range(0, continuations)]
+    failures = []
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        _forked = state
+        chunks = [seeds[i::processes] for i in range(0, processes) if len(seeds[i::processes]) > 0]
+        with multiprocessing.get_context('fork').Pool(len(chunks)) as pool:
+            results = []
+            for chunk_results, chunk_failures in pool.map(play_forked, chunks):
+                results += chunk_results
+                failures += chunk_failures
+        _forked = None
+    else:
+        results = play_continuations(state, seeds, failures)
+    state.restore()
+    return outcome_distributions(results, state, failures)
+
+def outcome_distributions(results, state, failures):
+    n = len(results)
+    distributions = {'continuations': n, 'round': state.round, 'turn': state.turn, 'failures': failures}
+    if n == 0:
+        return distributions
+    winners = [result['winner'] for result in results]
+    rounds = np.array([result['rounds'] for result in results])
+    team_health = np.array([result['team_health'] for result in results])
+    deaths = [result['deaths'] for result in results]
+    distributions.update({
+        'win_prob': winners.count(0)/n,
+        'winner': {team: winners.count(team)/n for team in sorted(set(winners), key=str)},
+        'outcomes': {outcome: sum(1 for result in results if result['outcome'] == outcome)/n for outcome in OUTCOMES},
+        'rounds_mean': float(np.mean(rounds)),
+        'rounds': {int(r): int(np.sum(rounds == r)) for r in np.unique(rounds)},
+        'team_health_mean': float(np.mean(team_health)),
+        'team_health_quantiles': [float(q) for q in np.quantile(team_health, [0.1, 0.5, 0.9])],
+        'deaths': {k: deaths.count(k)/n for k in sorted(set(deaths))},
+        'survival': [{'name': x.orignial_name, 'team': x.team, 'survival': sum(result['standing'][i] for result in results)/n} for i, x in enumerate(state.fighters)],
+    })
+    return distributions
+
+
+if __name__ == '__main__':
+    from simulation_worker import build_fighters
+    fighters = build_fighters(['Fighter', 'Rogue', 'Wizard', 'Cleric'], ['Ogre', 'Goblin', 'Goblin'])
+    state = fight_until(fighters, 2)
+    if state is None:
+        print('The fight was over before round 2')
+    else:
+        for combatant in state.describe()['combatants']:
+            print(combatant['name'] + ': ' + str(round(combatant['CHP'], 1)) + '/' + str(combatant['HP']) + ' HP, slots ' + str(combatant['spell_slots']) + ' ' + str(combatant['conditions']))
+        odds = fork_outcomes(state, 200)
+        print('Win probability from round 2: ' + str(round(odds['win_prob']*100, 1)) + '%')
+        print('Mean rounds: ' + str(round(odds['rounds_mean'], 2)))
+        for fighter in odds['survival']:
+            print(fighter['name'] + ' survives: ' + str(round(fighter['survival']*100, 1)) + '%')
@@ -0,0 +1,185 @@
+#Generator of the parties the questionnaire hands out
+#Writes precomputed_party_data/ next to this file:
+#   matrices.npy     float64 [parties, 8, features], layout of class_catalog (unused rows -1)
+#   class_codes.npy  int8 [parties, 8], position of the class in manifest['classes'], -1 if empty
+#   indices.npy      int64 [parties]
+#   manifest.json    classes, seed, encoding vocabulary and the hash of every class file
+#All arrays are plain .npy files: load_party_data maps them read only, without pickle,
+#so every streamlit worker process shares the same memory pages.
+#
+#By default the parties are the ones of the old precomputed_party_data.npz, so the
+#questionnaire hands out the same parties as before, only encoded with the current class
+#files. With legacy_file=None they are a random sample that only depends on (seed,
+#number_of_parties, party sizes, class names). Running the generator again re-encodes only
+#the parties that contain a class whose file changed.
+
+import numpy as np
+from multiprocessing import Pool
+import itertools
+import hashlib
+import random as rnd
+import json
+import os
+import sys
+
+from class_catalog import get_class_catalog, MAX_PARTY_SIZE
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+CLASSES_PATH = os.path.join(application_path, 'Classes')
+OUTPUT_PATH = os.path.join(application_path, 'precomputed_party_data')
+LEGACY_FILE = os.path.join(application_path, 'precomputed_party_data.npz')
+
+
+def class_file_hashes(class_files_path=CLASSES_PATH):
+    catalog = get_class_catalog(class_files_path)
+    hashes = {}
+    for class_name, data in catalog.raw.items():
+        text = json.dumps(data, sort_keys=True)
+        hashes[class_name] = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    return hashes
+
+def vocabulary_hash(vocabulary):
+    return hashlib.blake2b(json.dumps(vocabulary, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+def enumerate_parties(class_names, number_of_parties=100, min_size=3, max_size=MAX_PARTY_SIZE, seed=0):
+    #number_of_parties=None gives every composition (multiset of classes) of every size,
+    #otherwise a reproducible random sample, classes can appear more than once
+    class_names = sorted(class_names)
+    if number_of_parties is None:
+        parties = []
+        for size in range(min_size, max_size + 1):
+            parties += [list(party) for party in itertools.combinations_with_replacement(class_names, size)]
+        return parties
+    rng = rnd.Random(seed)
+    return [rng.choices(class_names, k=rng.randint(min_size, max_size)) for i in range(0, number_of_parties)]
+
+def legacy_parties(legacy_file=LEGACY_FILE):
+    #Class names of the parties of the old pickled npz file
+    data = np.load(legacy_file, allow_pickle=True)
+    return [[str(class_name) for class_name in party] for party in data['class_names']]
+
+def encode_parties(task):
+    #Runs in the pool workers, every worker builds its own catalog once
+    class_files_path, parties = task
+    catalog = get_class_catalog(class_files_path)
+    return np.stack([catalog.encode_party(party) for party in parties])
+
+def load_previous(output_path):
+    manifest_file = os.path.join(output_path, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return None, None, None
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    matrices = np.load(os.path.join(output_path, 'matrices.npy'), mmap_mode='r')
+    class_codes = np.load(os.path.join(output_path, 'class_codes.npy'), mmap_mode='r')
+    return manifest, matrices, class_codes
+
+def save_array(output_path, name, array):
+    tmp_file = os.path.join(output_path, name + '.tmp.npy')
+    np.save(tmp_file, array)
+    os.replace(tmp_file, os.path.join(output_path, name + '.npy'))
+
+def generate_party_data(output_path=OUTPUT_PATH, class_files_path=CLASSES_PATH, number_of_parties=100,
+                        min_size=3, max_size=MAX_PARTY_SIZE, seed=0, processes=None, chunk_size=2000, legacy_file=LEGACY_FILE):
+    catalog = get_class_catalog(class_files_path)
+    classes = sorted(catalog.raw.keys())
+    class_index = {class_name: i for i, class_name in enumerate(classes)}
+    hashes = class_file_hashes(class_files_path)
+    vocabulary = catalog.vocabulary_json()
+    if legacy_file is not None and os.path.exists(legacy_file):
+        parties = legacy_parties(legacy_file)
+        settings = {'legacy_file': os.path.basename(legacy_file), 'classes': classes}
+    else:
+        parties = enumerate_parties(classes, number_of_parties, min_size, max_size, seed)
+        settings = {'number_of_parties': number_of_parties, 'min_size': min_size, 'max_size': max_size, 'seed': seed, 'classes': classes}
+    class_codes = np.full((len(parties), MAX_PARTY_SIZE), -1, dtype=np.int8)
+    for i, party in enumerate(parties):
+        class_codes[i, 0:len(party)] = [class_index[class_name] for class_name in party]
+
+    #Which parties can be copied from the last run
+    os.makedirs(output_path, exist_ok=True)
+    manifest, old_matrices, old_codes = load_previous(output_path)
+    reusable = np.zeros(len(parties), dtype=bool)
+    if (manifest is not None and manifest['settings'] == settings and manifest['vocabulary_hash'] == vocabulary_hash(vocabulary)
+            and old_matrices.shape == (len(parties), MAX_PARTY_SIZE, catalog.feature_count) and np.array_equal(old_codes, class_codes)):
+        changed = [class_index[class_name] for class_name in classes if manifest['class_hashes'].get(class_name) != hashes[class_name]]
+        reusable = ~np.isin(class_codes, changed).any(axis=1)
+
+    matrices = np.empty((len(parties), MAX_PARTY_SIZE, catalog.feature_count), dtype=np.float64)
+    if reusable.any():
+        matrices[reusable] = old_matrices[reusable]
+    todo = np.flatnonzero(~reusable)
+    print('Parties: ' + str(len(parties)) + ', reused: ' + str(int(reusable.sum())) + ', encoding: ' + str(len(todo)))
+    del old_matrices, old_codes  #release the memory map before the files are replaced
+
+    if len(todo) > 0:
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        tasks = [(class_files_path, [parties[j] for j in chunk]) for chunk in chunks]
+        if len(chunks) == 1:
+            results = map(encode_parties, tasks)
+        else:
+            pool = Pool(processes)
+            results = pool.imap(encode_parties, tasks)
+        for chunk, encoded in zip(chunks, results):
+            matrices[chunk] = encoded
+        if len(chunks) > 1:
+            pool.close()
+            pool.join()
+
+    save_array(output_path, 'matrices', matrices)
+    save_array(output_path, 'class_codes', class_codes)
+    save_array(output_path, 'indices', np.arange(len(parties), dtype=np.int64))
+    manifest = {'settings': settings, 'classes': classes, 'class_hashes': hashes,
+                'vocabulary': vocabulary, 'vocabulary_hash': vocabulary_hash(vocabulary)}
+    tmp_file = os.path.join(output_path, 'manifest.tmp.json')
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_file, os.path.join(output_path, 'manifest.json'))
+    return manifest
+
+
+class PartyData:
+    #Read only view on the generated folder, same keys as the old npz file
+    def __init__(self, output_path=OUTPUT_PATH):
+        with open(os.path.join(output_path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.matrices = np.load(os.path.join(output_path, 'matrices.npy'), mmap_mode='r')
+        self.class_codes = np.load(os.path.join(output_path, 'class_codes.npy'), mmap_mode='r')
+        self.indices = np.load(os.path.join(output_path, 'indices.npy'), mmap_mode='r')
+        self.class_names = ClassNames(self.class_codes, self.manifest['classes'])
+
+    def __getitem__(self, key):
+        return {'matrices': self.matrices, 'class_names': self.class_names, 'indices': self.indices}[key]
+
+
+class ClassNames:
+    #Decodes the class names of a party when it is accessed, like data['class_names'][idx]
+    def __init__(self, class_codes, classes):
+        self.class_codes = class_codes
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.class_codes)
+
+    def __getitem__(self, idx):
+        return [self.classes[code] for code in self.class_codes[idx] if code >= 0]
+
+    def __iter__(self):
+        for idx in range(0, len(self.class_codes)):
+            yield self[idx]
+
+
+def load_party_data(output_path=OUTPUT_PATH, legacy_file=LEGACY_FILE):
+    #The generated folder if it exists, otherwise the old pickled npz file
+    if os.path.exists(os.path.join(output_path, 'manifest.json')):
+        return PartyData(output_path)
+    if os.path.exists(legacy_file):
+        return np.load(legacy_file, allow_pickle=True)
+    raise FileNotFoundError(f"Missing party data: run generate_party_data.py to create {output_path}")
+
+if __name__ == '__main__':
+    generate_party_data()
@@ -0,0 +1,104 @@
+#Horde mode: identical monsters of one team fight as one group
+#Every member stays a full entity (own HP, death, tokens, can be targeted on its own),
+#but the group takes one turn per round: at the initiative slot of its first standing
+#member, one decision is made for everyone (the AI choice scores of that member) and, if
+#it is a weapon attack, all members resolve their attacks in that slot against a shared
+#target, a new one is only chosen when the target is down or out of reach.
+#Members with a condition, or a decision that is not a weapon attack (spells, breath, ...),
+#play their normal turn. Heroes choosing a target score one member per horde, the most
+#wounded one in reach, instead of every member.
+#
+#   DM.horde_min_size = 4   #groups of at least 4 identical monsters become hordes, 0 is off
+
+import re
+
+HORDE_MIN_SIZE = 4
+
+
+def horde_name(name):
+    #'Goblin 3' is a copy of 'Goblin' (the numbered duplicates of the Entities folder)
+    return re.sub(r' \d+$', '', name)
+
+def make_hordes(fight, min_size=HORDE_MIN_SIZE):
+    #Groups the identical monsters of the fight, returns the hordes. min_size 0: no hordes
+    groups = {}
+    for x in fight:
+        x.horde = None
+        if min_size > 0 and x.team != 0 and not x.is_summoned:
+            groups.setdefault((x.team, horde_name(x.orignial_name)), []).append(x)
+    return [Horde(members) for members in groups.values() if len(members) >= min_size]
+
+def representatives(targets):
+    #One target per horde (its most wounded member), the others are kept as they are
+    best = {}
+    for x in targets:
+        if x.horde is not None and (x.horde not in best or x.CHP < best[x.horde].CHP):
+            best[x.horde] = x
+    return [x for x in targets if x.horde is None or best[x.horde] is x]
+
+
+class Horde:
+    def __init__(self, members):
+        self.members = members
+        self.name = horde_name(members[0].orignial_name)
+        self.acted_round = None
+        self.target = None  #shared target of the running turn
+        for x in members:
+            x.horde = self
+
+    def standing(self):
+        return [x for x in self.members if x.state == 1]
+
+    def acts_now(self, player, round_number):
+        #The horde acts once per round, at the slot of its first standing member
+        standing = self.standing()
+        if self.acted_round == round_number or len(standing) == 0 or standing[0] is not player:
+            return False
+        self.acted_round = round_number
+        return True
+
+    def take_turn(self, fight):
+        members = self.standing()
+        for x in members:
+            x.start_of_turn()
+        leader = members[0]
+        DM = leader.DM
+        DM.say(self.name + ' horde (' + str(len(members)) + ') acts', True)
+        self.target = None
+        attack = self.wants_attack(leader, fight)
+        for x in members:
+            if x.state != 1:
+                continue  #died during the turn of the horde (attack of opportunity, ...)
+            if len(x.state_table.enemies_left(fight, x.team)) == 0:
+                break
+            if attack and self.can_follow(x):
+                self.attack_with(x, fight)
+            else:
+                x.AI.do_your_turn(fight)
+
+    def wants_attack(self, leader, fight):
+        #True if a weapon attack is the best choice of the leader
+        if not self.can_follow(leader):
+            return False
+        scores = [choice.score(fight) for choice in leader.AI.Choices]
+        best = leader.AI.Choices[scores.index(max(scores))]
+        return max(scores) > 0 and type(best).__name__ == 'do_attack'
+
+    def can_follow(self, x):
+        #members that need their own turn: conditions, shapes, concentration
+        return not (x.prone or x.restrained or x.is_stunned or x.is_paralyzed or x.is_incapacitated
+                    or x.is_shape_changed or x.is_concentrating)
+
+    def attack_with(self, x, fight):
+        #The weapon attacks of one member against the shared target
+        if x.action != 1:
+            return
+        target = self.target
+        while x.attack_counter > 0 and x.state == 1:
+            if target is None or target.state == -1 or target not in x.enemies_reachable_sort(fight):
+                target = x.AI.choose_att_target(fight)
+                if target == False:
+                    target = None
+                    break
+            x.make_normal_attack_on(target, fight)
+        self.target = target
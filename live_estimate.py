@@ -0,0 +1,147 @@
+#Live estimate for the DM page of the GUI
+#While the DM runs a real fight, the page sends the table as it is (fighters in initiative
+#order, their HP, concentration and whose turn it is) to a worker process. The worker plays
+#the rest of the fight from there (fight_state.py) in small batches and sends the win
+#probability of the heros and the expected rounds after every batch, so the readout gets
+#better while it runs. A newer table cancels the run of the old one.
+#
+#Every fighter is built from the data the page sends (an entity edited in the GUI plays with
+#its edited stats) and gets the HP, concentration and spell slots left of the page. The page
+#does not know the tokens and conditions of the real fight, the fighters start the rest of
+#the fight without any.
+#
+#   estimator = LiveEstimator()
+#   estimator.submit([('Fighter', 0, 30, False, None, None), ('Ogre', 1, 12, False, None, None)], turn=1)
+#   ...
+#   result = estimator.poll()   #None or the newest distributions, result['running'] until done
+
+from Entity_class import *
+from Dm_class import *
+from fight_state import state_from, play_continuations, outcome_distributions
+
+import multiprocessing
+import queue
+import time
+
+CONTINUATIONS = 1000  #most fights per table
+BATCH = 25            #fights between two readouts
+TIME_LIMIT = 1.5      #seconds per table
+
+
+def set_table_state(fighter, CHP, concentrating, spell_slots):
+    #HP, concentration and spell slots left from the DM page, a hero at 0 HP is unconscious,
+    #a monster dead. Tokens and conditions are reset by the long rest
+    fighter.long_rest()
+    if spell_slots is not None:
+        fighter.spell_slot_counter = list(spell_slots)
+    fighter.CHP = max(CHP, 0)
+    if CHP <= 0:
+        fighter.state = 0 if fighter.team == 0 else -1
+    fighter.is_concentrating = bool(concentrating)
+
+def estimator_worker(requests, results, latest, continuations, batch, time_limit):
+    #Runs in the worker process until None is sent
+    DM = DungeonMaster()
+    built = {}  #(name, team, n-th copy) -> (data, entity), built again if the data changes
+    while True:
+        request = requests.get()
+        try:
+            while True:
+                request = requests.get_nowait()  #only the newest table counts
+        except queue.Empty:
+            pass
+        if request is None:
+            break
+        generation, table, turn = request
+        if generation != latest.value:
+            continue
+        try:
+            estimate_table(DM, built, table, turn, generation, results, latest, continuations, batch, time_limit)
+        except Exception as e:
+            #any error ends this table only, the worker waits for the next one
+            built.clear()  #the fighters may be left in the middle of a fight
+            results.put((generation, {'error': repr(e), 'running': False}))
+
+def estimate_table(DM, built, table, turn, generation, results, latest, continuations, batch, time_limit):
+    #Plays continuations of one table and sends the distributions after every batch
+    fighters = []
+    for name, team, CHP, concentrating, data, spell_slots in table:
+        key = (name, team, sum(1 for x in table[0:len(fighters)] if x[0:2] == (name, team)))
+        if key not in built or built[key][0] != data:
+            built[key] = (data, entity(name, team, DM, external_json=data if data is not None else False))
+        fighters.append(built[key][1])
+        set_table_state(fighters[-1], CHP, concentrating, spell_slots)
+    state = state_from(fighters, turn=turn)
+    played = []
+    failures = []
+    seed = 0  #same table, same dice, the readout does not jump
+    start = time.time()
+    distributions = None
+    while len(played) + len(failures) < continuations and time.time() - start < time_limit:
+        if latest.value != generation:
+            return  #the table changed, this run is stale
+        played += play_continuations(state, range(seed, seed + batch), failures)
+        seed += batch
+        distributions = outcome_distributions(played, state, failures)
+        distributions['running'] = True
+        results.put((generation, distributions))
+    if distributions is not None and latest.value == generation:
+        distributions['running'] = False
+        results.put((generation, distributions))
+
+
+class LiveEstimator:
+    def __init__(self, continuations=CONTINUATIONS, batch=BATCH, time_limit=TIME_LIMIT):
+        #spawn: the worker must not inherit the Tk process
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.latest = context.Value('i', 0)
+        self.generation = 0
+        self.process = context.Process(target=estimator_worker, args=(self.requests, self.results, self.latest, continuations, batch, time_limit), daemon=True)
+        self.process.start()
+
+    def submit(self, table, turn=0):
+        #table: [(name, team, CHP, concentrating, data, spell slots left)] in initiative order,
+        #data and spell slots can be None (entity file, full slots), turn: index of the fighter
+        #whose turn it is. Older runs are cancelled
+        self.generation += 1
+        self.latest.value = self.generation
+        self.requests.put((self.generation, table, turn))
+
+    def poll(self):
+        #Newest distributions of the current table (fight_state.outcome_distributions plus
+        #'running'), None if nothing new came in. An error if the worker process is gone
+        newest = None
+        try:
+            while True:
+                generation, distributions = self.results.get_nowait()
+                if generation == self.generation:
+                    newest = distributions
+        except queue.Empty:
+            pass
+        if newest is None and not self.process.is_alive() and self.results.empty():
+            newest = {'error': 'The estimate process ended unexpectedly', 'running': False}
+        return newest
+
+    def close(self):
+        self.latest.value = -1
+        self.requests.put(None)
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+if __name__ == '__main__':
+    estimator = LiveEstimator()
+    estimator.submit([('Wizard Lv5', 0, 20, False, None, [2, 1, 0, 0, 0, 0, 0, 0, 0]), ('Rogue Lv5', 0, 38, False, None, None), ('Goblin', 1, 7, False, None, None), ('Young Dragon', 1, 60, False, None, None)], turn=0)
+    result = None
+    while result is None or result.get('running', False):
+        time.sleep(0.1)
+        result = estimator.poll() or result
+    estimator.close()
+    if 'error' in result:
+        print(result['error'])
+    else:
+        print('Win chance: ' + str(round(result['win_prob']*100, 1)) + '% in ' + str(result['continuations']) + ' fights')
+        print('Expected rounds: ' + str(round(result['rounds_mean'], 1)))
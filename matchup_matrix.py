@@ -0,0 +1,177 @@
+#Monster x party matchup matrix and empirical XP/CR of every monster
+#Every monster of Archive/ and BenchmarkEntities/ with a nominal XP (encounter_xp.exp_dict)
+#fights standard Lv5 parties built from Classes/, in groups of COUNTS copies. One cell = (monster, party, copies).
+#
+#Fights are spent adaptively (adaptive_schedule.py): every cell starts with initial_fights,
+#then more batches go to the cells whose win probability is still the most uncertain,
+#until every cell is below target_error or the budget is used. Every batch is appended to
+#a checkpoint file, a restarted job sums the checkpoint and continues.
+#
+#Fit: P(heroes win) = sigmoid(a - b * log(XP * copies * multiplier(copies) / party budget)).
+#a and b are fitted on the nominal XP of all monsters, then the XP of every monster is
+#shifted (with a prior that keeps it near the nominal XP) to fit its own cells best.
+#That shifted value is the effective XP, on the scale of the DMG.
+#
+#Output (folder matchup_matrix/): matrix.npz (wins, fights, team health sums per cell),
+#labels.json, checkpoint.jsonl and effective_cr.json.
+
+import numpy as np
+import itertools
+import random as rnd
+import glob
+import json
+import os
+import sys
+
+from simulation_worker import play_roster_batch
+from adaptive_schedule import read_checkpoint, run_adaptive
+from encounter_xp import exp_dict, multiplier, party_xp, xp_to_cr
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+MONSTER_FOLDERS = ['Archive', 'BenchmarkEntities']
+CLASSES_PATH = os.path.join(application_path, 'Classes')
+OUTPUT_PATH = os.path.join(application_path, 'matchup_matrix')
+COUNTS = [1, 2, 4, 8]
+
+
+#---------------Rosters---------------
+def load_monsters(folders=MONSTER_FOLDERS):
+    #monster id 'Folder/Name' -> (name, json data, nominal XP)
+    monsters = {}
+    for folder in folders:
+        for file_name in sorted(glob.glob(os.path.join(application_path, folder, '*.json'))):
+            with open(file_name) as f:
+                data = json.load(f)
+            if data.get('Hero_or_Villain', 0) != 1:
+                continue
+            name = os.path.basename(file_name)[:-5]
+            #the entity files have no CR ('Level' is not one, a Goblin is Level 1 but CR 1/4),
+            #only the monsters of exp_dict have a nominal XP to fit against
+            if name not in exp_dict:
+                continue
+            monsters[folder + '/' + name] = (name, data, exp_dict[name])
+    return monsters
+
+def load_classes(class_files_path=CLASSES_PATH):
+    classes = {}
+    for file_name in sorted(glob.glob(os.path.join(class_files_path, '*.json'))):
+        with open(file_name) as f:
+            classes[os.path.basename(file_name)[:-len(' Lv5.json')]] = json.load(f)
+    return classes
+
+def standard_parties(class_names, number_of_parties=12, size=4, seed=0):
+    #Reproducible sample of parties of different classes
+    rng = rnd.Random(seed)
+    combinations = list(itertools.combinations(sorted(class_names), size))
+    rng.shuffle(combinations)
+    return [list(party) for party in combinations[0:number_of_parties]]
+
+#---------------Fit---------------
+def newton_logistic(wins, fights, features, prior_sd, iterations=100):
+    #MAP logistic regression with a N(0, prior_sd^2) prior on every weight, rows with 0 fights are ignored
+    theta = np.zeros(features.shape[1])
+    for iteration in range(0, iterations):
+        p = 1/(1 + np.exp(-np.clip(features @ theta, -30, 30)))
+        gradient = features.T @ (wins - fights*p) - theta/prior_sd**2
+        hessian = (features*(fights*p*(1 - p))[:, None]).T @ features + np.diag(1/prior_sd**2)
+        step = np.clip(np.linalg.solve(hessian, gradient), -2, 2)  #damped, the cells can be separable
+        theta = theta + step
+        if np.max(np.abs(step)) < 1e-8:
+            break
+    return theta
+
+def fit_effective_xp(wins, fights, offsets, nominal_xp, prior_sd=1.0):
+    #wins, fights, offsets: [monsters, cells] arrays, offsets = log(copies*multiplier/party budget)
+    #1) P(win) = sigmoid(a - b*log(nominal XP) - b*offset), pooled over all monsters
+    #2) every monster gets a shift u of its log XP with a N(0, prior_sd^2) prior,
+    #   effective XP = nominal XP * exp(u). A monster that always loses or always wins
+    #   is moved only as far as its fights support.
+    log_nominal = np.log(np.maximum(nominal_xp, 1))
+    x = (log_nominal[:, None] + offsets).ravel()
+    a, minus_b = newton_logistic(wins.ravel(), fights.ravel(), np.stack([np.ones(len(x)), x], axis=1), np.array([100.0, 100.0]))
+    b = -minus_b
+    shifts = np.zeros(len(nominal_xp))
+    for m in range(0, len(nominal_xp)):
+        #logit = a - b*(log nominal + offset) - b*u, a single weight on the feature -b
+        base = a - b*(log_nominal[m] + offsets[m])
+        u = 0.0
+        for iteration in range(0, 100):
+            p = 1/(1 + np.exp(-np.clip(base - b*u, -30, 30)))
+            gradient = -b*np.sum(wins[m] - fights[m]*p) - u/prior_sd**2
+            hessian = b**2*np.sum(fights[m]*p*(1 - p)) + 1/prior_sd**2
+            step = float(np.clip(gradient/hessian, -1, 1))
+            u += step
+            if abs(step) < 1e-8:
+                break
+        shifts[m] = u
+    return np.exp(log_nominal + shifts), b
+
+def effective_cr(matrix, labels):
+    wins = matrix['wins'].reshape(len(labels['monsters']), -1)
+    fights = matrix['fights'].reshape(len(labels['monsters']), -1)
+    offsets = np.array([[np.log(copies*multiplier(copies)/party_xp(party)) for party in labels['parties'] for copies in labels['counts']]]*len(labels['monsters']))
+    nominal_xp = np.array(labels['nominal_xp'], dtype=float)
+    fitted = np.sum(fights, axis=1) > 0  #monsters whose cells all failed are left out
+    effective_xp, slope = fit_effective_xp(wins[fitted], fights[fitted], offsets[fitted], nominal_xp[fitted])
+    result = {'slope': float(slope), 'monsters': {}}
+    for monster, xp, nominal in zip(np.array(labels['monsters'])[fitted], effective_xp, nominal_xp[fitted]):
+        result['monsters'][str(monster)] = {'nominal_xp': float(nominal), 'effective_xp': float(xp), 'effective_cr': xp_to_cr(xp)}
+    return result
+
+
+#---------------Job---------------
+def build_matchup_matrix(output_path=OUTPUT_PATH, number_of_parties=12, party_size=4, counts=COUNTS,
+                         initial_fights=20, batch_fights=20, max_fights=200, target_error=0.05,
+                         budget=None, processes=None, seed=0, monster_folders=MONSTER_FOLDERS):
+    os.makedirs(output_path, exist_ok=True)
+    monsters = load_monsters(monster_folders)
+    classes = load_classes()
+    parties = standard_parties(list(classes.keys()), number_of_parties, party_size, seed)
+    labels = {'monsters': list(monsters.keys()), 'parties': parties, 'counts': list(counts),
+              'nominal_xp': [monsters[m][2] for m in monsters]}
+    cells = {}  #cell key -> (monster, party index, copies)
+    for m, p, copies in itertools.product(monsters, range(0, len(parties)), counts):
+        cells[m + '#' + '|'.join(parties[p]) + '#' + str(copies)] = (m, p, copies)
+
+    def roster_of_cell(cell_key):
+        m, p, copies = cells[cell_key]
+        name, data, nominal_xp = monsters[m]
+        return [(c + ' Lv5', 0, classes[c]) for c in parties[p]] + [(name, 1, data)]*copies
+
+    def task_of(cell_key, batch, fights):
+        return (cell_key, batch, fights, roster_of_cell(cell_key))
+
+    checkpoint_file = os.path.join(output_path, 'checkpoint.jsonl')
+    stats = read_checkpoint(checkpoint_file, cells)
+    run_adaptive(stats, task_of, play_roster_batch, checkpoint_file, initial_fights, batch_fights, max_fights,
+                 target_error, budget=budget, processes=processes)
+
+    shape = (len(monsters), len(parties), len(counts))
+    matrix = {name: np.zeros(shape) for name in ['wins', 'fights', 'team_health']}
+    failed = []
+    for cell_key, (m, p, copies) in cells.items():
+        index = (labels['monsters'].index(m), p, list(counts).index(copies))
+        for name in matrix:
+            matrix[name][index] = stats[cell_key][name]
+        if stats[cell_key]['failed']:
+            failed.append(cell_key)
+    np.savez(os.path.join(output_path, 'matrix.npz'), **matrix)
+    labels['failed_cells'] = failed
+    with open(os.path.join(output_path, 'labels.json'), 'w') as f:
+        json.dump(labels, f, indent=4)
+    result = effective_cr(matrix, labels)
+    with open(os.path.join(output_path, 'effective_cr.json'), 'w') as f:
+        json.dump(result, f, indent=4)
+    return matrix, labels, result
+
+def print_effective_cr(result):
+    for monster, values in sorted(result['monsters'].items(), key=lambda item: item[1]['effective_xp']):
+        print(monster + ' : ' + str(int(values['nominal_xp'])) + ' XP nominal, ' + str(int(values['effective_xp'])) + ' XP effective, CR ' + str(values['effective_cr']))
+
+if __name__ == '__main__':
+    matrix, labels, result = build_matchup_matrix()
+    print_effective_cr(result)
@@ -0,0 +1,186 @@
+#Calibration of the DMG XP multiplier table against simulated fights
+#Encounters are sampled over party sizes, enemy counts 1-15 and XP budgets (adjusted XP
+#from about Easy to far beyond Deadly), each encounter is one cell. Every cell gets
+#initial_fights, then more batches go to the cells whose win probability is the most
+#uncertain, until every cell is below target_error, the fight budget is used or the
+#time limit is reached (adaptive_schedule.py). Batches are appended to a checkpoint file:
+#a restarted job (or a longer second run) reuses every fight already played.
+#
+#Fit, for win probability and for team health left (one fit each):
+#   logit P = a - b * log(raw XP * M(party size, enemies) / party budget)
+#   M(size, n) = DMG multiplier(size, n) * exp(-g(size, n)/b)
+#a and b are shared by all cells, g is a correction of the DMG value with a prior
+#around 0. M(4, 1) = 1 is the reference, like in the DMG.
+#
+#Output (folder multiplier_calibration/): checkpoint.jsonl, cells.json and
+#calibrated_multipliers.json with the fitted tables and the goodness of fit of the
+#fitted and of the DMG table.
+
+import numpy as np
+import random as rnd
+import time
+import json
+import os
+import sys
+
+from simulation_worker import play_encounter_batch, warm_up, has_template
+from encounter_xp import exp_dict, party_size_multiplier, party_xp
+from matchup_matrix import newton_logistic
+from adaptive_schedule import read_checkpoint, run_adaptive
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+OUTPUT_PATH = os.path.join(application_path, 'multiplier_calibration')
+CLASSES = ['Artificer', 'Barbarian', 'Bard', 'Cleric', 'Druid', 'Fighter', 'Monk', 'Paladin', 'Ranger', 'Rogue', 'Sorcerer', 'Warlock', 'Wizard']
+PARTY_SIZES = [1, 2, 3, 4, 5, 6]
+ENEMY_COUNTS = list(range(1, 16))
+TARGETS = ['win', 'team_health']
+
+
+#---------------Encounters---------------
+def monster_pool():
+    #questionnaire monsters that can be loaded, sorted by XP
+    return sorted([name for name in exp_dict if has_template(name)], key=lambda name: exp_dict[name])
+
+def sample_encounter(rng, party_size, number_of_enemies, ratio, pool):
+    #ratio: adjusted XP (DMG table) / Deadly budget the encounter aims at
+    party = sorted(rng.sample(CLASSES, party_size))
+    target = ratio*party_xp(party)/party_size_multiplier(number_of_enemies, party_size)/number_of_enemies
+    distance = {name: abs(np.log(exp_dict[name]/target)) for name in pool}
+    candidates = [name for name in pool if distance[name] < 0.7] or [min(pool, key=lambda name: distance[name])]
+    enemies = sorted(rng.choice(candidates) for i in range(0, number_of_enemies))
+    return party, enemies
+
+def sample_cells(encounters_per_group=4, party_sizes=PARTY_SIZES, enemy_counts=ENEMY_COUNTS, ratio_range=(0.2, 3.0), seed=0):
+    #encounters_per_group encounters for every (party size, enemy count), the XP ratios
+    #of a group are spread evenly on a log scale with a random shift
+    rng = rnd.Random(seed)
+    pool = monster_pool()
+    cells = {}
+    for party_size in party_sizes:
+        for number_of_enemies in enemy_counts:
+            shift = rng.random()
+            for k in range(0, encounters_per_group):
+                u = (k + shift)/encounters_per_group
+                ratio = ratio_range[0]*(ratio_range[1]/ratio_range[0])**u
+                party, enemies = sample_encounter(rng, party_size, number_of_enemies, ratio, pool)
+                key = '|'.join(party) + '#' + '|'.join(enemies)
+                cells[key] = {'party': party, 'enemies': enemies}
+    return cells
+
+#---------------Fit---------------
+def design(cells, groups):
+    #features [1, log adjusted XP ratio with the DMG table, one hot of the (size, n) group]
+    x = np.array([np.log(cell['raw_xp']*party_size_multiplier(cell['enemy_count'], cell['party_size'])/cell['budget']) for cell in cells])
+    one_hot = np.zeros((len(cells), len(groups)))
+    for i, cell in enumerate(cells):
+        group = (cell['party_size'], cell['enemy_count'])
+        if group in groups:
+            one_hot[i, groups.index(group)] = 1.0
+    return np.concatenate([np.ones((len(cells), 1)), -x[:, None], one_hot], axis=1)
+
+def log_loss(successes, fights, p):
+    #mean binomial log loss per fight, team health is used as a fraction of success
+    p = np.clip(p, 1e-9, 1 - 1e-9)
+    return float(-np.sum(successes*np.log(p) + (fights - successes)*np.log(1 - p))/np.sum(fights))
+
+def goodness_of_fit(successes, fights, p):
+    observed = successes/np.maximum(fights, 1)
+    base = np.sum(successes)/np.sum(fights)
+    loss = log_loss(successes, fights, p)
+    return {
+        'log_loss': loss,
+        'pseudo_r2': 1 - loss/log_loss(successes, fights, np.full(len(p), base)),  #McFadden, against one constant
+        'rmse': float(np.sqrt(np.sum(fights*(observed - p)**2)/np.sum(fights))),  #fight weighted, per cell means
+    }
+
+def fit_multipliers(cells, successes, party_sizes, enemy_counts, prior_sd=1.0):
+    #cells: list of dicts with party_size, enemy_count, raw_xp, budget and fights
+    fights = np.array([cell['fights'] for cell in cells], dtype=float)
+    seen = set((cell['party_size'], cell['enemy_count']) for cell, n in zip(cells, fights) if n > 0)
+    groups = [group for group in sorted(seen) if group != (4, 1)]
+    features = design(cells, groups)
+    theta = newton_logistic(successes, fights, features, np.array([100.0, 100.0] + [prior_sd]*len(groups)))
+    a, b, g = theta[0], theta[1], dict(zip(groups, theta[2:]))
+    dmg_theta = newton_logistic(successes, fights, features[:, 0:2], np.array([100.0, 100.0]))
+    table = {}
+    for party_size in party_sizes:
+        table[party_size] = {}
+        for number_of_enemies in enemy_counts:
+            correction = g.get((party_size, number_of_enemies), 0.0)
+            table[party_size][number_of_enemies] = float(party_size_multiplier(number_of_enemies, party_size)*np.exp(-correction/b)) if b > 0 else None
+    return {
+        'intercept': float(a),
+        'slope': float(b),
+        'table': table,
+        'fitted_groups': len(groups) + (1 if (4, 1) in seen else 0),
+        'fit': goodness_of_fit(successes, fights, 1/(1 + np.exp(-np.clip(features @ theta, -30, 30)))),
+        'dmg_fit': goodness_of_fit(successes, fights, 1/(1 + np.exp(-np.clip(features[:, 0:2] @ dmg_theta, -30, 30)))),
+    }
+
+
+#---------------Job---------------
+def calibrate_multipliers(output_path=OUTPUT_PATH, encounters_per_group=4, party_sizes=PARTY_SIZES, enemy_counts=ENEMY_COUNTS,
+                          initial_fights=16, batch_fights=16, max_fights=160, target_error=0.07,
+                          budget=None, time_limit=3600, processes=None, seed=0):
+    #time_limit in seconds: no new batches are started after it, the fit uses what is done
+    start = time.time()
+    os.makedirs(output_path, exist_ok=True)
+    cells = sample_cells(encounters_per_group, party_sizes, enemy_counts, seed=seed)
+    print('Cells: ' + str(len(cells)))
+
+    checkpoint_file = os.path.join(output_path, 'checkpoint.jsonl')
+    stats = read_checkpoint(checkpoint_file, cells)
+    print('Fights in the checkpoint: ' + str(sum(cell['fights'] for cell in stats.values())))
+
+    def task_of(cell_key, batch, fights):
+        return (cell_key, batch, fights, cells[cell_key]['party'], cells[cell_key]['enemies'])
+
+    run_adaptive(stats, task_of, play_encounter_batch, checkpoint_file, initial_fights, batch_fights, max_fights,
+                 target_error, budget=budget, time_limit=time_limit - (time.time() - start), processes=processes, initializer=warm_up)
+
+    rows = []
+    for cell_key, cell in cells.items():
+        rows.append({
+            'party_size': len(cell['party']), 'enemy_count': len(cell['enemies']),
+            'party': cell['party'], 'enemies': cell['enemies'],
+            'raw_xp': sum(exp_dict[name] for name in cell['enemies']), 'budget': party_xp(cell['party']),
+            'fights': stats[cell_key]['fights'], 'wins': stats[cell_key]['wins'], 'team_health': stats[cell_key]['team_health'],
+            'failed': stats[cell_key]['failed'],
+        })
+    with open(os.path.join(output_path, 'cells.json'), 'w') as f:
+        json.dump(rows, f, indent=4)
+
+    fitted = [row for row in rows if row['fights'] > 0]
+    result = {
+        'fights': int(sum(row['fights'] for row in fitted)),
+        'cells': len(fitted),
+        'failed_cells': sum(1 for row in rows if row['failed']),
+        'seconds': round(time.time() - start, 1),
+    }
+    successes = {'win': np.array([row['wins'] for row in fitted]), 'team_health': np.array([row['team_health'] for row in fitted])}
+    for target in TARGETS:
+        result[target] = fit_multipliers(fitted, successes[target], party_sizes, enemy_counts)
+    with open(os.path.join(output_path, 'calibrated_multipliers.json'), 'w') as f:
+        json.dump(result, f, indent=4)
+    return result
+
+def load_calibrated_multipliers(path=os.path.join(OUTPUT_PATH, 'calibrated_multipliers.json'), target='win'):
+    #party size -> enemy count -> multiplier, json keys back to int
+    with open(path) as f:
+        table = json.load(f)[target]['table']
+    return {int(size): {int(n): m for n, m in row.items()} for size, row in table.items()}
+
+def print_calibration(result):
+    print('Fights: ' + str(result['fights']) + ' in ' + str(result['cells']) + ' cells, ' + str(result['seconds']) + ' s')
+    for target in TARGETS:
+        fit = result[target]
+        print(target + ': pseudo R2 ' + str(round(fit['fit']['pseudo_r2'], 3)) + ' (DMG table ' + str(round(fit['dmg_fit']['pseudo_r2'], 3)) + '), rmse ' + str(round(fit['fit']['rmse'], 3)) + ' (DMG table ' + str(round(fit['dmg_fit']['rmse'], 3)) + ')')
+        for party_size, row in fit['table'].items():
+            print('  party of ' + str(party_size) + ': ' + ' '.join(str(round(m, 2)) if m is not None else '-' for m in row.values()))
+
+if __name__ == '__main__':
+    print_calibration(calibrate_multipliers())
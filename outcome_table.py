@@ -0,0 +1,253 @@
+#Offline precomputed encounter outcomes for the questionnaire
+#The questionnaire only knows the Lv5 classes and the monsters in exp_dict, so the encounters
+#people actually build are few and predictable. This job simulates the common ones ahead of time
+#and stores the results in a sorted, memory mapped table that streamlit.py reads before it
+#falls back to a live simulation.
+#
+#Table layout (folder outcome_table/):
+#   keys.npy         uint64, sorted hash of (party, enemies), see encounter_key
+#   stats.npy        float32 [n, 5], same order and meaning as simulate.benchmark returns
+#   meta.json        repetitions, size and the coverage report of the last build
+#   checkpoint.jsonl one line per simulated pair, the job resumes from this file
+
+import numpy as np
+from multiprocessing import Pool
+from collections import Counter
+from datetime import datetime
+import random as rnd
+import hashlib
+import json
+import glob
+import os
+import sys
+
+from generate_party_data import load_party_data
+from encounter_xp import exp_dict, adjusted_enemy_xp, party_xp, enemy_names_from_options, MAX_ENEMIES
+
+STAT_NAMES = ['win_prob', 'rounds_num', 'dmg_player', 'death_num', 'team_health']
+REPETITIONS = 100  #simulate.benchmark always runs 100 fights
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+TABLE_PATH = os.path.join(application_path, 'outcome_table')
+HUMANS_PATH = os.path.join(application_path, 'Humans')
+PARTY_DATA_PATH = os.path.join(application_path, 'precomputed_party_data')
+
+
+def encounter_key(party, enemy_names):
+    """64 bit key of an encounter, independent of the order of party members and enemies."""
+    text = '|'.join(sorted(party)) + '#' + '|'.join(sorted(enemy_names))
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class OutcomeTable:
+    #Read only view on a compiled table, the arrays are memory mapped so every
+    #worker process shares the same pages and nothing is parsed at start up
+    def __init__(self, path=TABLE_PATH):
+        self.path = path
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.stats = np.zeros((0, len(STAT_NAMES)), dtype=np.float32)
+        self.meta = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(os.path.join(path, 'keys.npy')):
+            self.keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+            self.stats = np.load(os.path.join(path, 'stats.npy'), mmap_mode='r')
+            with open(os.path.join(path, 'meta.json')) as f:
+                self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, party, enemy_names):
+        #returns (win_prob, rounds_num, dmg_player, death_num, team_health) or None if not precomputed
+        if len(self.keys) > 0:
+            key = np.uint64(encounter_key(party, enemy_names))
+            i = int(np.searchsorted(self.keys, key))
+            if i < len(self.keys) and self.keys[i] == key:
+                self.hits += 1
+                return tuple(float(x) for x in self.stats[i])
+        self.misses += 1
+        return None
+
+    def hit_rate(self):
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits/(self.hits + self.misses)
+
+#---------------Planning the pairs to simulate---------------
+def load_human_encounters(humans_path=HUMANS_PATH):
+    #Returns a list of (party, enemies) tuples from the historical submissions
+    encounters = []
+    for file_name in sorted(glob.glob(os.path.join(humans_path, '*.json'))):
+        try:
+            with open(file_name) as f:
+                submissions = json.load(f)
+        except ValueError:
+            continue  #empty or broken file
+        if not isinstance(submissions, list):
+            continue
+        for submission in submissions:
+            enemies = enemy_names_from_options(submission.get('enemies', []))
+            party = submission.get('party', [])
+            if len(enemies) > 0 and len(party) > 0:
+                encounters.append((tuple(sorted(party)), tuple(sorted(enemies))))
+    return encounters
+
+def load_questionnaire_parties(party_data_path=PARTY_DATA_PATH):
+    #The parties the questionnaire can hand out
+    try:
+        data = load_party_data(party_data_path)
+    except FileNotFoundError:
+        return []
+    return [tuple(sorted(names)) for names in data['class_names']]
+
+def expand_by_xp(party, target_xps, number, rng, monster_weights, tolerance=0.15, samples=4000):
+    #Draws random enemy multisets and keeps the ones whose adjusted XP is closest to one of the targets
+    #Monsters are drawn with the weights of how often DMs picked them
+    names = list(monster_weights.keys())
+    weights = [monster_weights[name] for name in names]
+    candidates = {}
+    for i in range(0, samples):
+        count = rng.randint(1, MAX_ENEMIES)
+        enemies = tuple(sorted(rng.choices(names, weights=weights, k=count)))
+        xp = adjusted_enemy_xp(enemies)
+        distance = min(abs(xp - target)/target for target in target_xps)
+        if distance <= tolerance and (enemies not in candidates or candidates[enemies] > distance):
+            candidates[enemies] = distance
+    ranked = sorted(candidates, key=lambda enemies: (candidates[enemies], enemies))
+    return [(party, enemies) for enemies in ranked[0:number]]
+
+def plan_pairs(humans_path=HUMANS_PATH, party_data_path=PARTY_DATA_PATH, candidates_per_party=6, tolerance=0.15, seed=0):
+    #Seeds: every historical submission, ordered by how often it was seen
+    #Expansion: for every seeded party and every questionnaire party, the enemy
+    #multisets closest to the XP budgets the DMs aimed for
+    rng = rnd.Random(seed)
+    human_encounters = load_human_encounters(humans_path)
+    seed_counter = Counter(human_encounters)
+    pairs = [pair for pair, count in seed_counter.most_common()]
+
+    monster_weights = Counter({name: 1 for name in exp_dict})  #every monster can be drawn
+    for party, enemies in human_encounters:
+        monster_weights.update(enemies)
+
+    targets = {}
+    for party, enemies in human_encounters:
+        targets.setdefault(party, set()).add(adjusted_enemy_xp(enemies))
+    for party in load_questionnaire_parties(party_data_path):
+        targets.setdefault(party, set())
+    for party in targets:
+        targets[party].add(party_xp(party, 'deadly'))
+
+    for party in sorted(targets):
+        pairs += expand_by_xp(party, sorted(targets[party]), candidates_per_party, rng, monster_weights, tolerance)
+
+    #remove duplicates, keep the first (most important) position
+    planned = []
+    seen = set()
+    for party, enemies in pairs:
+        key = encounter_key(party, enemies)
+        if key not in seen:
+            seen.add(key)
+            planned.append((party, enemies))
+    return planned, human_encounters
+
+#---------------Simulation and Checkpoint---------------
+def simulate_pair(pair):
+    #Runs in the pool workers, one line of the checkpoint file per pair
+    from simulate import benchmark
+    party, enemies = pair
+    record = {'key': str(encounter_key(party, enemies)), 'party': list(party), 'enemies': list(enemies)}
+    try:
+        record['stats'] = [float(x) for x in benchmark(list(party), list(enemies))]
+    except Exception as e:
+        #engine errors are SimulationError (Error_class), the worker goes on with the next pair
+        record['error'] = repr(e)
+    return record
+
+def read_checkpoint(checkpoint_file):
+    records = {}
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as f:
+            for line in f:
+                line = line.strip()
+                if line == '':
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  #a line cut off by an interrupted run
+                records[int(record['key'])] = record
+    return records
+
+def compile_table(records, table_path=TABLE_PATH, meta=None):
+    #Writes the sorted arrays, the old table is replaced only after the new one is complete
+    good = [record for record in records.values() if 'stats' in record]
+    keys = np.array([int(record['key']) for record in good], dtype=np.uint64)
+    stats = np.array([record['stats'] for record in good], dtype=np.float32).reshape(len(good), len(STAT_NAMES))
+    order = np.argsort(keys)
+    for name, array in (('keys', keys[order]), ('stats', stats[order])):
+        tmp_file = os.path.join(table_path, name + '.tmp.npy')
+        np.save(tmp_file, array)
+        os.replace(tmp_file, os.path.join(table_path, name + '.npy'))
+    with open(os.path.join(table_path, 'meta.json'), 'w') as f:
+        json.dump(meta or {}, f, indent=4)
+
+def coverage_report(planned, records, human_encounters):
+    done = [pair for pair in planned if 'stats' in records.get(encounter_key(*pair), {})]
+    failed = [pair for pair in planned if 'error' in records.get(encounter_key(*pair), {})]
+    human_hits = sum(1 for pair in human_encounters if 'stats' in records.get(encounter_key(*pair), {}))
+    distinct_human = set(human_encounters)
+    distinct_hits = sum(1 for pair in distinct_human if 'stats' in records.get(encounter_key(*pair), {}))
+    return {
+        'planned_pairs': len(planned),
+        'simulated_pairs': len(done),
+        'failed_pairs': len(failed),
+        'coverage': len(done)/len(planned) if len(planned) > 0 else 0.0,
+        'human_submissions': len(human_encounters),
+        'human_hit_rate': human_hits/len(human_encounters) if len(human_encounters) > 0 else 0.0,
+        'distinct_human_hit_rate': distinct_hits/len(distinct_human) if len(distinct_human) > 0 else 0.0,
+        'failed_examples': sorted(set(records[encounter_key(*pair)]['error'] for pair in failed))[0:10]
+    }
+
+def build_outcome_table(table_path=TABLE_PATH, humans_path=HUMANS_PATH, party_data_path=PARTY_DATA_PATH,
+                        candidates_per_party=6, tolerance=0.15, processes=None, seed=0, max_pairs=None):
+    #Resumable: pairs already in the checkpoint file are not simulated again
+    #Interrupt at any time, rerun with the same arguments to continue
+    os.makedirs(table_path, exist_ok=True)
+    checkpoint_file = os.path.join(table_path, 'checkpoint.jsonl')
+
+    planned, human_encounters = plan_pairs(humans_path, party_data_path, candidates_per_party, tolerance, seed)
+    if max_pairs is not None:
+        planned = planned[0:max_pairs]
+    records = read_checkpoint(checkpoint_file)
+    pending = [pair for pair in planned if encounter_key(*pair) not in records]
+    print('Planned pairs: ' + str(len(planned)) + ', already done: ' + str(len(planned) - len(pending)))
+
+    if len(pending) > 0:
+        with Pool(processes) as pool, open(checkpoint_file, 'a') as checkpoint:
+            for i, record in enumerate(pool.imap_unordered(simulate_pair, pending)):
+                checkpoint.write(json.dumps(record) + '\n')
+                checkpoint.flush()
+                records[int(record['key'])] = record
+                print('Progress : ' + str(round((i+1)/len(pending)*100, 1)) + '%')
+
+    report = coverage_report(planned, records, human_encounters)
+    meta = {'repetitions': REPETITIONS, 'stat_names': STAT_NAMES,
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'report': report}
+    compile_table(records, table_path, meta)
+    return report
+
+def print_report(report):
+    print('Simulated ' + str(report['simulated_pairs']) + '/' + str(report['planned_pairs']) + ' planned pairs (' + str(round(report['coverage']*100, 1)) + ' %)')
+    print('Failed pairs: ' + str(report['failed_pairs']))
+    for error in report['failed_examples']:
+        print('    ' + error)
+    print('Hit rate on ' + str(report['human_submissions']) + ' historical submissions: ' + str(round(report['human_hit_rate']*100, 1)) + ' %')
+    print('Hit rate on distinct historical encounters: ' + str(round(report['distinct_human_hit_rate']*100, 1)) + ' %')
+
+if __name__ == '__main__':
+    print_report(build_outcome_table())
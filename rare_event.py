@@ -0,0 +1,127 @@
+#Rare event estimation of hero deaths and TPKs (importance sampling)
+#In an easy encounter deaths and TPKs happen so rarely that 100 plain fights
+#estimate them as 0. Here the DM tilts the d20 against the heros while the fights
+#are played: attacks on heros roll high, saves and death saves of heros roll low.
+#Every tilted roll multiplies the likelihood ratio of its fight by p(roll)/q(roll),
+#p the fair d20 and q the tilted one. The mean of ratio * outcome over the tilted
+#fights is an unbiased estimate of the outcome under fair dice.
+#
+#   q(k) ~ exp(theta * direction * k/20), k = 1..20
+#theta = 0 plays fair dice, larger theta makes deaths more common and the ratios smaller.
+
+from Encounter_Simulator import do_the_fighting, run_simulation, calculate_difficulty
+
+import numpy as np
+from bisect import bisect_right
+from simulation_context import random
+from math import exp
+
+
+class DiceTilt:
+    #Set as DM.dice_tilt, Entity.rollD20 and make_death_save call roll
+    def __init__(self, theta=1.0):
+        self.theta = theta
+        self.cdf = {}
+        self.log_ratio = {}
+        k = np.arange(1, 21)
+        for direction in (1, -1):
+            q = np.exp(theta*direction*k/20)
+            q = q/np.sum(q)
+            self.cdf[direction] = list(np.cumsum(q)[0:19])
+            self.log_ratio[direction] = list(np.log(1/20) - np.log(q))
+        self.start_fight()
+
+    def start_fight(self):
+        self.fight_log_ratio = 0.0
+        self.tilted_rolls = 0
+
+    def roll(self, direction):
+        #direction +1 rolls high, -1 rolls low
+        d20 = bisect_right(self.cdf[direction], random()) + 1
+        self.fight_log_ratio += self.log_ratio[direction][d20 - 1]
+        self.tilted_rolls += 1
+        return d20
+
+    def likelihood_ratio(self):
+        return exp(self.fight_log_ratio)
+
+
+def weighted_estimate(weights, values):
+    #Unbiased importance sampling mean and its standard error
+    samples = weights*values
+    n = len(samples)
+    error = np.std(samples, ddof=1)/np.sqrt(n) if n > 1 else float('nan')
+    return float(np.mean(samples)), float(error)
+
+def weighted_lower_tail_mean(weights, values, fraction=0.05):
+    #Mean of the lowest fraction of values under the fair dice (self normalized weights)
+    order = np.argsort(values, kind='stable')
+    w = weights[order]/np.sum(weights)
+    v = values[order]
+    taken = np.minimum(w, np.maximum(fraction - (np.cumsum(w) - w), 0))
+    return float(np.sum(taken*v)/np.sum(taken))
+
+def rare_event_simulation(repetition, fighters, theta=1.0):
+    #Plays repetition tilted fights and returns the reweighted estimates
+    DM = fighters[0].DM
+    heros = [fighter for fighter in fighters if fighter.team == 0]
+    tilt = DiceTilt(theta)
+    weights = np.zeros(repetition)
+    tpk = np.zeros(repetition)
+    hero_died = np.zeros((repetition, len(heros)))
+    DM.dice_tilt = tilt
+    try:
+        for i in range(0, repetition):
+            tilt.start_fight()
+            winner = do_the_fighting(fighters)[0]
+            weights[i] = tilt.likelihood_ratio()
+            tpk[i] = 1.0 if winner not in [0, None] else 0.0  #a fight stopped without a winner is no TPK
+            for j, hero in enumerate(heros):
+                if hero.state == -1:
+                    hero_died[i, j] = 1.0
+            for fighter in fighters:
+                fighter.long_rest()
+    finally:
+        DM.dice_tilt = None
+
+    death_number = np.sum(hero_died, axis=1)
+    return {
+        'fights': repetition,
+        'theta': theta,
+        'effective_sample_size': float(np.sum(weights)**2/np.sum(weights**2)),
+        'tpk': weighted_estimate(weights, tpk),
+        'death_probability': {hero.name: weighted_estimate(weights, hero_died[:, j]) for j, hero in enumerate(heros)},
+        'any_death': weighted_estimate(weights, (death_number > 0).astype(float)),
+        'mean_deaths': weighted_estimate(weights, death_number),
+        'min_deaths': weighted_lower_tail_mean(weights, death_number),
+        'weights': weights,
+        'death_number': death_number,
+    }
+
+def rare_event_difficulty(fighters, repetition=100, rare_repetition=200, theta=1.0):
+    #calculate_difficulty with TPK chance and death probabilities from the tilted fights,
+    #fight length, unconscious counts and team health from plain fights
+    names, damage_statistic_sorted, winner, rounds_number, deaths, unconscious, DeathNumber, TeamHealth = run_simulation(repetition, fighters)
+    estimates = rare_event_simulation(rare_repetition, fighters, theta)
+    DeathProbabilities = [estimate for estimate, error in estimates['death_probability'].values()]
+    #resample the death numbers with their weights, so the lowest 5 % follow the fair dice
+    p = estimates['weights']/np.sum(estimates['weights'])
+    ResampledDeaths = np.random.default_rng(0).choice(estimates['death_number'], size=max(repetition, rare_repetition), p=p)
+    Difficulty = calculate_difficulty(estimates['tpk'][0], np.mean(rounds_number), DeathProbabilities, unconscious, ResampledDeaths, TeamHealth)
+    return Difficulty, estimates
+
+def print_estimates(estimates):
+    def text(estimate):
+        return str(round(estimate[0]*100, 4)) + ' % +/- ' + str(round(estimate[1]*100, 4))
+    print('Fights: ' + str(estimates['fights']) + ', effective sample size: ' + str(round(estimates['effective_sample_size'], 1)))
+    print('TPK: ' + text(estimates['tpk']))
+    print('Any hero dies: ' + text(estimates['any_death']))
+    for name, estimate in estimates['death_probability'].items():
+        print(name + ' dies: ' + text(estimate))
+
+if __name__ == '__main__':
+    from simulation_worker import build_fighters
+    fighters = build_fighters(['Fighter', 'Rogue', 'Wizard', 'Cleric'], ['Ogre', 'Goblin', 'Goblin'])
+    Difficulty, estimates = rare_event_difficulty(fighters)
+    print_estimates(estimates)
+    print('Difficulty: ' + str(Difficulty))
@@ -1,30 +1,101 @@
 from Entity_class import *
 from Encounter_Simulator import *
 from Dm_class import DungeonMaster
+from simulation_context import SimulationContext, use_context
+import multiprocessing
+import queue
+import time
 import json
 
-def run_full_stat_recap():
-    #read out Informations for the simulation from json file
-    if getattr(sys, 'frozen', False):
-        application_path = os.path.dirname(sys.executable)
-    elif __file__:
-        application_path = os.path.dirname(__file__)
-    f = open(application_path + '/simulation_parameters.json')
-    data = json.load(f)
-    parameters = data['simulation_parameters']
-    Loaded_Entities = data['Entities']
-    f.close
+PROGRESS_INTERVAL = 0.2  #seconds between two progress messages of a RecapRun
+
+def run_full_stat_recap(parameters=None, Loaded_Entities=None, progress=True):
+    #parameters: {'printing_on': 0/1, 'repetitions': n}, Loaded_Entities: [{'name': .., 'team': ..}]
+    #an entity with 'data' (its json content) is built from it instead of its file
+    #Without them they are read from simulation_parameters.json (script mode)
+    #progress: see run_simulation
+    #Returns the result text of full_statistical_recap
+    if parameters is None:
+        #read out Informations for the simulation from json file
+        if getattr(sys, 'frozen', False):
+            application_path = os.path.dirname(sys.executable)
+        elif __file__:
+            application_path = os.path.dirname(__file__)
+        with open(application_path + '/simulation_parameters.json') as f:
+            data = json.load(f)
+        parameters = data['simulation_parameters']
+        Loaded_Entities = data['Entities']
 
+    #every run has its own context: dice, battlefield and statistics
+    context = SimulationContext()
     #initiate the DM and check the printing#
-    DM = DungeonMaster()
+    DM = DungeonMaster(context=context)
     if parameters['printing_on'] == 0:
         DM.block_print()
     else:
         DM.enable_print()
 
     #load the Entities for the fight
-    Fighters = [entity(player['name'], player['team'], DM) for player in Loaded_Entities]
-    full_statistical_recap(parameters['repetitions'], Fighters)
+    Fighters = [entity(player['name'], player['team'], DM, external_json=player.get('data', False)) for player in Loaded_Entities]
+    with use_context(context):
+        full_statistical_recap(parameters['repetitions'], Fighters, progress=progress)
+    return context.statistics['text_result']
+
+def recap_worker(parameters, Loaded_Entities, results, cancel):
+    #Runs in the process of a RecapRun: ('progress', done, total) while it runs, then
+    #('result', text) or ('error', text). A set cancel event stops it after the running fight,
+    #the result is then made from the fights played so far
+    last = [0.0]
+    def progress(done, total):
+        if time.time() - last[0] > PROGRESS_INTERVAL:
+            last[0] = time.time()
+            results.put(('progress', done, total))
+        return cancel.is_set()
+    try:
+        text_result = run_full_stat_recap(parameters, Loaded_Entities, progress=progress)
+    except Exception as e:
+        results.put(('error', repr(e)))
+        return
+    if not cancel.is_set():
+        results.put(('progress', parameters['repetitions'], parameters['repetitions']))
+    results.put(('result', text_result))
+
+
+class RecapRun:
+    #full_statistical_recap in its own process, for the GUI: the Tk loop polls it and stays free
+    #   run = RecapRun(parameters, [{'name': .., 'team': .., 'data': entity.data}, ...])
+    #   run.poll() -> list of messages of recap_worker, run.cancel()
+    def __init__(self, parameters, Loaded_Entities):
+        context = multiprocessing.get_context('spawn')  #the worker must not inherit the Tk process
+        self.results = context.Queue()
+        self.cancel_event = context.Event()
+        self.process = context.Process(target=recap_worker, args=(parameters, Loaded_Entities, self.results, self.cancel_event), daemon=True)
+        self.process.start()
+        self.finished = False
+
+    def poll(self):
+        messages = []
+        try:
+            while True:
+                messages.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        if any(message[0] in ['result', 'error'] for message in messages):
+            self.finished = True
+            self.process.join(timeout=1)
+        elif not self.process.is_alive() and self.results.empty():
+            messages.append(('error', 'The simulation process ended unexpectedly'))
+            self.finished = True
+        return messages
+
+    def cancel(self):
+        self.cancel_event.set()
 
 if __name__ == '__main__':
-    run_full_stat_recap()
\ No newline at end of file
+    text_result = run_full_stat_recap()
+    if getattr(sys, 'frozen', False):
+        application_path = os.path.dirname(sys.executable)
+    else:
+        application_path = os.path.dirname(os.path.abspath(__file__))
+    with open(application_path + '/simulation_result.txt', 'w') as f:  #script mode hands the result over as a file
+        f.write(text_result)
@@ -1,12 +1,19 @@
 from Entity_class import *
 from Encounter_Simulator import *
 from Dm_class import *
+from simulation_context import SimulationContext, use_context
 
 import numpy as np
 
-def benchmark(party, enemy_names, verbose=False):
-    """Simulates a combat encounter and returns a reward."""
-    DM = DungeonMaster()
+def benchmark(party, enemy_names, verbose=False, context=None):
+    """Simulates a combat encounter and returns a reward.
+
+    Every call runs in its own SimulationContext (or the one given), so concurrent calls
+    from several threads or sessions do not share dice, battlefield or results.
+    """
+    if context is None:
+        context = SimulationContext()
+    DM = DungeonMaster(context=context)
     DM.block_print()
 
     # Create entities dictionary
@@ -21,11 +28,39 @@ def benchmark(party, enemy_names, verbose=False):
     Fighters = [entity(Entities[i]['name'], Entities[i]['team'], DM, archive=True) for i in Entities]
 
     # Run simulation
-    text, win_probability, rounds_number, dmg_player, DeathNumber, TeamHealth = full_statistical_recap(100, Fighters)
+    with use_context(context):
+        text, win_probability, rounds_number, dmg_player, DeathNumber, TeamHealth = full_statistical_recap(100, Fighters, progress=verbose)
 
 
     return win_probability, np.mean(rounds_number), np.mean(dmg_player), np.mean(DeathNumber), np.mean(TeamHealth)
 
+def remote_benchmark(url, party, enemy_names, repetitions=100, timeout=120, fallback=True, log=None):
+    """Same result as benchmark, computed by the simulation service (Website/fastAPITest.py).
+
+    If the service cannot be reached, fails, sends a malformed answer or hit its time limit
+    before a single chunk of fights finished, there is no estimate: with fallback the
+    encounter is simulated here with benchmark, otherwise a RuntimeError is raised.
+    log: optional function that gets the reason of the fallback as text.
+    """
+    import requests
+    payload = {"party": list(party), "enemies": [enemy for enemy in enemy_names if enemy is not None], "repetitions": repetitions}
+    try:
+        response = requests.post(url.rstrip("/") + "/simulate", json=payload, timeout=timeout)
+        response.raise_for_status()
+        summary = response.json()
+        result = summary["estimate"]
+        if result is None:
+            error = f"The simulation service finished no fights ({summary['status']}), try a longer time limit"
+        else:
+            return result["win_prob"], result["rounds_num"], result["dmg_player"], result["death_num"], result["team_health"]
+    except (requests.RequestException, KeyError, ValueError, TypeError) as e:
+        error = f"The simulation service failed: {e!r}"
+    if not fallback:
+        raise RuntimeError(error)
+    if log is not None:
+        log(error + ", simulating locally")
+    return benchmark(party, enemy_names)
+
 if __name__ == "__main__":
     party = ["Fighter", "Rogue", "Wizard"]
     enemy_names = ["Goblin", "Ogre", "Pirate"]
@@ -0,0 +1,87 @@
+#Simulation context: everything one simulation owns, so that several simulations can run
+#at the same time in one process (threads of a server, tasks of an async executor)
+#   battlefield - the Battlefield.txt values (density), read once when the context is made
+#   rng - random.Random of this simulation, all dice of the engine use it
+#   log - list the DM writes its lines to instead of printing them (None: print)
+#   statistics - results of full_statistical_recap, instead of simulation_result.txt
+#
+#   context = SimulationContext(seed=1)
+#   DM = DungeonMaster(context=context)
+#   with use_context(context):
+#       full_statistical_recap(100, fighters)
+#
+#The engine modules take random and shuffle from here. Inside use_context they use the rng
+#of the context (a ContextVar, so every thread and every asyncio task sees its own), outside
+#they use the global random module as before, random.seed keeps working for old callers.
+
+import random as _random
+import numpy as np
+import contextvars
+import os
+import sys
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+_battlefield = None  #Battlefield.txt, read once per process
+_current = contextvars.ContextVar('simulation_context', default=None)
+
+
+def load_battlefield():
+    global _battlefield
+    if _battlefield is None:
+        _battlefield = np.genfromtxt(os.path.join(application_path, 'Battlefield.txt'), delimiter= ',')
+    return _battlefield
+
+class SimulationContext:
+    def __init__(self, seed=None, density=None, log=None):
+        self.battlefield = np.array(load_battlefield())
+        if density is not None:
+            self.battlefield[0][1] = density
+        self.rng = _random.Random(seed)
+        self.log = log
+        self.statistics = {}
+
+    @property
+    def density(self):
+        return self.battlefield[0][1]
+
+class use_context:
+    #with use_context(context): the dice of the engine in this thread/task come from context.rng
+    def __init__(self, context):
+        self.context = context
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current.set(self.context)
+        return self.context
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        return False
+
+def current_context():
+    return _current.get()
+
+def random():
+    context = _current.get()
+    if context is None:
+        return _random.random()
+    return context.rng.random()
+
+def fight_seed():
+    #Draws a seed from the dice and restarts the dice from it. A fight played right after is
+    #replayed by a new context with this seed (the fighters as they were before the fight)
+    context = _current.get()
+    rng = _random if context is None else context.rng
+    seed = rng.getrandbits(64)
+    rng.seed(seed)
+    return seed
+
+def shuffle(x):
+    context = _current.get()
+    if context is None:
+        return _random.shuffle(x)
+    return context.rng.shuffle(x)
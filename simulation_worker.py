@@ -0,0 +1,219 @@
+#Warm simulation workers
+#Every process keeps the entity files it has read in memory, so building the
+#fighters of an encounter does not touch the disk again. Used by the simulation
+#service in Website/ and by batch jobs that run fights on a process pool.
+
+from Entity_class import *
+from Encounter_Simulator import *
+from Dm_class import *
+from simulation_context import SimulationContext, use_context
+
+import numpy as np
+import random
+import hashlib
+import copy
+import time
+import glob
+import json
+import os
+import sys
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+_templates = {}  #(name, archive) -> content of the json file
+_dm = None       #one DungeonMaster per process, it is only read during a fight
+
+
+def load_template(name, archive=True):
+    key = (name, archive)
+    if key not in _templates:
+        folder = 'Archive' if archive else 'Entities'
+        with open(os.path.join(application_path, folder, str(name) + '.json')) as f:
+            _templates[key] = json.load(f)
+    return _templates[key]
+
+def has_template(name, archive=True):
+    folder = 'Archive' if archive else 'Entities'
+    return (name, archive) in _templates or os.path.exists(os.path.join(application_path, folder, str(name) + '.json'))
+
+def get_dm():
+    global _dm
+    if _dm is None:
+        _dm = DungeonMaster()
+        _dm.block_print()
+    return _dm
+
+def own_dm(context, settings=None):
+    #DM for one simulation: the settings of the process DM (density, fidelity, horde mode, ...)
+    #or the ones given (dm_settings of another DM), but its own fight state and context,
+    #changes do not reach other simulations
+    DM = copy.copy(get_dm())
+    DM.context = context
+    DM.block_print()
+    if settings is not None:
+        for name, value in settings.items():
+            setattr(DM, name, value)
+    return DM
+
+#DM attributes that configure the fights (not their state), see dm_settings
+DM_SETTINGS = ['density', 'horde_min_size', 'round_cap', 'stalemate_rounds', 'early_resolution', 'dice_tilt', 'fidelity'] + list(FIDELITY_LEVELS['full'])
+
+def dm_settings(DM):
+    #Picklable settings of a DM, own_dm(context, settings) plays with the same configuration
+    return {name: getattr(DM, name) for name in DM_SETTINGS}
+
+def warm_up(archive=True):
+    #Pool initializer: reads every entity of the folder and creates the DM
+    folder = 'Archive' if archive else 'Entities'
+    for file_name in glob.glob(os.path.join(application_path, folder, '*.json')):
+        try:
+            load_template(os.path.basename(file_name)[:-5], archive)
+        except ValueError:
+            pass  #broken file, fails when it is used
+    get_dm()
+
+def build_fighters(party, enemy_names, archive=True, DM=None):
+    #Same roster as simulate.benchmark: party members are 'X Lv5' in team 0, enemies in team 1
+    if DM is None:
+        DM = get_dm()
+    fighters = [entity(f"{member} Lv5", 0, DM, archive=archive, external_json=copy.deepcopy(load_template(f"{member} Lv5", archive))) for member in party]
+    fighters += [entity(enemy, 1, DM, archive=archive, external_json=copy.deepcopy(load_template(enemy, archive))) for enemy in enemy_names if enemy is not None]
+    return fighters
+
+def simulate_chunk(party, enemy_names, repetitions, seed=None, density=None, horde_min_size=None, fidelity=None, deadline=None):
+    #Runs repetitions fights and returns the sums needed to merge chunks:
+    #fights, wins, rounds, mean damage per fighter, hero deaths, team health left and the
+    #number of fights stopped by the round cap, as stalemate or resolved early
+    #density overrides the one of Battlefield.txt for these fights (0 loose, 1 normal, 2 dense)
+    #horde_min_size turns on horde mode for these fights (horde.py)
+    #fidelity: 'full', 'fast' or 'rough' decision paths for these fights (Dm_class.FIDELITY_LEVELS)
+    #deadline: time.time() after which no new fight is started, the chunk returns the fights
+    #played so far (a process pool cannot stop a task that is running)
+    #The chunk has its own context (dice) and DM (settings), chunks can run in threads
+    #A fight that raises a SimulationError is left out ('fights' counts the played ones) and
+    #listed in 'failures' with its own seed (run_simulation), the chunk seed and its index
+    if seed is None:
+        seed = random.getrandbits(64)
+    context = SimulationContext(seed=seed)
+    DM = own_dm(context)
+    if density is not None:
+        DM.density = density
+    if horde_min_size is not None:
+        DM.horde_min_size = horde_min_size
+    if fidelity is not None:
+        DM.set_fidelity(fidelity)
+    fighters = build_fighters(party, enemy_names, DM=DM)
+    outcomes = []
+    failures = []
+    progress = False
+    if deadline is not None:
+        progress = lambda done, total: time.time() > deadline
+    with use_context(context):
+        names, damage_statistic_sorted, winner, rounds_number, deaths, unconscious, DeathNumber, TeamHealth = run_simulation(repetitions, fighters, progress=progress, outcomes=outcomes, failures=failures)
+    dmg_per_fight = np.mean(np.array(damage_statistic_sorted, dtype=float), axis=0)  #mean over fighters, like benchmark
+    return {
+        'fights': len(winner),
+        'wins': int(sum(1 for i in winner if i == 0)),
+        'rounds': float(np.sum(rounds_number)),
+        'dmg_player': float(np.sum(dmg_per_fight)),
+        'death_num': float(np.sum(DeathNumber)),
+        'team_health': float(np.sum(TeamHealth)),
+        'round_cap': outcomes.count('round_cap'),
+        'stalemate': outcomes.count('stalemate'),
+        'resolved_early': outcomes.count('resolved_early'),
+        'failures': [dict(failure, chunk_seed=seed, party=list(party), enemies=list(enemy_names)) for failure in failures],
+    }
+
+def merge_chunks(total, chunk):
+    for key in chunk:
+        if key in total:
+            total[key] = total[key] + chunk[key]  #sums, failures are lists
+        else:
+            total[key] = chunk[key]
+    return total
+
+def estimate(total):
+    #Means of the merged chunks, same order as simulate.benchmark plus the standard error of win_prob
+    n = total.get('fights', 0)
+    if n == 0:
+        return None
+    win_prob = total['wins']/n
+    return {
+        'fights': n,
+        'win_prob': win_prob,
+        'win_prob_error': float(np.sqrt(win_prob*(1 - win_prob)/n)),
+        'rounds_num': total['rounds']/n,
+        'dmg_player': total['dmg_player']/n,
+        'death_num': total['death_num']/n,
+        'team_health': total['team_health']/n,
+        'round_cap_rate': total.get('round_cap', 0)/n,
+        'stalemate_rate': total.get('stalemate', 0)/n,
+        'resolved_early_rate': total.get('resolved_early', 0)/n,
+        'failed_fights': len(total.get('failures', [])),
+    }
+
+def play_seeded_roster(roster, seeds, failures=None, settings=None):
+    #roster: list of (name, team, json data). Plays one fight per seed, the dice of
+    #every fight only depend on its seed (common random numbers between rosters).
+    #Returns per fight: win of team 0 (1/0), team health left of team 0, dead heros, rounds
+    #failures: optional list, a fight that raises a SimulationError is recorded there
+    #({'seed', 'roster', 'error'}) and is NaN in the results, without it the error is raised
+    #settings: dm_settings of the DM whose configuration the fights use, default the process DM
+    context = SimulationContext()
+    DM = own_dm(context, settings)
+    fighters = [entity(name, team, DM, external_json=copy.deepcopy(data)) for name, team, data in roster]
+    TeamHP = sum(fighter.HP for fighter in fighters if fighter.team == 0)
+    results = {'win': np.zeros(len(seeds)), 'team_health': np.zeros(len(seeds)), 'deaths': np.zeros(len(seeds)), 'rounds': np.zeros(len(seeds))}
+    for k, seed in enumerate(seeds):
+        context.rng.seed(seed)
+        try:
+            with use_context(context):
+                winner, rounds_number = do_the_fighting(fighters)
+        except SimulationError as e:
+            if failures is None:
+                raise
+            failures.append({'seed': seed, 'roster': [name for name, team, data in roster], 'error': repr(e)})
+            for key in results:
+                results[key][k] = np.nan
+            for fighter in fighters:
+                fighter.release_summons()
+                fighter.long_rest()
+            continue
+        results['rounds'][k] = rounds_number
+        results['win'][k] = 1.0 if winner == 0 else 0.0
+        results['team_health'][k] = sum(fighter.CHP for fighter in fighters if fighter.team == 0)/TeamHP if TeamHP > 0 else 0.0
+        results['deaths'][k] = sum(1 for fighter in fighters if fighter.team == 0 and fighter.state == -1)
+        for fighter in fighters:
+            fighter.long_rest()
+    return results
+
+def cell_seed(cell_key, batch):
+    #Seed of a batch of fights of a cell (adaptive_schedule.py), the same on every machine and run
+    text = cell_key + '#' + str(batch)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=4).digest(), 'little')
+
+def play_roster_batch(task):
+    #Pool task: one batch of fights of a cell given as a roster (play_seeded_roster)
+    cell_key, batch, fights, roster = task
+    base = cell_seed(cell_key, batch)
+    failures = []  #fights that raised an engine error, they are nan in results and not counted
+    try:
+        results = play_seeded_roster(roster, [base + k for k in range(0, fights)], failures=failures)
+    except Exception as e:
+        return {'cell': cell_key, 'batch': batch, 'error': repr(e)}
+    return {'cell': cell_key, 'batch': batch, 'fights': fights - len(failures),
+            'wins': float(np.nansum(results['win'])), 'team_health': float(np.nansum(results['team_health'])),
+            'failures': failures}
+
+def play_encounter_batch(task):
+    #Pool task: one batch of fights of a cell given as party classes and enemy names (simulate_chunk)
+    cell_key, batch, fights, party, enemies = task
+    try:
+        chunk = simulate_chunk(party, enemies, fights, seed=cell_seed(cell_key, batch))
+    except Exception as e:
+        return {'cell': cell_key, 'batch': batch, 'error': repr(e)}
+    #fights that raised an engine error are not counted, they are listed in failures
+    return {'cell': cell_key, 'batch': batch, 'fights': chunk['fights'], 'wins': chunk['wins'], 'team_health': chunk['team_health'], 'failures': chunk['failures']}
@@ -3,11 +3,13 @@ import json
 import numpy as np
 import random as rnd
 import os
-import requests
-import base64
 import time
-import datetime  # New import for timestamp generation
-from simulate import benchmark
+from simulate import benchmark, remote_benchmark
+from encounter_xp import exp_dict, adjusted_enemy_xp, party_xp, enemy_names_from_options
+from outcome_table import OutcomeTable
+from class_catalog import get_class_catalog
+from generate_party_data import load_party_data
+from submission_store import SubmissionSink, GitHubRemote, DirectoryRemote, new_session_file_name
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -18,6 +20,7 @@ logging.basicConfig(level=logging.DEBUG)
 GIT_SECRET  = os.getenv("DB_TOKEN")  # Ensure this is properly set in your environment or Streamlit secrets
 GITHUB_REPO = "CarloRomeo427/DnD_Encounter_Balance_Tester/"
 GITHUB_BRANCH = "main"
+SIMULATION_SERVICE_URL = os.getenv("SIMULATION_SERVICE_URL")  # Optional, e.g. http://localhost:8000, otherwise fights run in this process
 # Note: The file path is now dynamic (unique per session)
 st.set_page_config(layout="wide", initial_sidebar_state="collapsed")
 
@@ -55,90 +58,35 @@ st.markdown(footer, unsafe_allow_html=True)
 
 
 
-def push_to_github(new_line_data):
-    """Writes new_line_data (a JSON string representing a dictionary) as an element of an array in a session-specific JSON file.
-    
-    If the file doesn't exist, it creates one with the data wrapped in an array.
-    If the file exists, it loads the current array, appends the new dictionary, and writes the updated array.
-    """
-    # Generate a unique file name for this session if it doesn't exist
-    if "git_filename" not in st.session_state:
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        random_int = rnd.randint(1000, 9999)
-        random_int_2 = rnd.randint(1000, 9999)
-        st.session_state.git_filename = f"user_selection_{timestamp}_{random_int}_{random_int_2}.json"
-    
-    file_name = st.session_state.git_filename
-    url = f"https://api.github.com/repos/CarloRomeo427/DnD_Encounter_Balance_Tester/contents/Humans/{file_name}"
-    headers = {
-        "Authorization": f"token {GIT_SECRET}",
-        "Accept": "application/vnd.github.v3+json",
-    }
-    
-    # Attempt to get the current remote file (if it exists)
-    get_response = requests.get(url, headers=headers)
-    if get_response.status_code == 200:
-        remote_data = get_response.json()
-        sha = remote_data.get("sha")
-        encoded_content = remote_data.get("content", "")
-        if encoded_content:
-            current_text = base64.b64decode(encoded_content).decode("utf-8")
-        else:
-            current_text = ""
-    else:
-        sha = None
-        current_text = ""
-    
-    # Initialize data_list as an array. If current_text exists, try to parse it.
-    if current_text.strip():
-        try:
-            data_list = json.loads(current_text)
-            # Ensure the content is a list
-            if not isinstance(data_list, list):
-                data_list = []
-        except Exception as e:
-            st.error(f"Error decoding current JSON content: {e}")
-            data_list = []
+@st.cache_resource
+def get_submission_sink():
+    """One local store and flusher thread per server process, shared by all sessions."""
+    if GIT_SECRET:
+        remote = GitHubRemote(GITHUB_REPO, GIT_SECRET, branch=GITHUB_BRANCH)
     else:
-        data_list = []
-    
-    # Parse the new_line_data (which should be a JSON string representing a dictionary)
-    try:
-        new_data = json.loads(new_line_data)
-    except Exception as e:
-        st.error(f"Error decoding new encounter data: {e}")
-        return None, {"error": str(e)}
-    
-    # Append the new data to the array
-    data_list.append(new_data)
-    
-    # Serialize the entire list as JSON (formatted with indentation for readability)
-    new_text = json.dumps(data_list, indent=4)
-    
-    # Encode the new content in Base64
-    content_b64 = base64.b64encode(new_text.encode("utf-8")).decode("utf-8")
-    
-    # Prepare the payload
-    data = {
-        "message": f"Updating session file {file_name} with new encounter data",
-        "content": content_b64,
-        "branch": GITHUB_BRANCH,
-    }
-    if sha:
-        data["sha"] = sha
+        remote = DirectoryRemote()  # No token: keep the session files in the local Humans/ folder
+    return SubmissionSink(remote)
 
-    # Update (or create) the file on GitHub
-    put_response = requests.put(url, headers=headers, json=data)
-    return put_response.status_code, put_response.json()
+def save_submission(encounter_data):
+    """Stores encounter_data locally and returns at once, the upload happens in the background."""
+    # Generate a unique file name for this session if it doesn't exist
+    if "git_filename" not in st.session_state:
+        st.session_state.git_filename = new_session_file_name()
+    return get_submission_sink().submit(st.session_state.git_filename, encounter_data)
 
 
 # --------------------- LOAD PRECOMPUTED DATA ---------------------
-DATA_FILE = "precomputed_party_data.npz"
-if not os.path.exists(DATA_FILE):
-    st.error(f"Missing data file: {DATA_FILE}. Run data generation first.")
+@st.cache_resource
+def get_party_data():
+    """Memory mapped party data, shared by all sessions of this server process."""
+    return load_party_data()
+
+try:
+    data = get_party_data()
+except FileNotFoundError as e:
+    st.error(f"{e}. Run data generation first.")
     st.stop()
 
-data = np.load(DATA_FILE, allow_pickle=True)
 precomputed_parties = data["matrices"]
 precomputed_class_names = data["class_names"]
 party_indices = list(data["indices"])
@@ -205,115 +153,28 @@ def generate_encounter():
     
 
 def extract_feature_constants(class_files_path):
-    numerical_features = [
-        "AC", "HP", "Proficiency", "To_Hit", "Attacks", "DMG",
-        "Str", "Dex", "Con", "Int", "Wis", "Cha",
-        "Spell_DC", "Spell_Mod", "Spell_Slot_1", "Spell_Slot_2", "Spell_Slot_3",
-        "Speed", "Range_Attack"
-    ]
-    cat_set_1 = ["Saves_Proficiency", "Damage_Type", "Position"]
-    cat_set_2 = ["Spell_List"]
-    cat_set_3 = ["Other_Abilities"]
-    categorical_features = cat_set_1 + cat_set_2 + cat_set_3
-
-    categorical_max_lengths = {feature: 0 for feature in categorical_features}
-    categorical_value_sets = {feature: set() for feature in categorical_features}
-
-    for file_name in os.listdir(class_files_path):
-        if file_name.endswith(".json"):
-            with open(os.path.join(class_files_path, file_name), "r") as f:
-                data = json.load(f)
-                for feature in categorical_features:
-                    values = str(data.get(feature, "")).split()
-                    categorical_max_lengths[feature] = max(categorical_max_lengths[feature], len(values))
-                    categorical_value_sets[feature].update(values)
-
-    num_feature_count = len(numerical_features)
-    cat_set_1_count = sum(categorical_max_lengths[f] for f in cat_set_1)
-    cat_set_2_count = sum(categorical_max_lengths[f] for f in cat_set_2)
-    cat_set_3_count = sum(categorical_max_lengths[f] for f in cat_set_3)
-
-    index_ranges = {
-        "numerical": (0, num_feature_count),
-        "cat_set_1": (num_feature_count, num_feature_count + cat_set_1_count),
-        "cat_set_2": (
-            num_feature_count + cat_set_1_count, 
-            num_feature_count + cat_set_1_count + cat_set_2_count
-        ),
-        "cat_set_3": (
-            num_feature_count + cat_set_1_count + cat_set_2_count,
-            num_feature_count + cat_set_1_count + cat_set_2_count + cat_set_3_count
-        )
-    }
-
-    return (
-        numerical_features, 
-        categorical_features, 
-        categorical_max_lengths, 
-        {key: list(values) for key, values in categorical_value_sets.items()}, 
-        index_ranges,
-        (cat_set_1, cat_set_2, cat_set_3)
-    )
+    return get_class_catalog(class_files_path).constants()
 
 def get_class_features(class_name, class_files_path):
-    (numerical_features, categorical_features, categorical_max_lengths,
-     categorical_value_sets, index_ranges, cat_sets) = extract_feature_constants(class_files_path)
-
-    file_name = f"{class_name} Lv5.json"
-    file_path = os.path.join(class_files_path, file_name)
-
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Class file not found: {file_name}")
-
-    with open(file_path, "r") as f:
-        data = json.load(f)
-
-    class_features = {}
-    for feature in numerical_features:
-        class_features[feature] = data.get(feature, 0)
-    for feature in categorical_features:
-        values = str(data.get(feature, "")).split()
-        valid_values = [val for val in values if val in categorical_value_sets[feature]]
-        class_features[feature] = valid_values if valid_values else ["Unknown"]
-
-    return class_features
+    return get_class_catalog(class_files_path).class_features(class_name)
 
 # --------------------- XP CALCULATIONS ---------------------
-MULTIPLIER_TABLE = {
-    1: 1.0,    # ✅ 1 → x1
-    2: 1.5,    # ✅ 2 → x1.5
-    3: 2.0,    # ✅ 3-6 → x2
-    4: 2.0,    # ✅
-    5: 2.0,    # ✅
-    6: 2.0,    # ✅
-    7: 2.5,    # ✅ 7-10 → x2.5
-    8: 2.5,    # ✅
-    9: 2.5,    # ✅
-    10: 2.5,   # ✅
-    11: 3.0,   # ✅ 11-14 → x3
-    12: 3.0,   # ✅
-    13: 3.0,   # ✅
-    14: 3.0,   # ✅
-    15: 4.0,   # ✅ 15+ → x4
-}
-exp_dict = {
-    "Ape": 100, "Boar": 50, "Brown Bear": 200, "Crocodile": 100, "Displayer Beast": 700,
-    "Fire Elemental": 1800, "Flameskull": 1100, "Giant Boar": 450, "Giant Centipede": 50,
-    "Giant Crocodile": 1800, "Giant Eagle": 200, "Giant Scorpion": 700, "Giant Spider": 200,
-    "Giant Wasp": 100, "Goblin": 50, "Night Hag": 1800, "Ogre": 450, "Pirate": 200,
-    "Polar Bear": 450, "Stone Giant": 2900, "Swarm of Bats": 50, "Vampire Spawn": 1800,
-    "Vampire": 10000, "Wolf": 50, "Young Dragon": 5900
-}
 enemy_options = ["None -> 0 XP"] + [f"{name} -> {xp} XP" for name, xp in exp_dict.items()]
 enemy_option_to_xp = {opt: xp for opt, xp in zip(enemy_options, [0] + list(exp_dict.values()))}
 
 def compute_enemy_exp(selected_options):
-    xp_values = [enemy_option_to_xp[o] for o in selected_options if enemy_option_to_xp[o] > 0]
-    return sum(xp_values) * MULTIPLIER_TABLE.get(len(xp_values), 4.0)
+    return adjusted_enemy_xp(enemy_names_from_options(selected_options))
 
 def calculate_party_exp(party, difficulty="deadly"):
-    EXP_THRESHOLDS = {"easy": 250, "medium": 500, "hard": 750, "deadly": 1100}
-    return EXP_THRESHOLDS[difficulty] * len(party)
+    return party_xp(party, difficulty)
+
+# --------------------- OUTCOME TABLE ---------------------
+@st.cache_resource
+def load_outcome_table():
+    """Precomputed encounter results, shared by all sessions of this server process."""
+    return OutcomeTable()
+
+outcome_table = load_outcome_table()
 
 # --------------------- UI ELEMENTS ---------------------
 st.title("🧙‍♂️ D&D Encounter Balance Tester 🐉")
@@ -328,7 +189,12 @@ if st.session_state.blocks:
             for enemy in encounter["enemies"]
             if enemy != enemy_options[0]
         ]
-        win_prob, rounds_num, dmg_player, death_num, team_health = benchmark(party, enemy_names, verbose=False)
+        outcome = outcome_table.lookup(party, enemy_names)
+        if outcome is None and SIMULATION_SERVICE_URL:
+            outcome = remote_benchmark(SIMULATION_SERVICE_URL, party, enemy_names, log=log_debug)
+        if outcome is None:
+            outcome = benchmark(party, enemy_names, verbose=False)
+        win_prob, rounds_num, dmg_player, death_num, team_health = outcome
         simulation_results.append({
             "win_prob": win_prob,
             "rounds_num": rounds_num,
@@ -336,6 +202,7 @@ if st.session_state.blocks:
             "death_num": death_num,
             "team_health": team_health
         })
+    log_debug(f"Outcome table hit rate: {outcome_table.hit_rate():.2f} ({len(outcome_table)} precomputed encounters)")
     wins = np.round(np.mean([r["win_prob"] for r in simulation_results]), 2)
     rounds = np.round(np.mean([r["rounds_num"] for r in simulation_results]), 2)
     dmg = np.round(np.mean([r["dmg_player"] for r in simulation_results]), 2)
@@ -540,18 +407,16 @@ else:
                         "enemies": selected_enemies,
                         "enemy_exp": enemy_total_exp
                     }
-                    new_line = json.dumps(encounter_data)
                     st.session_state.session_encounters.append(encounter_data)
-                    status, response = push_to_github(new_line)
+                    try:
+                        record_id = save_submission(encounter_data)
+                        st.success("✅ Decision saved!")
+                        print(f"✅ Decision saved as {record_id}")
+                    except OSError as e:
+                        st.error(f"❌ Failed to save data: {e}")
+                        print(f"❌ Failed to save data: {e}")
                     counter = st.session_state.counter
 
-                    if status in (200, 201):
-                        st.success("✅ Data successfully uploaded to GitHub!")
-                        print("✅ Data successfully uploaded to GitHub!")
-                    else:
-                        st.error(f"❌ Failed to upload data: {response}")
-                        print(f"❌ Failed to upload data: {response}")
-
                     # Clear all session state keys except 'counter' and 'git_filename' so the same session file is used
                     for key in list(st.session_state.keys()):
                         if key not in ["counter", "git_filename", "parties", "enemies", "session_encounters", "blocks", "start", "selected_expertise"]:
@@ -0,0 +1,262 @@
+#Submission sink for the questionnaire
+#A submission is appended to a local JSONL file and the call returns at once.
+#A background thread collects the pending records in batches and forwards them
+#to a remote (GitHub, or a local folder). Every record has an id, the remotes skip
+#ids they already have, so a batch can be sent again after a crash or a failed
+#request without creating duplicates (at-least-once delivery).
+#
+#Store layout (folder submissions/):
+#   records.jsonl    every submission, one JSON record per line, append only
+#   delivered.log    one record id per line, written after the remote confirmed it
+
+import threading
+import datetime
+import base64
+import uuid
+import json
+import time
+import os
+import sys
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+STORE_PATH = os.path.join(application_path, 'submissions')
+
+
+def new_session_file_name():
+    #Same naming as the files already in Humans/
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"user_selection_{timestamp}_{uuid.uuid4().int % 9000 + 1000}_{uuid.uuid4().int % 9000 + 1000}.json"
+
+
+class LocalStore:
+    #Append only record log plus the log of delivered ids
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.records_file = os.path.join(path, 'records.jsonl')
+        self.delivered_file = os.path.join(path, 'delivered.log')
+        self.lock = threading.Lock()
+
+    def append(self, session, data):
+        record = {
+            "id": uuid.uuid4().hex,
+            "session": session,
+            "created": datetime.datetime.now().isoformat(timespec='seconds'),
+            "data": data
+        }
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self.records_file, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        return record["id"]
+
+    def _read_lines(self, file_name):
+        if not os.path.exists(file_name):
+            return []
+        with open(file_name) as f:
+            return [line.strip() for line in f if line.strip() != '']
+
+    def _pending(self, limit=None):
+        delivered = set(self._read_lines(self.delivered_file))
+        records = []
+        for line in self._read_lines(self.records_file):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  #line cut off by a crash while writing
+            if record["id"] not in delivered:
+                records.append(record)
+                if limit is not None and len(records) >= limit:
+                    break
+        return records
+
+    def pending(self, limit=None):
+        #Records not yet confirmed by the remote, oldest first
+        with self.lock:
+            return self._pending(limit)
+
+    def mark_delivered(self, record_ids):
+        with self.lock:
+            with open(self.delivered_file, 'a') as f:
+                for record_id in record_ids:
+                    f.write(record_id + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def compact(self):
+        #Drops everything that is delivered, only called when nothing is pending
+        with self.lock:
+            if len(self._pending(1)) == 0:
+                open(self.records_file, 'w').close()
+                open(self.delivered_file, 'w').close()
+
+
+#---------------Remotes---------------
+#A remote gets all pending records of one session file at once and must
+#return True only when they are stored. Records it already has are skipped.
+
+def merge_records(current_list, records):
+    #Appends the record data to the list of the session file, skipping known ids
+    known_ids = set(entry.get("id") for entry in current_list if isinstance(entry, dict))
+    for record in records:
+        if record["id"] not in known_ids:
+            entry = dict(record["data"])
+            entry["id"] = record["id"]
+            current_list.append(entry)
+            known_ids.add(record["id"])
+    return current_list
+
+
+class DirectoryRemote:
+    #Writes the session files into a local folder, same format as Humans/
+    def __init__(self, path=os.path.join(application_path, 'Humans')):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def deliver(self, session, records):
+        file_name = os.path.join(self.path, session)
+        current_list = []
+        if os.path.exists(file_name):
+            try:
+                with open(file_name) as f:
+                    current_list = json.load(f)
+            except ValueError:
+                current_list = []
+            if not isinstance(current_list, list):
+                current_list = []
+        merge_records(current_list, records)
+        tmp_file = file_name + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(current_list, f, indent=4)
+        os.replace(tmp_file, file_name)
+        return True
+
+
+class GitHubRemote:
+    #One GET and one PUT per session file and batch, instead of per submission
+    def __init__(self, repo, token, branch="main", folder="Humans", timeout=20):
+        self.repo = repo.strip('/')
+        self.token = token
+        self.branch = branch
+        self.folder = folder
+        self.timeout = timeout
+
+    def deliver(self, session, records):
+        import requests
+        url = f"https://api.github.com/repos/{self.repo}/contents/{self.folder}/{session}"
+        headers = {
+            "Authorization": f"token {self.token}",
+            "Accept": "application/vnd.github.v3+json",
+        }
+        get_response = requests.get(url, headers=headers, params={"ref": self.branch}, timeout=self.timeout)
+        sha = None
+        current_list = []
+        if get_response.status_code == 200:
+            remote_data = get_response.json()
+            sha = remote_data.get("sha")
+            encoded_content = remote_data.get("content", "")
+            if encoded_content:
+                try:
+                    current_list = json.loads(base64.b64decode(encoded_content).decode("utf-8"))
+                except ValueError:
+                    current_list = []
+                if not isinstance(current_list, list):
+                    current_list = []
+        elif get_response.status_code != 404:
+            print(f"GitHub GET failed for {session}: {get_response.status_code}", flush=True)
+            return False
+
+        merge_records(current_list, records)
+        data = {
+            "message": f"Updating session file {session} with new encounter data",
+            "content": base64.b64encode(json.dumps(current_list, indent=4).encode("utf-8")).decode("utf-8"),
+            "branch": self.branch,
+        }
+        if sha:
+            data["sha"] = sha
+        put_response = requests.put(url, headers=headers, json=data, timeout=self.timeout)
+        if put_response.status_code not in (200, 201):
+            #409 means the file changed meanwhile, the next flush reads it again
+            print(f"GitHub PUT failed for {session}: {put_response.status_code}", flush=True)
+            return False
+        return True
+
+
+#---------------Sink and Flusher---------------
+class SubmissionSink:
+    #submit() only writes to the local store, the flusher thread talks to the remote
+    def __init__(self, remote, store=None, interval=10, batch_size=100, max_backoff=300):
+        self.store = store if store is not None else LocalStore()
+        self.remote = remote
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.wake_up = threading.Event()
+        self.stopped = threading.Event()
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name='SubmissionFlusher', daemon=True)
+        self.thread.start()
+
+    def submit(self, session, data):
+        record_id = self.store.append(session, data)
+        self.wake_up.set()
+        return record_id
+
+    def flush(self):
+        #Sends one batch, returns the number of delivered records
+        records = self.store.pending(self.batch_size)
+        sessions = {}
+        for record in records:
+            sessions.setdefault(record["session"], []).append(record)
+        delivered = 0
+        for session, session_records in sessions.items():
+            try:
+                ok = self.remote.deliver(session, session_records)
+                error = f"delivery of {session} failed"
+            except Exception as e:
+                ok = False
+                error = repr(e)
+            if not ok:
+                self.last_error = error
+                raise ConnectionError(error)
+            self.store.mark_delivered([record["id"] for record in session_records])
+            delivered += len(session_records)
+        if len(records) > 0 and len(self.store.pending(1)) == 0:
+            self.store.compact()
+        return delivered
+
+    def pending_count(self):
+        return len(self.store.pending())
+
+    def _run(self):
+        backoff = self.interval
+        while not self.stopped.is_set():
+            self.wake_up.wait(backoff)
+            self.wake_up.clear()
+            #give other submissions of the same moment the chance to join the batch
+            time.sleep(0.5)
+            try:
+                while self.flush() >= self.batch_size:
+                    pass
+                backoff = self.interval
+                self.last_error = None
+            except ConnectionError as e:
+                print(f"Submission flush failed, retrying later: {e}", flush=True)
+                backoff = min(backoff*2, self.max_backoff)
+
+    def close(self, timeout=30):
+        #Last attempt to deliver everything, records that fail stay in the store
+        self.stopped.set()
+        self.wake_up.set()
+        self.thread.join(timeout)
+        try:
+            while self.flush() > 0:
+                pass
+        except ConnectionError as e:
+            print(f"Undelivered submissions kept in {self.store.path}: {e}", flush=True)
@@ -0,0 +1,314 @@
+#Surrogate model: predicts win probability, rounds and team health of an encounter
+#without simulating it. Trained on simulated encounters, scoring thousands of
+#candidates is a few matrix products.
+#
+#Encoding: every entity (Lv5 class or monster) is its row of the NUMERICAL_FEATURES of
+#class_catalog plus an identity column. A side is the sum and the max of its rows
+#(count vectors x entity rows, so batches are vectorized): the sums of the identity
+#columns are the composition of the side (how many of every class or monster), the
+#rest are aggregates. Plus the XP of both sides and the damage race (HP of one side /
+#damage per round of the other).
+#
+#Model: one Bayesian ridge regression per target, on the logit of win probability and
+#team health and the log of the rounds. The predictive standard deviation combines the
+#uncertainty of the weights (large far from the training data) and the misfit of the
+#model on the training encounters. confident is False where the win probability is
+#unsure, the caller should simulate those encounters.
+#
+#Files (folder surrogate_model/): training.jsonl (one simulated encounter per line,
+#the generation resumes from it), model.npz and model.json.
+
+import numpy as np
+from multiprocessing import Pool
+import random as rnd
+import hashlib
+import json
+import os
+import sys
+
+from class_catalog import NUMERICAL_FEATURES
+from simulation_worker import simulate_chunk, warm_up, has_template
+from encounter_xp import exp_dict, multiplier, party_xp, EXP_THRESHOLDS
+from encounter_index import get_encounter_index
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+MODEL_PATH = os.path.join(application_path, 'surrogate_model')
+ARCHIVE_PATH = os.path.join(application_path, 'Archive')
+CLASSES = ['Artificer', 'Barbarian', 'Bard', 'Cleric', 'Druid', 'Fighter', 'Monk', 'Paladin', 'Ranger', 'Rogue', 'Sorcerer', 'Warlock', 'Wizard']
+MONSTERS = list(exp_dict.keys())
+TARGETS = ['win', 'rounds', 'team_health']
+
+
+#---------------Encoding---------------
+def entity_rows(names, suffix=''):
+    #[len(names), numerical features + identity], zeros for entities without a file
+    rows = np.zeros((len(names), len(NUMERICAL_FEATURES) + len(names)))
+    for i, name in enumerate(names):
+        file_name = os.path.join(ARCHIVE_PATH, name + suffix + '.json')
+        if os.path.exists(file_name):
+            with open(file_name) as f:
+                data = json.load(f)
+            rows[i, 0:len(NUMERICAL_FEATURES)] = [float(data.get(feature, 0)) for feature in NUMERICAL_FEATURES]
+        rows[i, len(NUMERICAL_FEATURES) + i] = 1.0
+    return rows
+
+_rows = None
+
+def rows_of_entities():
+    #(class rows, monster rows), read from the Archive the first time they are needed
+    global _rows
+    if _rows is None:
+        _rows = (entity_rows(CLASSES, ' Lv5'), entity_rows(MONSTERS))
+    return _rows
+
+MONSTER_XP = np.array([exp_dict[name] for name in MONSTERS], dtype=float)
+
+def counts(names_lists, vocabulary):
+    #[n, len(vocabulary)] how often every name is in every list
+    position = {name: i for i, name in enumerate(vocabulary)}
+    matrix = np.zeros((len(names_lists), len(vocabulary)))
+    for i, names in enumerate(names_lists):
+        for name in names:
+            matrix[i, position[name]] += 1
+    return matrix
+
+def enemy_counts_from_packed(index, packed):
+    #Bulk scoring of encounter_index rows without decoding them to names
+    slots = index.slots(packed)
+    matrix = np.zeros((len(packed), len(index.monsters) + 1))
+    np.add.at(matrix, (np.repeat(np.arange(len(packed)), slots.shape[1]), slots.ravel()), 1)
+    matrix = matrix[:, 1:]
+    return matrix[:, [index.monsters.index(name) for name in MONSTERS]]
+
+def side_features(count_matrix, rows):
+    present = (count_matrix > 0)[:, :, None]
+    maximum = np.max(np.where(present, rows[None, :, 0:len(NUMERICAL_FEATURES)], 0), axis=1)
+    return np.concatenate([count_matrix @ rows, maximum, np.sum(count_matrix, axis=1, keepdims=True)], axis=1)
+
+def encode(party_counts, enemy_counts):
+    #[n, features] of encounters given as count matrices over CLASSES and MONSTERS
+    class_rows, monster_rows = rows_of_entities()
+    enemy_number = np.sum(enemy_counts, axis=1)
+    adjusted_xp = (enemy_counts @ MONSTER_XP)*np.array([multiplier(int(n)) for n in enemy_number])
+    budget = EXP_THRESHOLDS['deadly']*np.sum(party_counts, axis=1)
+    xp = np.stack([np.log(np.maximum(adjusted_xp, 1)), np.log(np.maximum(budget, 1)), np.log(np.maximum(adjusted_xp, 1)/np.maximum(budget, 1))], axis=1)
+    #damage race: rounds each side needs to burn through the HP of the other, as logs
+    hp, attacks, dmg = [NUMERICAL_FEATURES.index(feature) for feature in ['HP', 'Attacks', 'DMG']]
+    party_hp, enemy_hp = party_counts @ class_rows[:, hp], enemy_counts @ monster_rows[:, hp]
+    party_dmg = party_counts @ (class_rows[:, attacks]*class_rows[:, dmg])
+    enemy_dmg = enemy_counts @ (monster_rows[:, attacks]*monster_rows[:, dmg])
+    race = np.stack([np.log(np.maximum(enemy_hp, 1)/np.maximum(party_dmg, 1)), np.log(np.maximum(party_hp, 1)/np.maximum(enemy_dmg, 1))], axis=1)
+    return np.concatenate([side_features(party_counts, class_rows), side_features(enemy_counts, monster_rows), xp, race, race[:, 0:1] - race[:, 1:2]], axis=1)
+
+def encode_encounters(parties, enemy_lists):
+    return encode(counts(parties, CLASSES), counts(enemy_lists, MONSTERS))
+
+
+#---------------Training data---------------
+def sample_encounter(rng, index, exclude, ratio_range=(0.2, 8.0), party_sizes=(1, 6)):
+    party = sorted(rng.sample(CLASSES, rng.randint(party_sizes[0], party_sizes[1])))
+    target = party_xp(party)*ratio_range[0]*(ratio_range[1]/ratio_range[0])**rng.random()
+    for width in [0.05, 0.2, 0.5]:
+        packed = index.query(target*(1 - width), target*(1 + width), exclude=exclude, max_distinct=3)
+        if len(packed) > 0:
+            return party, index.decode(packed[[rng.randrange(len(packed))]])[0]
+    return party, None
+
+def run_encounter(task):
+    #Pool task: fights of one encounter, errors are returned
+    key, party, enemies, fights = task
+    try:
+        chunk = simulate_chunk(party, enemies, fights, seed=key)
+    except Exception as e:
+        return {'key': key, 'party': party, 'enemies': enemies, 'error': repr(e)}
+    if chunk['fights'] == 0:
+        return {'key': key, 'party': party, 'enemies': enemies, 'error': chunk['failures'][0]['error']}
+    return {'key': key, 'party': party, 'enemies': enemies, 'fights': chunk['fights'], 'wins': chunk['wins'], 'rounds': chunk['rounds'], 'team_health': chunk['team_health'], 'failures': chunk['failures']}
+
+def read_training_data(model_path=MODEL_PATH):
+    records = []
+    training_file = os.path.join(model_path, 'training.jsonl')
+    if os.path.exists(training_file):
+        with open(training_file) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+def generate_training_data(model_path=MODEL_PATH, encounters=1500, fights=20, processes=None, seed=0):
+    #Simulates random encounters (random party, enemy team from the encounter index at a
+    #random XP ratio) until the training file has that many, returns all records
+    os.makedirs(model_path, exist_ok=True)
+    records = read_training_data(model_path)
+    done = set(record['key'] for record in records)
+    index = get_encounter_index()
+    exclude = [name for name in MONSTERS if not has_template(name)]
+    rng = rnd.Random(seed)
+    tasks = []
+    while len(tasks) + len(records) < encounters:
+        party, enemies = sample_encounter(rng, index, exclude)
+        if enemies is None:
+            continue
+        text = '|'.join(party) + '#' + '|'.join(enemies)
+        key = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=4).digest(), 'little')
+        if key not in done:
+            done.add(key)
+            tasks.append((key, party, enemies, fights))
+    print('Encounters to simulate: ' + str(len(tasks)))
+    pool = Pool(processes, initializer=warm_up) if processes != 1 else None
+    try:
+        results = pool.imap_unordered(run_encounter, tasks) if pool is not None else map(run_encounter, tasks)
+        with open(os.path.join(model_path, 'training.jsonl'), 'a') as f:
+            for i, record in enumerate(results):
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                records.append(record)
+                if (i + 1) % 100 == 0:
+                    print('Progress : ' + str(round((i+1)/len(tasks)*100, 1)) + '%')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return records
+
+
+#---------------Model---------------
+def targets_of(records):
+    #transformed targets and their weights (inverse variance of the transform)
+    n = np.array([record['fights'] for record in records], dtype=float)
+    result = {}
+    for target in ['win', 'team_health']:
+        #team health can end a little below 0, the engine lets the HP of dying heros go negative
+        successes = np.clip([record['wins' if target == 'win' else 'team_health'] for record in records], 0, n)
+        p = (successes + 0.5)/(n + 1)
+        result[target] = (np.log(p/(1 - p)), n*p*(1 - p))
+    rounds = np.array([record['rounds'] for record in records], dtype=float)/n
+    result['rounds'] = (np.log(np.maximum(rounds, 1)), n)
+    return result
+
+class Surrogate:
+    def __init__(self, mean, scale, weights, covariance, misfit, max_win_sd=0.1):
+        self.mean = mean              #feature standardization
+        self.scale = scale
+        self.weights = weights        #target -> weights, intercept last
+        self.covariance = covariance  #target -> posterior covariance of the weights
+        self.misfit = misfit          #target -> variance the model cannot explain
+        self.max_win_sd = max_win_sd
+
+    @staticmethod
+    def fit(features, records, ridge=1.0, max_win_sd=0.1):
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+        X = np.concatenate([(features - mean)/scale, np.ones((len(features), 1))], axis=1)
+        prior = np.full(X.shape[1], ridge)
+        prior[-1] = 1e-6  #the intercept is not shrunk
+        weights, covariance, misfit = {}, {}, {}
+        for target, (y, w) in targets_of(records).items():
+            precision = (X*w[:, None]).T @ X + np.diag(prior)
+            covariance[target] = np.linalg.inv(precision)
+            weights[target] = covariance[target] @ (X.T @ (w*y))
+            residual = y - X @ weights[target]
+            #excess of the residuals over the noise of the fights themselves
+            misfit[target] = float(max(np.sum(w*residual**2 - 1)/np.sum(w), 0.0))
+        return Surrogate(mean, scale, weights, covariance, misfit, max_win_sd)
+
+    def predict_features(self, features):
+        X = np.concatenate([(features - self.mean)/self.scale, np.ones((len(features), 1))], axis=1)
+        result = {}
+        for target in TARGETS:
+            value = X @ self.weights[target]
+            sd = np.sqrt(np.einsum('ij,jk,ik->i', X, self.covariance[target], X) + self.misfit[target])
+            #95 % interval mapped back from the logit (log for rounds), the sd is a quarter of it
+            inverse = np.exp if target == 'rounds' else (lambda v: 1/(1 + np.exp(-np.clip(v, -30, 30))))
+            result[target] = inverse(value)
+            result[target + '_low'] = inverse(value - 2*sd)
+            result[target + '_high'] = inverse(value + 2*sd)
+            result[target + '_sd'] = (result[target + '_high'] - result[target + '_low'])/4
+        result['confident'] = result['win_sd'] <= self.max_win_sd
+        return result
+
+    def predict(self, parties, enemy_lists):
+        #parties: lists of class names, enemy_lists: lists of monster names
+        return self.predict_features(encode_encounters(parties, enemy_lists))
+
+    def save(self, model_path=MODEL_PATH, report=None):
+        os.makedirs(model_path, exist_ok=True)
+        arrays = {'mean': self.mean, 'scale': self.scale}
+        for target in TARGETS:
+            arrays['weights_' + target] = self.weights[target]
+            arrays['covariance_' + target] = self.covariance[target]
+        np.savez(os.path.join(model_path, 'model.npz'), **arrays)
+        with open(os.path.join(model_path, 'model.json'), 'w') as f:
+            json.dump({'classes': CLASSES, 'monsters': MONSTERS, 'misfit': self.misfit, 'max_win_sd': self.max_win_sd, 'report': report}, f, indent=4)
+
+    @staticmethod
+    def load(model_path=MODEL_PATH):
+        with open(os.path.join(model_path, 'model.json')) as f:
+            meta = json.load(f)
+        if meta['classes'] != CLASSES or meta['monsters'] != MONSTERS:
+            raise ValueError('The surrogate model was trained on other classes or monsters, train it again')
+        arrays = np.load(os.path.join(model_path, 'model.npz'))
+        return Surrogate(arrays['mean'], arrays['scale'],
+                         {target: arrays['weights_' + target] for target in TARGETS},
+                         {target: arrays['covariance_' + target] for target in TARGETS},
+                         meta['misfit'], meta['max_win_sd'])
+
+def validation_report(surrogate, features, records):
+    #Error of the surrogate on held out encounters and how often they are inside the 95 % interval
+    prediction = surrogate.predict_features(features)
+    n = np.array([record['fights'] for record in records], dtype=float)
+    observed = {
+        'win': np.array([record['wins'] for record in records])/n,
+        'rounds': np.array([record['rounds'] for record in records])/n,
+        'team_health': np.clip(np.array([record['team_health'] for record in records])/n, 0, 1),
+    }
+    report = {}
+    for target in TARGETS:
+        low, high = prediction[target + '_low'], prediction[target + '_high']
+        if target != 'rounds':
+            #plus the noise of the n fights of the observed value
+            low = low - 2*np.sqrt(low*(1 - low)/n)
+            high = high + 2*np.sqrt(high*(1 - high)/n)
+        report[target] = {
+            'rmse': float(np.sqrt(np.mean((observed[target] - prediction[target])**2))),
+            'within_interval': float(np.mean((observed[target] >= low) & (observed[target] <= high))),
+        }
+    confident = prediction['confident']
+    report['confident_fraction'] = float(np.mean(confident))
+    report['confident_win_rmse'] = float(np.sqrt(np.mean((observed['win'] - prediction['win'])[confident]**2))) if np.any(confident) else None
+    return report
+
+def train_surrogate(model_path=MODEL_PATH, encounters=1500, fights=20, ridge=1.0, test_fraction=0.2, processes=None, seed=0):
+    records = [record for record in generate_training_data(model_path, encounters, fights, processes, seed) if 'error' not in record]
+    records = sorted(records, key=lambda record: record['key'])  #hash order, a fixed random split
+    test = records[0:int(len(records)*test_fraction)]
+    train = records[len(test):]
+    features = encode_encounters([r['party'] for r in train], [r['enemies'] for r in train])
+    report = validation_report(Surrogate.fit(features, train, ridge),
+                               encode_encounters([r['party'] for r in test], [r['enemies'] for r in test]), test)
+    report['train_encounters'] = len(train)
+    report['test_encounters'] = len(test)
+    #the saved model uses every encounter
+    surrogate = Surrogate.fit(encode_encounters([r['party'] for r in records], [r['enemies'] for r in records]), records, ridge)
+    surrogate.save(model_path, report)
+    return surrogate, report
+
+_surrogate = None
+
+def get_surrogate(model_path=MODEL_PATH):
+    #Cached per process, None if no model was trained
+    global _surrogate
+    if _surrogate is None and os.path.exists(os.path.join(model_path, 'model.npz')):
+        _surrogate = Surrogate.load(model_path)
+    return _surrogate
+
+if __name__ == '__main__':
+    surrogate, report = train_surrogate()
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,235 @@
+#Declarative parameter sweeps over encounter grids
+#A sweep spec names the axes of the grid and how a grid point becomes an encounter:
+#
+#   spec = {
+#       'name': 'goblins',
+#       'axes': {'goblins': list(range(1, 16)), 'party_size': [2, 3, 4, 5, 6], 'density': [0, 1, 2]},
+#       'party': ['Fighter', 'Rogue', 'Wizard', 'Cleric', 'Paladin', 'Ranger'],  #first party_size classes
+#       'enemies': {'Goblin': 'goblins'},  #monster -> axis name or a fixed number
+#       'repetitions': 100,
+#   }
+#
+#Special axes: 'party_size' (cuts spec['party']), 'party' (values are lists of classes),
+#'density' (overrides Battlefield.txt). Every other axis is used through spec['enemies'].
+#
+#Results go to sweeps/<name>/ as columnar part files (part_XXXXX.npz, no pickle), one
+#row per grid point. A restarted sweep skips the points already in the parts.
+#With refine=True the grid is first run on every coarse_step-th value of each axis,
+#then points are added between neighbours whose win probability differs most.
+#Every row also gets the win probability of the damage race (damage_race.py) and
+#race_flag = 1 where the simulation disagrees with it, a quick check for broken entities.
+
+import numpy as np
+from multiprocessing import Pool
+import itertools
+import hashlib
+import glob
+import json
+import os
+import sys
+
+from simulation_worker import simulate_chunk, estimate, warm_up
+from damage_race import race_win_probs, race_disagreement
+
+if getattr(sys, 'frozen', False):
+    application_path = os.path.dirname(sys.executable)
+else:
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+SWEEP_PATH = os.path.join(application_path, 'sweeps')
+STAT_COLUMNS = ['fights', 'win_prob', 'win_prob_error', 'rounds_num', 'dmg_player', 'death_num', 'team_health']
+
+
+#---------------Grid---------------
+def axis_values(spec):
+    return {axis: list(values) for axis, values in spec['axes'].items()}
+
+def encounter_of(point, spec):
+    #point: dict axis -> value. Returns party, enemy names and density of the grid point
+    if 'party' in point:
+        party = list(point['party'])
+    else:
+        party = list(spec.get('party', []))
+        if 'party_size' in point:
+            party = party[0:int(point['party_size'])]
+    enemies = []
+    for monster, count in spec.get('enemies', {}).items():
+        number = point[count] if isinstance(count, str) else count
+        enemies += [monster]*int(number)
+    density = point.get('density', spec.get('density'))
+    return party, enemies, density
+
+def point_key(point, spec):
+    #Same encounter and repetitions, same key, independent of the axis order
+    party, enemies, density = encounter_of(point, spec)
+    text = json.dumps([sorted(party), sorted(enemies), density, spec.get('repetitions', 100)])
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def grid_points(values, index_sets=None):
+    #index_sets: axis -> list of value positions, default all of them
+    axes = list(values.keys())
+    index_sets = index_sets or {axis: range(0, len(values[axis])) for axis in axes}
+    for indices in itertools.product(*[index_sets[axis] for axis in axes]):
+        yield dict(zip(axes, indices))
+
+def point_from_indices(indices, values):
+    return {axis: values[axis][i] for axis, i in indices.items()}
+
+
+#---------------Columnar results---------------
+def column_value(value):
+    if isinstance(value, (list, tuple)):
+        return '|'.join(str(v) for v in value)
+    return value
+
+def write_part(sweep_path, rows):
+    #One part file per flush, the parts together are the result table
+    if len(rows) == 0:
+        return
+    existing = glob.glob(os.path.join(sweep_path, 'part_*.npz'))
+    number = max([int(os.path.basename(name)[5:10]) for name in existing] + [-1]) + 1
+    columns = {}
+    for name in rows[0].keys():
+        values = [row[name] for row in rows]
+        if name == 'key':
+            columns[name] = np.array(values, dtype=np.uint64)
+        elif all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool) for v in values):
+            columns[name] = np.array(values, dtype=np.float64)
+        else:
+            columns[name] = np.array([str(v) for v in values])  #unicode column, loads without pickle
+    tmp_file = os.path.join(sweep_path, 'part_' + str(number).zfill(5) + '.tmp.npz')
+    np.savez(tmp_file, **columns)
+    os.replace(tmp_file, os.path.join(sweep_path, 'part_' + str(number).zfill(5) + '.npz'))
+
+def read_sweep(sweep_path):
+    #All parts as one dict of columns. A column that older parts do not have yet (written
+    #before it was added) is NaN in their rows, or '' for a text column
+    parts = [np.load(name) for name in sorted(glob.glob(os.path.join(sweep_path, 'part_*.npz')))]
+    if len(parts) == 0:
+        return {}
+    names = []
+    for part in parts:
+        names += [name for name in part.files if name not in names]
+    table = {}
+    for name in names:
+        kind = next(part[name].dtype.kind for part in parts if name in part.files)
+        fill = '' if kind == 'U' else np.nan
+        table[name] = np.concatenate([part[name] if name in part.files else np.full(len(part['key']), fill) for part in parts])
+    return table
+
+
+#---------------Scheduling---------------
+def run_point(task):
+    #Pool task, errors are returned so one broken entity does not stop the sweep
+    key, party, enemies, density, repetitions = task
+    try:
+        chunk = simulate_chunk(party, enemies, repetitions, seed=key, density=density)
+    except Exception as e:
+        return key, None, repr(e), []
+    if chunk['fights'] == 0:
+        return key, None, chunk['failures'][0]['error'], []
+    return key, estimate(chunk), None, chunk['failures']
+
+def run_points(points, spec, values, sweep_path, done, pool, flush_every):
+    #Simulates the given index points that are not done yet, results are written as they come
+    repetitions = spec.get('repetitions', 100)
+    todo = {}
+    for indices in points:
+        point = point_from_indices(indices, values)
+        key = point_key(point, spec)
+        if key not in done and key not in todo:
+            todo[key] = point
+    tasks = []
+    for key, point in todo.items():
+        party, enemies, density = encounter_of(point, spec)
+        tasks.append((key, party, enemies, density, repetitions))
+    race = dict(zip([task[0] for task in tasks], race_win_probs([task[1] for task in tasks], [task[2] for task in tasks])))
+
+    rows = []
+    errors = []
+    results = pool.imap_unordered(run_point, tasks) if pool is not None else map(run_point, tasks)
+    for i, (key, result, error, failures) in enumerate(results):
+        for failure in failures:  #single fights that raised an engine error, the point uses the others
+            errors.append({'key': str(key), 'point': {axis: column_value(v) for axis, v in todo[key].items()}, 'error': failure['error'], 'seed': str(failure['seed']), 'fight': failure['fight']})
+        if error is not None:
+            errors.append({'key': str(key), 'point': {axis: column_value(v) for axis, v in todo[key].items()}, 'error': error})
+            continue
+        row = {'key': key}
+        row.update({axis: column_value(v) for axis, v in todo[key].items()})
+        row.update({column: result[column] for column in STAT_COLUMNS})
+        row['race_win_prob'] = float(race[key])
+        row['race_flag'] = float(race_disagreement(result['win_prob'], race[key]))  #0 when the race is unknown (nan)
+        rows.append(row)
+        done[key] = result['win_prob']
+        if len(rows) >= flush_every:
+            write_part(sweep_path, rows)
+            rows = []
+        print('Progress : ' + str(round((i+1)/len(tasks)*100, 1)) + '%')
+    write_part(sweep_path, rows)
+    if len(errors) > 0:
+        with open(os.path.join(sweep_path, 'errors.jsonl'), 'a') as f:
+            for error in errors:
+                f.write(json.dumps(error) + '\n')
+    return len(tasks)
+
+def refinement_points(values, done_indices, win, threshold):
+    #Midpoints between computed neighbours along one axis whose win probability differs by more than threshold
+    new_points = []
+    for axis in values:
+        lines = {}
+        for indices in done_indices:
+            rest = tuple((a, i) for a, i in sorted(indices.items()) if a != axis)
+            lines.setdefault(rest, []).append(indices[axis])
+        for rest, positions in lines.items():
+            positions = sorted(set(positions))
+            for i, j in zip(positions[0:-1], positions[1:]):
+                if j - i > 1:
+                    a = dict(rest); a[axis] = i
+                    b = dict(rest); b[axis] = j
+                    if abs(win(a) - win(b)) > threshold:
+                        middle = dict(rest); middle[axis] = (i + j)//2
+                        new_points.append(middle)
+    return new_points
+
+def run_sweep(spec, sweep_path=None, processes=None, flush_every=20, refine=False, coarse_step=4, threshold=0.1, max_rounds=10):
+    sweep_path = sweep_path or os.path.join(SWEEP_PATH, spec.get('name', 'sweep'))
+    os.makedirs(sweep_path, exist_ok=True)
+    with open(os.path.join(sweep_path, 'spec.json'), 'w') as f:
+        json.dump(spec, f, indent=4, default=list)
+    values = axis_values(spec)
+
+    table = read_sweep(sweep_path)
+    done = dict(zip([int(k) for k in table.get('key', [])], table.get('win_prob', [])))
+    print('Points already computed: ' + str(len(done)))
+
+    pool = Pool(processes, initializer=warm_up) if processes != 1 else None
+    try:
+        if not refine:
+            run_points(list(grid_points(values)), spec, values, sweep_path, done, pool, flush_every)
+        else:
+            coarse = {axis: sorted(set(list(range(0, len(v), coarse_step)) + [len(v) - 1])) for axis, v in values.items()}
+            points = list(grid_points(values, coarse))
+            for round_number in range(0, max_rounds):
+                run_points(points, spec, values, sweep_path, done, pool, flush_every)
+                done_indices = [indices for indices in points if point_key(point_from_indices(indices, values), spec) in done]
+                win = lambda indices: done[point_key(point_from_indices(indices, values), spec)]
+                new_points = [p for p in refinement_points(values, done_indices, win, threshold) if p not in points]
+                if len(new_points) == 0:
+                    break
+                points += new_points
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return read_sweep(sweep_path)
+
+if __name__ == '__main__':
+    spec = {
+        'name': 'goblins',
+        'axes': {'goblins': list(range(1, 16)), 'party_size': [2, 3, 4, 5, 6], 'density': [0, 1, 2]},
+        'party': ['Fighter', 'Rogue', 'Wizard', 'Cleric', 'Paladin', 'Ranger'],
+        'enemies': {'Goblin': 'goblins'},
+        'repetitions': 100,
+    }
+    table = run_sweep(spec, refine=True)
+    print('Grid points in the table: ' + str(len(table.get('key', []))))